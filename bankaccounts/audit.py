@@ -0,0 +1,351 @@
+"""
+Export of the audit trail of accounts and sagas into columnar files, for
+loading into a data warehouse.
+
+The notification logs of the ``Accounts`` and ``Sagas`` process
+applications (or of the ``SimpleBankAccountApplication``) are read in
+chunks of notifications, and the transactions, recorded errors and saga
+outcomes of each chunk are written as tables, in Parquet files if pyarrow
+is installed, otherwise in NumPy ``.npz`` files. The position of each log
+is saved in a state file after each chunk, so exports resume where the
+last export stopped::
+
+    exporter = AuditExporter("audit", accounts=accounts, sagas=sagas)
+    report = exporter.export()
+
+Amounts are exported exactly, as integers in minor units of the currency
+(cents), with the scale of each amount, which is larger for amounts with more
+decimal places than the minor units.
+"""
+import json
+import os
+import time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from eventsourcing.application.simple import SimpleApplication
+from eventsourcing.domain.model.events import DomainEvent
+from eventsourcing.utils.topic import get_topic, resolve_topic
+
+from bankaccounts.domainmodel import BankAccount
+from bankaccounts.system.sagas import BaseSaga
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_MINOR_UNITS = 2
+STATE_FILENAME = "state.json"
+PARQUET = "parquet"
+NPZ = "npz"
+
+# Columns of each table, with their types.
+TABLES: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "transactions": (
+        ("notification_id", "int64"),
+        ("account_id", "string"),
+        ("version", "int64"),
+        ("timestamp_us", "int64"),
+        ("transaction_id", "string"),
+        ("amount_minor", "int64"),
+        ("amount_scale", "int64"),
+        ("is_single_pass", "bool"),
+    ),
+    "errors": (
+        ("notification_id", "int64"),
+        ("account_id", "string"),
+        ("version", "int64"),
+        ("timestamp_us", "int64"),
+        ("transaction_id", "string"),
+        ("error_code", "string"),
+    ),
+    "saga_outcomes": (
+        ("notification_id", "int64"),
+        ("transaction_id", "string"),
+        ("version", "int64"),
+        ("timestamp_us", "int64"),
+        ("saga_type", "string"),
+        ("outcome", "string"),
+        ("error_code", "string"),
+    ),
+}
+
+Row = Tuple[Any, ...]
+
+
+class AuditExportReport(NamedTuple):
+    num_notifications: int
+    num_rows: Dict[str, int]
+    paths: List[str]
+    positions: Dict[str, int]
+    elapsed: float
+
+    def summary(self) -> str:
+        return "{} notifications exported in {:.3f}s ({}), positions {}".format(
+            self.num_notifications,
+            self.elapsed,
+            ", ".join(
+                "{} {}".format(count, name) for name, count in self.num_rows.items()
+            ),
+            self.positions,
+        )
+
+
+def to_minor_units(
+    amount: Decimal, minor_units: int = DEFAULT_MINOR_UNITS
+) -> Tuple[int, int]:
+    """
+    Returns an amount exactly, as an integer and its scale (the amount is
+    the integer times ten to the minus scale). The scale is ``minor_units``,
+    unless the amount has more decimal places, which accounts accept.
+    """
+    scale = max(minor_units, -amount.normalize().as_tuple().exponent)
+    return int(amount.scaleb(scale)), scale
+
+
+def get_backend() -> str:
+    if pyarrow is not None:
+        return PARQUET
+    elif numpy is not None:
+        return NPZ
+    raise ImportError("Audit export requires pyarrow or numpy")
+
+
+def write_table(
+    path: str, columns: Tuple[Tuple[str, str], ...], rows: List[Row], backend: str
+) -> None:
+    """
+    Writes rows to a columnar file, atomically.
+    """
+    temp_path = path + ".tmp"
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    if backend == PARQUET:
+        types = {
+            "int64": pyarrow.int64,
+            "string": pyarrow.string,
+            "bool": pyarrow.bool_,
+        }
+        table = pyarrow.table(
+            {
+                name: pyarrow.array(column, type=types[type_name]())
+                for (name, type_name), column in zip(columns, values)
+            }
+        )
+        pyarrow.parquet.write_table(table, temp_path)
+    elif backend == NPZ:
+        arrays = {
+            name: numpy.array(column, dtype="U" if type_name == "string" else type_name)
+            for (name, type_name), column in zip(columns, values)
+        }
+        with open(temp_path, "wb") as f:
+            numpy.savez(f, **arrays)
+    else:
+        raise ValueError("Unsupported backend: {}".format(backend))
+    os.replace(temp_path, path)
+
+
+def read_table(path: str) -> Dict[str, list]:
+    """
+    Reads a file written by ``write_table()``, as lists of column values.
+    """
+    if path.endswith("." + PARQUET):
+        return pyarrow.parquet.read_table(path).to_pydict()
+    with numpy.load(path) as arrays:
+        return {name: arrays[name].tolist() for name in arrays.files}
+
+
+class AuditExporter(object):
+    """
+    Exports transactions and errors from the notification log of the
+    ``accounts`` application, and saga outcomes from the notification log
+    of the ``sagas`` application, into the output directory.
+
+    Each chunk of ``chunk_size`` notifications of a log is written as one
+    file per table, named by the table and the first notification ID of the
+    chunk, and then the position of the log is saved. If an export is
+    interrupted, the chunk is written again when the export resumes,
+    replacing the files.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        accounts: Optional[SimpleApplication] = None,
+        sagas: Optional[SimpleApplication] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        minor_units: int = DEFAULT_MINOR_UNITS,
+        backend: Optional[str] = None,
+    ):
+        assert chunk_size > 0, chunk_size
+        self.output_dir = output_dir
+        self.sources: Dict[str, SimpleApplication] = {}
+        if accounts is not None:
+            self.sources["accounts"] = accounts
+        if sagas is not None:
+            self.sources["sagas"] = sagas
+        self.chunk_size = chunk_size
+        self.minor_units = minor_units
+        self.backend = backend or get_backend()
+        self._row_functions: Dict[str, Optional[Tuple[str, Callable]]] = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.output_dir, STATE_FILENAME)
+
+    def get_positions(self) -> Dict[str, int]:
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_positions(self, positions: Dict[str, int]) -> None:
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(positions, f)
+        os.replace(temp_path, self.state_path)
+
+    def export(self) -> AuditExportReport:
+        """
+        Exports the notifications recorded since the last export.
+        """
+        started = time.time()
+        positions = self.get_positions()
+        num_notifications = 0
+        num_rows = {name: 0 for name in TABLES}
+        paths = []
+        for source_name, app in self.sources.items():
+            record_manager = app.event_store.record_manager
+            max_id = record_manager.get_max_notification_id()
+            position = positions.get(source_name, 0)
+            while position < max_id:
+                stop = min(position + self.chunk_size, max_id)
+                tables: Dict[str, List[Row]] = {}
+                for notification in record_manager.get_notifications(position, stop):
+                    num_notifications += 1
+                    row = self._get_row(app, notification)
+                    if row is not None:
+                        table_name, values = row
+                        tables.setdefault(table_name, []).append(values)
+                for table_name, rows in tables.items():
+                    path = os.path.join(
+                        self.output_dir,
+                        "{}-{}-{:012d}.{}".format(
+                            table_name, source_name, position + 1, self.backend
+                        ),
+                    )
+                    write_table(path, TABLES[table_name], rows, self.backend)
+                    num_rows[table_name] += len(rows)
+                    paths.append(path)
+                position = stop
+                positions[source_name] = position
+                self._save_positions(positions)
+        return AuditExportReport(
+            num_notifications=num_notifications,
+            num_rows=num_rows,
+            paths=paths,
+            positions=positions,
+            elapsed=time.time() - started,
+        )
+
+    def _get_row(
+        self, app: SimpleApplication, notification: Dict[str, Any]
+    ) -> Optional[Tuple[str, Row]]:
+        names = app.event_store.record_manager.field_names
+        topic = notification[names.topic]
+        try:
+            row_function = self._row_functions[topic]
+        except KeyError:
+            row_function = self._row_functions[topic] = self._get_row_function(topic)
+        if row_function is None:
+            # Other events aren't decoded.
+            return None
+        table_name, func = row_function
+        event = app.event_store.event_mapper.event_from_topic_and_state(
+            topic, notification[names.state]
+        )
+        return table_name, func(notification["id"], event)
+
+    def _get_row_function(self, topic: str) -> Optional[Tuple[str, Callable]]:
+        event_class = resolve_topic(topic)
+        if issubclass(event_class, BankAccount.TransactionAppended):
+            return "transactions", self._transaction_row
+        elif issubclass(event_class, BankAccount.ErrorRecorded):
+            return "errors", self._error_row
+        elif issubclass(event_class, (BaseSaga.Succeeded, BaseSaga.Errored)):
+            return "saga_outcomes", self._saga_outcome_row
+        return None
+
+    def _transaction_row(
+        self, notification_id: int, event: BankAccount.TransactionAppended
+    ) -> Row:
+        return (
+            notification_id,
+            str(event.originator_id),
+            event.originator_version,
+            _timestamp_us(event),
+            _str_or_empty(event.transaction_id),
+            *to_minor_units(event.amount, self.minor_units),
+            event.is_single_pass,
+        )
+
+    def _error_row(
+        self, notification_id: int, event: BankAccount.ErrorRecorded
+    ) -> Row:
+        # The error isn't constructed, unless it was recorded without a code.
+        error_code = event.__dict__.get("error_code") or _get_error_code(event.error)
+        return (
+            notification_id,
+            str(event.originator_id),
+            event.originator_version,
+            _timestamp_us(event),
+            _str_or_empty(event.transaction_id),
+            error_code,
+        )
+
+    def _saga_outcome_row(self, notification_id: int, event: DomainEvent) -> Row:
+        if isinstance(event, BaseSaga.Succeeded):
+            outcome, error_code = "succeeded", ""
+        else:
+            outcome, error_code = "errored", _get_error_code(event.error)
+        return (
+            notification_id,
+            str(event.originator_id),
+            event.originator_version,
+            _timestamp_us(event),
+            type(event).__qualname__.split(".")[0],
+            outcome,
+            error_code,
+        )
+
+
+def _timestamp_us(event: DomainEvent) -> int:
+    return int(Decimal(event.timestamp).scaleb(6))
+
+
+def _str_or_empty(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
+def _get_error_code(error: Optional[Exception]) -> str:
+    if error is None:
+        return ""
+    return getattr(error, "code", None) or get_topic(type(error))
+
+
+def iter_tables(output_dir: str, table_name: str) -> Iterator[Dict[str, list]]:
+    """
+    Reads the exported files of a table, in order of notification ID.
+    """
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.startswith(table_name + "-") and not filename.endswith(".tmp"):
+            yield read_table(os.path.join(output_dir, filename))
@@ -4,7 +4,12 @@ from uuid import UUID
 
 from eventsourcing.domain.model.aggregate import BaseAggregateRoot
 
-from bankaccounts.exceptions import AccountClosedError, InsufficientFundsError
+from bankaccounts.exceptions import (
+    AccountClosedError,
+    InsufficientFundsError,
+    TransactionError,
+    construct_error,
+)
 
 
 class BankAccount(BaseAggregateRoot):
@@ -14,12 +19,15 @@ class BankAccount(BaseAggregateRoot):
         self.overdraft_limit = Decimal("0.00")
         self.is_closed = False
 
-    def append_transaction(self, amount: Decimal, transaction_id: UUID = None) -> None:
+    def append_transaction(
+        self, amount: Decimal, transaction_id: UUID = None, is_single_pass=False
+    ) -> None:
         self.check_account_is_not_closed()
         self.check_has_sufficient_funds(amount)
-        self.__trigger_event__(
-            self.TransactionAppended, amount=amount, transaction_id=transaction_id
-        )
+        kwargs = {"amount": amount, "transaction_id": transaction_id}
+        if is_single_pass:
+            kwargs["is_single_pass"] = True
+        self.__trigger_event__(self.TransactionAppended, **kwargs)
 
     def check_account_is_not_closed(self) -> None:
         if self.is_closed:
@@ -34,6 +42,11 @@ class BankAccount(BaseAggregateRoot):
         def amount(self) -> Decimal:
             return self.__dict__["amount"]
 
+        @property
+        def is_single_pass(self) -> bool:
+            # Whether both sides of a transfer were appended together.
+            return self.__dict__.get("is_single_pass", False)
+
         def mutate(self, obj: "BankAccount") -> None:
             obj.balance += self.amount
 
@@ -58,11 +71,25 @@ class BankAccount(BaseAggregateRoot):
             obj.is_closed = True
 
     def record_error(self, error: Exception, transaction_id=None):
-        self.__trigger_event__(
-            self.ErrorRecorded, error=error, transaction_id=transaction_id
-        )
+        if isinstance(error, TransactionError):
+            # Record the error code, so the error is constructed when used.
+            self.__trigger_event__(
+                self.ErrorRecorded,
+                error_code=error.code,
+                error_args=list(error.args),
+                transaction_id=transaction_id,
+            )
+        else:
+            self.__trigger_event__(
+                self.ErrorRecorded, error=error, transaction_id=transaction_id
+            )
 
     class ErrorRecorded(BaseAggregateRoot.Event):
         @property
         def error(self):
-            return self.__dict__["error"]
+            try:
+                return self.__dict__["error"]
+            except KeyError:
+                return construct_error(
+                    self.__dict__["error_code"], self.__dict__["error_args"]
+                )
@@ -1,27 +1,95 @@
+from functools import lru_cache
+from typing import Any, Dict, Sequence, Type
+
 from eventsourcing.utils.topic import get_topic, resolve_topic
 from eventsourcing.utils.transcoding import decoder, encoder
 
+_error_classes: Dict[str, Type["TransactionError"]] = {}
+
+
+def register_error_class(cls: Type["TransactionError"]) -> None:
+    registered = _error_classes.get(cls.code)
+    if registered is not None and get_topic(registered) != get_topic(cls):
+        raise ValueError(
+            "Error code {} already used by {}".format(cls.code, get_topic(registered))
+        )
+    _error_classes[cls.code] = cls
+
 
 class TransactionError(Exception):
+    """
+    Base class for errors recorded by transactions.
+
+    Each class has a short code, which is used instead of its topic when
+    errors are encoded, and is registered. Subclasses that don't define a
+    code use their topic, and aren't registered, since they are found by
+    resolving the topic.
+    """
+
+    code = "transaction_error"
+
+    def __init_subclass__(cls, **kwargs: Any):
+        super().__init_subclass__(**kwargs)
+        if "code" not in cls.__dict__:
+            # Classes that are derived and renamed dynamically (Ray wraps
+            # errors raised by actors like this) would otherwise conflict
+            # with the registration of the class under its earlier name.
+            cls.code = get_topic(cls)
+        else:
+            register_error_class(cls)
+
     def __eq__(self, other):
         return self.args == other.args and type(self) == type(other)
 
 
+register_error_class(TransactionError)
+
+
 class AccountClosedError(TransactionError):
-    pass
+    code = "account_closed"
 
 
 class InsufficientFundsError(TransactionError):
-    pass
+    code = "insufficient_funds"
+
+
+class LockTimeoutError(Exception):
+    """
+    Raised when accounts can't be locked in time. This isn't a transaction
+    error, so it isn't recorded by accounts.
+    """
+
+
+def get_error_class(code: str) -> Type[TransactionError]:
+    try:
+        return _error_classes[code]
+    except KeyError:
+        # Codes of classes that haven't been imported yet are their topics.
+        return _resolve_topic(code)
+
+
+def construct_error(code: str, args: Sequence) -> TransactionError:
+    return get_error_class(code)(*args)
+
+
+@lru_cache(maxsize=None)
+def _resolve_topic(topic: str) -> Any:
+    return resolve_topic(topic)
 
 
 @encoder.register(TransactionError)
 def encode_exception(obj):
-    d = {"__exception__": {"__topic__": get_topic(type(obj)), "args": obj.args,}}
-    return d
+    return {"__error__": [obj.code, list(obj.args)]}
+
+
+@decoder.register("__error__")
+def decode_error(d):
+    code, args = d["__error__"]
+    return construct_error(code, args)
 
 
 @decoder.register("__exception__")
 def decode_exception(d):
-    exception_class = resolve_topic(d["__exception__"]["__topic__"])
+    # Errors recorded before error codes were introduced.
+    exception_class = _resolve_topic(d["__exception__"]["__topic__"])
     return exception_class(*d["__exception__"]["args"])
@@ -0,0 +1,855 @@
+"""
+File-backed infrastructure for single-node deployments.
+
+Events are stored in memory-mapped, append-only segment files, one directory
+per application, with an in-memory index of the offsets of the events of each
+aggregate. Use ``FileApplication`` wherever ``PopoApplication`` or
+``SQLAlchemyApplication`` are used. The directory is given by the ``path``
+argument or the environment variable FILE_STORE_PATH.
+"""
+import fcntl
+import mmap
+import os
+import shutil
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
+
+from eventsourcing.application.simple import ApplicationWithConcreteInfrastructure
+from eventsourcing.exceptions import RecordConflictError
+from eventsourcing.infrastructure.base import RecordManagerWithTracking, TrackingKwargs
+from eventsourcing.infrastructure.datastore import AbstractDatastore, DatastoreSettings
+from eventsourcing.infrastructure.factory import InfrastructureFactory
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Sync modes: flush each write before returning, flush concurrent writes
+# together before returning, or leave flushing to the operating system.
+SYNC_ALWAYS = "always"
+SYNC_GROUP = "group"
+SYNC_NONE = "none"
+DEFAULT_SYNC = SYNC_GROUP
+
+# A frame is a header (payload length, CRC-32 of payload) followed by the
+# payload. Each payload is a batch of event records written atomically,
+# optionally with a tracking record, or a tombstone of a deleted record.
+FRAME_HEADER = struct.Struct("<II")
+END_OF_SEGMENT = 0xFFFFFFFF
+BATCH_HEADER = struct.Struct("<IH")  # number of records, length of upstream name
+TRACKING = struct.Struct("<Q")  # upstream notification ID
+RECORD_HEADER = struct.Struct("<16sQHI")  # ID, version, topic length, state length
+IS_TOMBSTONE = 0xFFFF  # length of upstream name in the batch header of a tombstone
+TOMBSTONE = struct.Struct("<16sQ")  # ID, version
+
+# Index files of sealed segments.
+INDEX_HEADER = struct.Struct("<II")  # number of records, number of upstreams
+INDEX_ENTRY = struct.Struct("<16sQI")  # ID, version, offset in segment
+INDEX_TRACKING = struct.Struct("<QH")  # upstream notification ID, name length
+INDEX_TOMBSTONE = TOMBSTONE  # followed by tombstones, until the end of the file
+
+
+class Segment(object):
+    """
+    A preallocated segment file, mapped into memory.
+    """
+
+    def __init__(self, path: str, number: int, first_notification_id: int):
+        self.path = path
+        self.number = number
+        self.first_notification_id = first_notification_id
+        self.num_records = 0
+        self.tracking: Dict[str, int] = {}
+        self.tombstones: List[Tuple[bytes, int]] = []
+        self.end = 0
+        self.is_sealed = False
+        self.file = open(path, "r+b")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+
+    @property
+    def index_path(self) -> str:
+        return self.path[: -len(".log")] + ".idx"
+
+    def flush(self, start: int, stop: int) -> None:
+        start -= start % mmap.PAGESIZE
+        self.map.flush(start, stop - start)
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+
+def segment_path(path: str, number: int) -> str:
+    return os.path.join(path, "segment-{:08d}.log".format(number))
+
+
+class SegmentStore(object):
+    """
+    Event records of one application, in append-only segment files.
+
+    Writes are serialised between processes with a lock file, and each
+    process follows the writes of others by reading new frames at the
+    end of the last segment. Frames are written before their headers,
+    so incomplete frames aren't read. When a segment is full, it is
+    sealed and its index is written, so that recovery only needs to
+    scan the last segment.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        sync: str = DEFAULT_SYNC,
+    ):
+        assert sync in (SYNC_ALWAYS, SYNC_GROUP, SYNC_NONE), sync
+        self.path = path
+        self.segment_size = segment_size
+        self.sync = sync
+        self.is_closed = False
+        # A store is only used by the process that opened it, since the
+        # locks and flusher thread of a store aren't usable in a forked child.
+        self.pid = os.getpid()
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, "lock"), "a+b")
+        self._lock = threading.RLock()
+        self._segments: List[Segment] = []
+        self._locations: List[Tuple[Segment, int, UUID]] = []
+        self._originator_ids: Dict[bytes, UUID] = {}
+        self._sequences: Dict[UUID, List[int]] = {}
+        self._tracking: Dict[str, int] = {}
+        self._deleted: Set[int] = set()
+        self._dirty: Dict[Segment, Tuple[int, int]] = {}
+        self._flush_lock = threading.Lock()
+        self._sync_condition = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._flusher: Optional[threading.Thread] = None
+        with self._lock:
+            self._refresh()
+
+    def append(
+        self,
+        records: Sequence[Tuple[UUID, int, str, bytes]],
+        tracking: Optional[Tuple[str, int]] = None,
+    ) -> int:
+        """
+        Writes records, and optionally a tracking record, atomically.
+
+        Returns the notification ID of the first record.
+        """
+        with self._lock:
+            self._check_not_closed()
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh(repair=True)
+                self._check_conflicts(records, tracking)
+                first_notification_id = len(self._locations) + 1
+                written = self._write_frame(self._encode_batch(records, tracking))
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        if self.sync == SYNC_GROUP:
+            self._wait_for_flush(written)
+        return first_notification_id
+
+    def delete(self, originator_id: UUID, version: int) -> None:
+        """
+        Writes a tombstone of a record, after which the record isn't read.
+        The record stays in its segment, and its version isn't reused.
+        """
+        with self._lock:
+            self._check_not_closed()
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh(repair=True)
+                notification_ids = self._sequences.get(originator_id, [])
+                if version >= len(notification_ids):
+                    return
+                if notification_ids[version] in self._deleted:
+                    return
+                written = self._write_frame(
+                    BATCH_HEADER.pack(0, IS_TOMBSTONE)
+                    + TOMBSTONE.pack(originator_id.bytes, version)
+                )
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        if self.sync == SYNC_GROUP:
+            self._wait_for_flush(written)
+
+    def get_notification_ids(
+        self, originator_id: UUID, start: int = 0, stop: Optional[int] = None
+    ) -> List[int]:
+        with self._lock:
+            self._refresh()
+            notification_ids = self._sequences.get(originator_id, [])[start:stop]
+            if self._deleted:
+                notification_ids = [
+                    i for i in notification_ids if i not in self._deleted
+                ]
+            return notification_ids
+
+    def read(self, notification_ids: Iterable[int]) -> List[Tuple]:
+        """
+        Returns (ID, version, topic, state, notification ID) of the given
+        notifications, except deleted notifications.
+        """
+        with self._lock:
+            self._refresh()
+            return [self._read(i) for i in notification_ids if i not in self._deleted]
+
+    def max_notification_id(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._locations)
+
+    def max_tracking_id(self, upstream_name: str) -> int:
+        with self._lock:
+            self._refresh()
+            return self._tracking.get(upstream_name, 0)
+
+    def originator_ids(self) -> List[UUID]:
+        with self._lock:
+            self._refresh()
+            return list(self._sequences)
+
+    def close(self) -> None:
+        with self._lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+            if self.pid != os.getpid():
+                # The parent process closes the store.
+                return
+        with self._sync_condition:
+            self._sync_condition.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock, self._flush_lock:
+            if self.sync != SYNC_NONE:
+                self._flush()
+            for segment in self._segments:
+                segment.close()
+            self._lock_file.close()
+
+    def _check_not_closed(self) -> None:
+        if self.is_closed:
+            raise ValueError("Segment store is closed: {}".format(self.path))
+        if self.pid != os.getpid():
+            raise ValueError(
+                "Segment store was opened by process {}: {}".format(
+                    self.pid, self.path
+                )
+            )
+
+    @property
+    def is_usable(self) -> bool:
+        return not self.is_closed and self.pid == os.getpid()
+
+    def _check_conflicts(
+        self,
+        records: Sequence[Tuple[UUID, int, str, bytes]],
+        tracking: Optional[Tuple[str, int]],
+    ) -> None:
+        next_versions: Dict[UUID, int] = {}
+        for originator_id, version, _, _ in records:
+            try:
+                next_version = next_versions[originator_id]
+            except KeyError:
+                next_version = len(self._sequences.get(originator_id, ()))
+            if version < next_version:
+                raise RecordConflictError(originator_id, version)
+            elif version > next_version:
+                raise AssertionError(
+                    "Next position for sequence {} is {}, not {}".format(
+                        originator_id, next_version, version
+                    )
+                )
+            next_versions[originator_id] = version + 1
+        if tracking is not None:
+            upstream_name, notification_id = tracking
+            if notification_id <= self._tracking.get(upstream_name, 0):
+                raise RecordConflictError(upstream_name, notification_id)
+
+    def _write_frame(self, payload: bytes) -> int:
+        segment = self._get_segment_for(len(payload))
+        start = segment.end + FRAME_HEADER.size
+        stop = start + len(payload)
+        segment.map[start:stop] = payload
+        FRAME_HEADER.pack_into(
+            segment.map, segment.end, len(payload), zlib.crc32(payload)
+        )
+        self._index_batch(segment, start)
+        self._mark_dirty(segment, segment.end, stop)
+        segment.end = stop
+        self._written += 1
+        if self.sync == SYNC_ALWAYS:
+            self._flush()
+        return self._written
+
+    @staticmethod
+    def _encode_batch(
+        records: Sequence[Tuple[UUID, int, str, bytes]],
+        tracking: Optional[Tuple[str, int]],
+    ) -> bytes:
+        parts = []
+        if tracking is not None:
+            upstream_name = tracking[0].encode("utf8")
+            parts.append(BATCH_HEADER.pack(len(records), len(upstream_name)))
+            parts.append(TRACKING.pack(tracking[1]))
+            parts.append(upstream_name)
+        else:
+            parts.append(BATCH_HEADER.pack(len(records), 0))
+        for originator_id, version, topic, state in records:
+            topic_bytes = topic.encode("utf8")
+            if isinstance(state, str):
+                state = state.encode("utf8")
+            parts.append(
+                RECORD_HEADER.pack(
+                    originator_id.bytes, version, len(topic_bytes), len(state)
+                )
+            )
+            parts.append(topic_bytes)
+            parts.append(state)
+        return b"".join(parts)
+
+    def _index_batch(self, segment: Segment, offset: int) -> None:
+        data = segment.map
+        num_records, upstream_name_length = BATCH_HEADER.unpack_from(data, offset)
+        offset += BATCH_HEADER.size
+        if upstream_name_length == IS_TOMBSTONE:
+            originator_id, version = TOMBSTONE.unpack_from(data, offset)
+            self._delete(segment, originator_id, version)
+            return
+        if upstream_name_length:
+            (notification_id,) = TRACKING.unpack_from(data, offset)
+            offset += TRACKING.size
+            upstream_name = data[offset : offset + upstream_name_length].decode("utf8")
+            offset += upstream_name_length
+            self._track(segment, upstream_name, notification_id)
+        for _ in range(num_records):
+            originator_id, _, topic_length, state_length = RECORD_HEADER.unpack_from(
+                data, offset
+            )
+            self._add_location(segment, originator_id, offset)
+            offset += RECORD_HEADER.size + topic_length + state_length
+
+    def _add_location(self, segment: Segment, originator_id: bytes, offset: int):
+        # Share one UUID object per aggregate, rather than constructing one
+        # each time a record is read.
+        try:
+            originator_uuid = self._originator_ids[originator_id]
+        except KeyError:
+            originator_uuid = UUID(bytes=originator_id)
+            self._originator_ids[originator_id] = originator_uuid
+        self._locations.append((segment, offset, originator_uuid))
+        try:
+            self._sequences[originator_uuid].append(len(self._locations))
+        except KeyError:
+            self._sequences[originator_uuid] = [len(self._locations)]
+        segment.num_records += 1
+
+    def _track(self, segment: Segment, upstream_name: str, notification_id: int):
+        if notification_id > self._tracking.get(upstream_name, 0):
+            self._tracking[upstream_name] = notification_id
+        if notification_id > segment.tracking.get(upstream_name, 0):
+            segment.tracking[upstream_name] = notification_id
+
+    def _delete(self, segment: Segment, originator_id: bytes, version: int) -> None:
+        notification_ids = self._sequences[self._originator_ids[originator_id]]
+        self._deleted.add(notification_ids[version])
+        segment.tombstones.append((originator_id, version))
+
+    def _read(self, notification_id: int) -> Tuple:
+        segment, offset, originator_id = self._locations[notification_id - 1]
+        data = segment.map
+        _, version, topic_length, state_length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        topic = data[offset : offset + topic_length].decode("utf8")
+        offset += topic_length
+        state = data[offset : offset + state_length]
+        return originator_id, version, topic, state, notification_id
+
+    def _refresh(self, repair: bool = False) -> None:
+        """
+        Indexes frames written since the last refresh, by this or other
+        processes, opening new segments as they are created.
+        """
+        self._check_not_closed()
+        if not self._segments:
+            if not self._open_segment(1):
+                return
+        segment = self._segments[-1]
+        while True:
+            self._scan(segment, repair)
+            if not segment.is_sealed:
+                return
+            if not os.path.exists(segment.index_path):
+                self._write_index(segment)
+            if not self._open_segment(segment.number + 1):
+                return
+            segment = self._segments[-1]
+
+    def _open_segment(self, number: int) -> bool:
+        path = segment_path(self.path, number)
+        if not os.path.exists(path):
+            return False
+        segment = Segment(path, number, len(self._locations) + 1)
+        self._segments.append(segment)
+        if os.path.exists(segment_path(self.path, number + 1)):
+            # Earlier segments are sealed, so use their index if it was written.
+            self._read_index(segment)
+        return True
+
+    def _scan(self, segment: Segment, repair: bool) -> None:
+        data = segment.map
+        while not segment.is_sealed:
+            offset = segment.end
+            if offset + FRAME_HEADER.size > segment.size:
+                return
+            length, crc = FRAME_HEADER.unpack_from(data, offset)
+            if length == 0:
+                return
+            if length == END_OF_SEGMENT:
+                segment.is_sealed = True
+                return
+            start = offset + FRAME_HEADER.size
+            stop = start + length
+            if stop > segment.size or zlib.crc32(data[start:stop]) != crc:
+                # The frame is being written by another process, unless writes
+                # are locked, in which case it was torn by a crash.
+                if repair:
+                    stop = min(stop, segment.size)
+                    data[offset:stop] = bytes(stop - offset)
+                return
+            self._index_batch(segment, start)
+            segment.end = stop
+
+    def _get_segment_for(self, payload_length: int) -> Segment:
+        # Leave room to write the end of segment marker.
+        required = FRAME_HEADER.size * 2 + payload_length
+        if self._segments:
+            segment = self._segments[-1]
+            if not segment.is_sealed and segment.end + required <= segment.size:
+                return segment
+            if not segment.is_sealed:
+                FRAME_HEADER.pack_into(segment.map, segment.end, END_OF_SEGMENT, 0)
+                segment.is_sealed = True
+                self._mark_dirty(segment, segment.end, segment.end + FRAME_HEADER.size)
+                self._flush()
+                self._write_index(segment)
+            number = segment.number + 1
+        else:
+            number = 1
+        path = segment_path(self.path, number)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as f:
+            f.truncate(max(self.segment_size, required))
+            os.fsync(f.fileno())
+        os.rename(temp_path, path)
+        self._fsync_directory()
+        self._open_segment(number)
+        return self._segments[-1]
+
+    def _write_index(self, segment: Segment) -> None:
+        parts = [INDEX_HEADER.pack(segment.num_records, len(segment.tracking))]
+        first = segment.first_notification_id
+        for notification_id in range(first, first + segment.num_records):
+            _, offset, _ = self._locations[notification_id - 1]
+            originator_id, version, _, _ = RECORD_HEADER.unpack_from(
+                segment.map, offset
+            )
+            parts.append(INDEX_ENTRY.pack(originator_id, version, offset))
+        for upstream_name, notification_id in segment.tracking.items():
+            name = upstream_name.encode("utf8")
+            parts.append(INDEX_TRACKING.pack(notification_id, len(name)))
+            parts.append(name)
+        for originator_id, version in segment.tombstones:
+            parts.append(INDEX_TOMBSTONE.pack(originator_id, version))
+        temp_path = "{}.{}.tmp".format(segment.index_path, os.getpid())
+        with open(temp_path, "wb") as f:
+            f.write(b"".join(parts))
+            os.fsync(f.fileno())
+        os.rename(temp_path, segment.index_path)
+
+    def _read_index(self, segment: Segment) -> None:
+        try:
+            with open(segment.index_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        num_records, num_upstreams = INDEX_HEADER.unpack_from(data, 0)
+        offset = INDEX_HEADER.size
+        for originator_id, _, record_offset in INDEX_ENTRY.iter_unpack(
+            data[offset : offset + num_records * INDEX_ENTRY.size]
+        ):
+            self._add_location(segment, originator_id, record_offset)
+        offset += num_records * INDEX_ENTRY.size
+        for _ in range(num_upstreams):
+            notification_id, name_length = INDEX_TRACKING.unpack_from(data, offset)
+            offset += INDEX_TRACKING.size
+            upstream_name = data[offset : offset + name_length].decode("utf8")
+            offset += name_length
+            self._track(segment, upstream_name, notification_id)
+        for originator_id, version in INDEX_TOMBSTONE.iter_unpack(data[offset:]):
+            self._delete(segment, originator_id, version)
+        segment.is_sealed = True
+
+    def _fsync_directory(self) -> None:
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _mark_dirty(self, segment: Segment, start: int, stop: int) -> None:
+        try:
+            dirty_start, dirty_stop = self._dirty[segment]
+        except KeyError:
+            self._dirty[segment] = (start, stop)
+        else:
+            self._dirty[segment] = (min(start, dirty_start), max(stop, dirty_stop))
+
+    def _flush(self) -> None:
+        dirty, self._dirty = self._dirty, {}
+        for segment, (start, stop) in dirty.items():
+            segment.flush(start, stop)
+
+    def _wait_for_flush(self, written: int) -> None:
+        with self._sync_condition:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+                self._flusher.start()
+            self._sync_condition.notify_all()
+            while self._synced < written and not self.is_closed:
+                self._sync_condition.wait()
+
+    def _run_flusher(self) -> None:
+        # Writes made whilst flushing are flushed together by the next flush.
+        while True:
+            with self._sync_condition:
+                while self._synced >= self._written and not self.is_closed:
+                    self._sync_condition.wait()
+                if self.is_closed:
+                    return
+            with self._lock:
+                written = self._written
+                dirty, self._dirty = self._dirty, {}
+            with self._flush_lock:
+                for segment, (start, stop) in dirty.items():
+                    segment.flush(start, stop)
+            with self._sync_condition:
+                self._synced = written
+                self._sync_condition.notify_all()
+
+
+_stores: Dict[str, SegmentStore] = {}
+_stores_lock = threading.Lock()
+_stores_pid = os.getpid()
+
+
+def get_segment_store(
+    path: str, segment_size: int = DEFAULT_SEGMENT_SIZE, sync: str = DEFAULT_SYNC
+) -> SegmentStore:
+    """
+    Returns the open segment store for the given directory, which is shared
+    by the record managers of the operating system process.
+    """
+    path = os.path.abspath(path)
+    _forget_stores_after_fork()
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None or not store.is_usable:
+            store = SegmentStore(path, segment_size=segment_size, sync=sync)
+            _stores[path] = store
+        return store
+
+
+def close_segment_store(path: str) -> None:
+    _forget_stores_after_fork()
+    with _stores_lock:
+        store = _stores.pop(os.path.abspath(path), None)
+    if store is not None:
+        store.close()
+
+
+def _forget_stores_after_fork() -> None:
+    # Child processes open their own stores, since the locks and flusher
+    # threads of the parent's stores aren't usable. Forks are detected by
+    # the process ID, since os.register_at_fork() needs Python 3.7.
+    global _stores_lock, _stores_pid
+    if _stores_pid != os.getpid():
+        _stores_lock = threading.Lock()
+        _stores.clear()
+        _stores_pid = os.getpid()
+
+
+class FileSettings(DatastoreSettings):
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        segment_size: Optional[int] = None,
+        sync: Optional[str] = None,
+    ):
+        self.path = path or os.getenv("FILE_STORE_PATH", "")
+        assert self.path, "File store path not set (use FILE_STORE_PATH)"
+        self.segment_size = segment_size or int(
+            os.getenv("FILE_STORE_SEGMENT_SIZE", DEFAULT_SEGMENT_SIZE)
+        )
+        self.sync = sync or os.getenv("FILE_STORE_SYNC", DEFAULT_SYNC)
+
+
+class FileStoredEventRecord(object):
+    """
+    Event record, read from or to be written to a segment file.
+    """
+
+    application_name = None
+    notification_id = None
+
+    def __init__(self, **kwargs: Any):
+        self.__dict__.update(kwargs)
+
+
+class FileRecordManager(RecordManagerWithTracking):
+    def __init__(self, settings: FileSettings, *args: Any, **kwargs: Any):
+        super(FileRecordManager, self).__init__(*args, **kwargs)
+        self.settings = settings
+        self._store: Optional[SegmentStore] = None
+
+    @property
+    def store(self) -> SegmentStore:
+        store = self._store
+        if store is None or not store.is_usable:
+            store = get_segment_store(
+                os.path.join(self.settings.path, self.application_name),
+                segment_size=self.settings.segment_size,
+                sync=self.settings.sync,
+            )
+            self._store = store
+        return store
+
+    def clone(
+        self, application_name: str, pipeline_id: int, **kwargs: Any
+    ) -> "FileRecordManager":
+        return super(FileRecordManager, self).clone(  # type: ignore
+            application_name=application_name,
+            pipeline_id=pipeline_id,
+            settings=self.settings,
+            **kwargs
+        )
+
+    def record_items(self, sequenced_items: Iterable[Any]) -> None:
+        self.write_records(self.to_records(sequenced_items))
+
+    def write_records(
+        self,
+        records: Iterable[Any],
+        tracking_kwargs: Optional[TrackingKwargs] = None,
+        orm_objs_pending_save: Optional[Sequence[Any]] = None,
+        orm_objs_pending_delete: Optional[Sequence[Any]] = None,
+    ) -> None:
+        records = list(records)
+        names = self.field_names
+        tracking = None
+        if tracking_kwargs:
+            assert tracking_kwargs["application_name"] == self.application_name
+            tracking = (
+                str(tracking_kwargs["upstream_application_name"]),
+                int(tracking_kwargs["notification_id"]),
+            )
+        notification_id = self.store.append(
+            [
+                (
+                    getattr(record, names.sequence_id),
+                    getattr(record, names.position),
+                    getattr(record, names.topic),
+                    getattr(record, names.state),
+                )
+                for record in records
+            ],
+            tracking,
+        )
+        for record in records:
+            setattr(record, self.notification_id_name, notification_id)
+            notification_id += 1
+
+    def get_record(self, sequence_id: UUID, position: int) -> Any:
+        records = self._read(
+            self.store.get_notification_ids(sequence_id, position, position + 1)
+        )
+        if not records:
+            raise IndexError(self.application_name, sequence_id, position)
+        return records[0]
+
+    def get_records(
+        self,
+        sequence_id: UUID,
+        gt: Optional[int] = None,
+        gte: Optional[int] = None,
+        lt: Optional[int] = None,
+        lte: Optional[int] = None,
+        limit: Optional[int] = None,
+        query_ascending: bool = True,
+        results_ascending: bool = True,
+    ) -> Sequence[Any]:
+        start = 0
+        if gt is not None:
+            start = gt + 1
+        if gte is not None:
+            start = max(start, gte)
+        stop = None
+        if lt is not None:
+            stop = lt
+        if lte is not None:
+            stop = lte + 1 if stop is None else min(stop, lte + 1)
+        notification_ids = self.store.get_notification_ids(sequence_id, start, stop)
+        if not query_ascending:
+            notification_ids.reverse()
+        if limit is not None:
+            notification_ids = notification_ids[:limit]
+        if query_ascending != results_ascending:
+            notification_ids.reverse()
+        return self._read(notification_ids)
+
+    def get_notification_records(
+        self,
+        start: Optional[int] = None,
+        stop: Optional[int] = None,
+        *args: Any,
+        **kwargs: Any
+    ) -> Iterable:
+        first = (start or 0) + 1
+        last = self.store.max_notification_id()
+        if stop is not None:
+            last = min(last, stop)
+        return self._read(range(first, last + 1))
+
+    def _read(self, notification_ids: Iterable[int]) -> List[FileStoredEventRecord]:
+        names = self.field_names
+        return [
+            self.record_class(
+                **{
+                    names.sequence_id: originator_id,
+                    names.position: version,
+                    names.topic: topic,
+                    names.state: state,
+                    self.notification_id_name: notification_id,
+                }
+            )
+            for originator_id, version, topic, state, notification_id in (
+                self.store.read(notification_ids)
+            )
+        ]
+
+    def get_max_notification_id(self) -> int:
+        return self.store.max_notification_id()
+
+    def get_max_tracking_record_id(self, upstream_application_name: str) -> int:
+        return self.store.max_tracking_id(upstream_application_name)
+
+    def has_tracking_record(
+        self, upstream_application_name: str, pipeline_id: int, notification_id: int
+    ) -> bool:
+        return notification_id <= self.store.max_tracking_id(upstream_application_name)
+
+    def all_sequence_ids(self) -> List[UUID]:
+        return self.store.originator_ids()
+
+    def delete_record(self, record: Any) -> None:
+        names = self.field_names
+        self.store.delete(
+            getattr(record, names.sequence_id), getattr(record, names.position)
+        )
+
+
+class FileDatastore(AbstractDatastore[FileSettings]):
+    def __init__(self, settings: FileSettings, application_name: str):
+        super(FileDatastore, self).__init__(settings=settings)
+        self.path = os.path.join(settings.path, application_name)
+
+    def setup_connection(self) -> None:
+        pass
+
+    def close_connection(self) -> None:
+        close_segment_store(self.path)
+
+    def setup_tables(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+
+    def setup_table(self, table: Any) -> None:
+        self.setup_tables()
+
+    def drop_tables(self) -> None:
+        close_segment_store(self.path)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def drop_table(self, table: Any) -> None:
+        self.drop_tables()
+
+    def truncate_tables(self) -> None:
+        self.drop_tables()
+        self.setup_tables()
+
+
+class FileInfrastructureFactory(InfrastructureFactory):
+    record_manager_class = FileRecordManager
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        segment_size: Optional[int] = None,
+        sync: Optional[str] = None,
+        *args: Any,
+        **kwargs: Any
+    ):
+        super(FileInfrastructureFactory, self).__init__(*args, **kwargs)
+        self.settings = FileSettings(path=path, segment_size=segment_size, sync=sync)
+
+    def construct_record_manager(
+        self, record_class: Optional[type], *args: Any, **kwargs: Any
+    ) -> Any:
+        return super(FileInfrastructureFactory, self).construct_record_manager(
+            record_class, settings=self.settings, *args, **kwargs
+        )
+
+    def construct_datastore(self) -> Optional[AbstractDatastore]:
+        assert self.application_name
+        return FileDatastore(
+            settings=self.settings, application_name=self.application_name
+        )
+
+
+class FileApplication(ApplicationWithConcreteInfrastructure):
+    """
+    File-backed infrastructure, storing events in memory-mapped, append-only
+    segment files.
+
+    Settings can be given as constructor arguments, or with the environment
+    variables FILE_STORE_PATH, FILE_STORE_SEGMENT_SIZE and FILE_STORE_SYNC
+    ("group" by default, "always" or "none").
+    """
+
+    infrastructure_factory_class = FileInfrastructureFactory
+    stored_event_record_class = FileStoredEventRecord
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        segment_size: Optional[int] = None,
+        sync: Optional[str] = None,
+        **kwargs: Any
+    ):
+        self.path = path
+        self.segment_size = segment_size
+        self.sync = sync
+        super(FileApplication, self).__init__(**kwargs)
+
+    def construct_infrastructure(self, *args: Any, **kwargs: Any) -> None:
+        super(FileApplication, self).construct_infrastructure(
+            path=self.path,
+            segment_size=self.segment_size,
+            sync=self.sync,
+            *args,
+            **kwargs
+        )
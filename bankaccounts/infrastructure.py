@@ -0,0 +1,234 @@
+import os
+import time
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from eventsourcing.application.sqlalchemy import SQLAlchemyApplication
+from eventsourcing.infrastructure.datastore import AbstractDatastore
+from eventsourcing.infrastructure.sqlalchemy.datastore import (
+    SQLAlchemyDatastore,
+    SQLAlchemySettings,
+)
+from eventsourcing.infrastructure.sqlalchemy.factory import (
+    SQLAlchemyInfrastructureFactory,
+)
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_DB_MAX_OVERFLOW = 10
+DEFAULT_DB_POOL_TIMEOUT = 30
+
+
+class PoolStats(object):
+    """
+    Counts connection checkouts from a pool, and the time spent waiting for them.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = Lock()
+
+    def record_checkout(self, wait: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+
+    @property
+    def mean_wait(self) -> float:
+        if not self.checkouts:
+            return 0.0
+        return self.total_wait / self.checkouts
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "total_wait": self.total_wait,
+                "mean_wait": self.mean_wait,
+                "max_wait": self.max_wait,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """
+    Queue pool that records how long each checkout had to wait for a connection.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            self.stats.record_checkout(time.perf_counter() - started)
+
+    def recreate(self):
+        # Keep the stats when the engine recreates the pool (e.g. after dispose).
+        pool = super(TimedQueuePool, self).recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class PooledSQLAlchemySettings(SQLAlchemySettings):
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        max_overflow: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+        pool_pre_ping: Optional[bool] = None,
+    ):
+        super(PooledSQLAlchemySettings, self).__init__(uri=uri, pool_size=pool_size)
+        if max_overflow is not None:
+            self.max_overflow = max_overflow
+        else:
+            self.max_overflow = int(
+                os.getenv("DB_MAX_OVERFLOW", DEFAULT_DB_MAX_OVERFLOW)
+            )
+
+        if pool_timeout is not None:
+            self.pool_timeout = pool_timeout
+        else:
+            self.pool_timeout = float(
+                os.getenv("DB_POOL_TIMEOUT", DEFAULT_DB_POOL_TIMEOUT)
+            )
+
+        if pool_pre_ping is not None:
+            self.pool_pre_ping = pool_pre_ping
+        else:
+            self.pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "").lower() in (
+                "1",
+                "true",
+                "yes",
+            )
+
+
+class PooledSQLAlchemyDatastore(SQLAlchemyDatastore):
+    """
+    Datastore that creates its engine with an explicitly sized, timed
+    connection pool.
+
+    SQLite in-memory databases exist only for a single connection, so
+    they keep the default engine configuration.
+    """
+
+    def setup_connection(self) -> None:
+        settings = self.settings
+        assert isinstance(settings, PooledSQLAlchemySettings), settings
+        if self._engine is None:
+            if self.is_sqlite_in_memory():
+                super(PooledSQLAlchemyDatastore, self).setup_connection()
+                return
+
+            kwargs: Dict[str, Any] = {}
+            if self.is_sqlite():
+                kwargs["connect_args"] = {"check_same_thread": False}
+
+            self._engine = create_engine(
+                settings.uri,
+                strategy=self._connection_strategy,
+                poolclass=TimedQueuePool,
+                pool_size=settings.pool_size,
+                max_overflow=settings.max_overflow,
+                pool_timeout=settings.pool_timeout,
+                pool_pre_ping=settings.pool_pre_ping,
+                **kwargs
+            )
+
+    def is_sqlite_in_memory(self) -> bool:
+        uri = self.settings.uri or ""
+        return self.is_sqlite() and (uri.endswith(":memory:") or uri == "sqlite://")
+
+    @property
+    def pool_stats(self) -> Optional[PoolStats]:
+        if self._engine is None:
+            return None
+        return getattr(self._engine.pool, "stats", None)
+
+
+class PooledSQLAlchemyInfrastructureFactory(SQLAlchemyInfrastructureFactory):
+    def __init__(
+        self,
+        max_overflow: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+        pool_pre_ping: Optional[bool] = None,
+        *args: Any,
+        **kwargs: Any
+    ):
+        super(PooledSQLAlchemyInfrastructureFactory, self).__init__(*args, **kwargs)
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_pre_ping = pool_pre_ping
+
+    def construct_datastore(self) -> Optional[AbstractDatastore]:
+        datastore = PooledSQLAlchemyDatastore(
+            settings=PooledSQLAlchemySettings(
+                uri=self.uri,
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+                pool_pre_ping=self.pool_pre_ping,
+            ),
+            session=self.session,
+        )
+        if self.session is None:
+            assert datastore.session, "Datastore object session is None"
+            self.session = datastore.session
+        return datastore
+
+
+class PooledSQLAlchemyApplication(SQLAlchemyApplication):
+    """
+    SQLAlchemy infrastructure with a tunable connection pool.
+
+    Pool settings can be given as constructor arguments, or with the
+    environment variables DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT
+    and DB_POOL_PRE_PING. Each operating system process constructs its
+    own engine, so with the multiprocess runner the environment variables
+    configure the pool of every process.
+    """
+
+    infrastructure_factory_class = PooledSQLAlchemyInfrastructureFactory
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = None,
+        max_overflow: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+        pool_pre_ping: Optional[bool] = None,
+        **kwargs: Any
+    ):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_pre_ping = pool_pre_ping
+        super(PooledSQLAlchemyApplication, self).__init__(**kwargs)
+
+    def construct_infrastructure(self, *args: Any, **kwargs: Any) -> None:
+        super(PooledSQLAlchemyApplication, self).construct_infrastructure(
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_timeout=self.pool_timeout,
+            pool_pre_ping=self.pool_pre_ping,
+            *args,
+            **kwargs
+        )
+
+    @property
+    def pool_stats(self) -> Optional[PoolStats]:
+        """
+        Returns checkout and wait time statistics of the connection pool.
+
+        Applications that share a session also share the pool, and so
+        report the same statistics.
+        """
+        if self.session is None:
+            return None
+        return getattr(self.session.get_bind().pool, "stats", None)
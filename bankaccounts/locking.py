@@ -0,0 +1,67 @@
+"""
+In-process locking of accounts, so that threads of an application that
+change the same accounts wait for each other, rather than conflicting
+when their new events are recorded.
+"""
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterator, List, Optional
+from uuid import UUID
+
+from bankaccounts.exceptions import LockTimeoutError
+
+DEFAULT_NUM_STRIPES = 256
+DEFAULT_LOCK_TIMEOUT = 10.0
+
+
+class StripedLockManager(object):
+    """
+    Locks accounts with a fixed number of locks (stripes), chosen by the
+    account ID, so memory doesn't grow with the number of accounts.
+    Accounts that share a stripe are locked together.
+
+    The locks of several accounts are acquired in order of stripe, so that
+    threads that lock the same accounts in a different order (such as
+    transfers in opposite directions) can't deadlock. If the locks can't be
+    acquired within the timeout, ``LockTimeoutError`` is raised. Locks
+    aren't reentrant.
+    """
+
+    def __init__(
+        self,
+        num_stripes: int = DEFAULT_NUM_STRIPES,
+        timeout: Optional[float] = DEFAULT_LOCK_TIMEOUT,
+    ):
+        assert num_stripes > 0, num_stripes
+        self.num_stripes = num_stripes
+        self.timeout = timeout
+        self._locks = [Lock() for _ in range(num_stripes)]
+
+    def get_stripe(self, account_id: UUID) -> int:
+        return account_id.int % self.num_stripes
+
+    @contextmanager
+    def lock(self, *account_ids: UUID, timeout: Optional[float] = None) -> Iterator:
+        """
+        Locks the given accounts, waiting at most ``timeout`` seconds (or
+        the manager's timeout) for all the locks.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        stripes = sorted({self.get_stripe(account_id) for account_id in account_ids})
+        acquired: List[Lock] = []
+        try:
+            for stripe in stripes:
+                lock = self._locks[stripe]
+                if deadline is None:
+                    lock.acquire()
+                elif not lock.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                    raise LockTimeoutError(
+                        {"account_ids": list(account_ids), "timeout": timeout}
+                    )
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
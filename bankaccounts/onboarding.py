@@ -0,0 +1,90 @@
+"""
+Bulk onboarding of accounts, for example when migrating the accounts of
+another bank.
+
+Each account is described by an ``AccountSpec``, and the events of many
+new accounts are saved together, in batches.
+"""
+import time
+from decimal import Decimal
+from typing import Callable, Iterable, List, NamedTuple, Optional
+from uuid import UUID
+
+from bankaccounts.domainmodel import BankAccount
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class AccountSpec(NamedTuple):
+    account_id: Optional[UUID] = None
+    opening_balance: Decimal = Decimal("0.00")
+    overdraft_limit: Decimal = Decimal("0.00")
+
+
+class OnboardingProgress(NamedTuple):
+    num_accounts: int
+    num_events: int
+    elapsed: float
+
+    @property
+    def throughput(self) -> float:
+        """
+        Accounts created per second.
+        """
+        return self.num_accounts / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return "{} accounts ({} events) in {:.3f}s ({:.1f} accounts/s)".format(
+            self.num_accounts, self.num_events, self.elapsed, self.throughput
+        )
+
+
+def open_account(spec: AccountSpec) -> BankAccount:
+    """
+    Creates an account, with its overdraft limit and opening balance.
+    """
+    account = BankAccount.__create__(originator_id=spec.account_id)
+    if spec.overdraft_limit:
+        account.set_overdraft_limit(spec.overdraft_limit)
+    if spec.opening_balance:
+        account.append_transaction(spec.opening_balance)
+    return account
+
+
+def onboard_accounts(
+    save: Callable[[List[BankAccount]], None],
+    specs: Iterable[AccountSpec],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Callable[[OnboardingProgress], None]] = None,
+) -> OnboardingProgress:
+    """
+    Creates accounts from the given specs, and saves them in batches of
+    ``batch_size`` accounts, calling ``progress`` after each batch.
+
+    Specs are consumed as they are needed, so they can be streamed. If an
+    account can't be opened, for example because its opening balance is
+    below its overdraft limit, the error is raised, and the accounts in
+    earlier batches remain saved.
+    """
+    assert batch_size > 0, batch_size
+    started = time.time()
+    num_accounts = 0
+    num_events = 0
+    batch: List[BankAccount] = []
+    report = OnboardingProgress(0, 0, 0.0)
+    specs = iter(specs)
+    while True:
+        for spec in specs:
+            account = open_account(spec)
+            num_events += len(account.__pending_events__)
+            batch.append(account)
+            if len(batch) == batch_size:
+                break
+        if not batch:
+            return report
+        save(batch)
+        num_accounts += len(batch)
+        batch = []
+        report = OnboardingProgress(num_accounts, num_events, time.time() - started)
+        if progress is not None:
+            progress(report)
@@ -0,0 +1,296 @@
+"""
+Profiling of the hot paths of the process applications.
+
+Set the environment variable PROFILE_DIR to profile the process applications
+from construction until they are closed, when the profiles are written to
+that directory. This also works with the multiprocess runner, since each
+operating system process constructs and closes its own applications. Set
+PROFILE_MEMORY to also trace memory allocations.
+
+A window of a running system can be profiled with ``profiling()``::
+
+    with profiling(accounts, sagas, output_dir="profiles") as paths:
+        run_benchmark()
+
+Each profiler writes ``<name>-<pid>.pstats`` (cProfile statistics),
+``<name>-<pid>.folded`` (collapsed stacks, for flamegraph.pl or speedscope)
+and, when tracing memory, ``<name>-<pid>.tracemalloc.txt``.
+"""
+import cProfile
+import os
+import pstats
+import threading
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from eventsourcing.application.process import ProcessApplication
+
+DEFAULT_TRACEMALLOC_FRAMES = 25
+DEFAULT_TRACEMALLOC_TOP = 50
+MAX_COLLAPSED_STACK_DEPTH = 100
+MIN_COLLAPSED_STACK_MICROSECONDS = 1
+
+_active = threading.local()
+
+
+def _get_active_profilers() -> List["Profiler"]:
+    try:
+        return _active.profilers
+    except AttributeError:
+        _active.profilers = []
+        return _active.profilers
+
+
+class Profiler(object):
+    """
+    Collects cProfile statistics, and optionally tracemalloc statistics,
+    while enabled.
+
+    Profilers can be nested in a thread, for example when the single threaded
+    runner processes a prompt from one application whilst another is running.
+    The inner profiler pauses the outer one, so that time is attributed to the
+    innermost profiler. A profiler only profiles one thread at a time, and
+    calls made by other threads whilst it is enabled aren't profiled.
+    """
+
+    def __init__(
+        self,
+        name: str = "profile",
+        output_dir: Optional[str] = None,
+        trace_memory: bool = False,
+    ):
+        self.name = name
+        self.output_dir = output_dir
+        self.trace_memory = trace_memory
+        self.profile = cProfile.Profile()
+        self.has_data = False
+        self._is_tracing_memory = False
+        self._lock = threading.Lock()
+        self._thread_id: Optional[int] = None
+        self._depth = 0
+
+    def enable(self) -> bool:
+        """
+        Starts profiling the current thread. Returns False, without enabling
+        the profiler, if the profiler is enabled in another thread.
+        """
+        thread_id = threading.get_ident()
+        with self._lock:
+            if self._thread_id not in (None, thread_id):
+                return False
+            self._thread_id = thread_id
+            self._depth += 1
+            if self._depth > 1:
+                return True
+        active = _get_active_profilers()
+        if active:
+            active[-1].profile.disable()
+        active.append(self)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(DEFAULT_TRACEMALLOC_FRAMES)
+            self._is_tracing_memory = True
+        self.has_data = True
+        self.profile.enable()
+        return True
+
+    def disable(self) -> None:
+        with self._lock:
+            self._depth -= 1
+            if self._depth:
+                return
+            self._thread_id = None
+        self.profile.disable()
+        active = _get_active_profilers()
+        active.remove(self)
+        if active:
+            active[-1].profile.enable()
+
+    def __enter__(self) -> "Profiler":
+        self.enable()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.disable()
+
+    def dump(self, output_dir: Optional[str] = None) -> List[str]:
+        """
+        Writes the collected statistics, and returns the paths of the files.
+        """
+        output_dir = output_dir or self.output_dir or os.getcwd()
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(output_dir, "{}-{}".format(self.name, os.getpid()))
+        paths = []
+        if self.has_data:
+            stats = pstats.Stats(self.profile)
+            # Creating the stats disables profiling in this thread.
+            active = _get_active_profilers()
+            if active:
+                active[-1].profile.enable()
+            stats.dump_stats(base + ".pstats")
+            paths.append(base + ".pstats")
+            with open(base + ".folded", "w") as f:
+                for stack, microseconds in sorted(collapse_stacks(stats).items()):
+                    f.write("{} {}\n".format(stack, microseconds))
+            paths.append(base + ".folded")
+        if self.trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                ]
+            )
+            with open(base + ".tracemalloc.txt", "w") as f:
+                for stat in snapshot.statistics("lineno")[:DEFAULT_TRACEMALLOC_TOP]:
+                    f.write("{}\n".format(stat))
+            paths.append(base + ".tracemalloc.txt")
+        if self._is_tracing_memory:
+            tracemalloc.stop()
+            self._is_tracing_memory = False
+        return paths
+
+
+def collapse_stacks(stats: pstats.Stats) -> Dict[str, int]:
+    """
+    Returns collapsed stacks, with the own time of each stack in microseconds.
+
+    Profiles record the callers of each function, but not whole stacks, so
+    the stacks are approximated by apportioning the time of each function
+    between its callers, as flameprof does.
+    """
+    raw: Dict[Tuple, Tuple] = stats.stats  # type: ignore
+    callees: Dict[Tuple, List[Tuple[Tuple, float]]] = defaultdict(list)
+    roots = []
+    for func, (_, _, _, _, callers) in raw.items():
+        if not any(caller in raw and caller != func for caller in callers):
+            roots.append(func)
+        for caller, (_, _, _, edge_cumtime) in callers.items():
+            callees[caller].append((func, edge_cumtime))
+
+    collapsed: Dict[str, int] = defaultdict(int)
+
+    def visit(func: Tuple, path: List[str], on_path: set, share: float) -> None:
+        tottime = raw[func][2]
+        path.append(_label(func))
+        on_path.add(func)
+        microseconds = int(tottime * share * 1e6)
+        if microseconds >= MIN_COLLAPSED_STACK_MICROSECONDS:
+            collapsed[";".join(path)] += microseconds
+        if len(path) < MAX_COLLAPSED_STACK_DEPTH:
+            for callee, edge_cumtime in callees[func]:
+                callee_cumtime = raw[callee][3]
+                if callee in on_path or not callee_cumtime:
+                    continue
+                callee_share = share * edge_cumtime / callee_cumtime
+                if callee_cumtime * callee_share * 1e6 >= (
+                    MIN_COLLAPSED_STACK_MICROSECONDS
+                ):
+                    visit(callee, path, on_path, min(callee_share, 1.0))
+        path.pop()
+        on_path.discard(func)
+
+    for root in roots:
+        visit(root, [], set(), 1.0)
+    return dict(collapsed)
+
+
+def _label(func: Tuple) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        return name.replace(" ", "_")
+    return "{}({}:{})".format(name, os.path.basename(filename), lineno)
+
+
+class ProfiledProcessApplication(ProcessApplication):
+    """
+    Process application that can profile the processing of upstream events.
+
+    The profiled calls are the policy dispatch, which includes retrieving and
+    mutating aggregates and triggering new events, the recording of new
+    events, which includes encoding them, and the decoding of upstream events.
+    """
+
+    def __init__(self, profiler: Optional[Profiler] = None, **kwargs: Any):
+        super(ProfiledProcessApplication, self).__init__(**kwargs)
+        output_dir = os.getenv("PROFILE_DIR")
+        if profiler is None and output_dir:
+            profiler = Profiler(
+                name=self.name,
+                output_dir=output_dir,
+                trace_memory=os.getenv("PROFILE_MEMORY", "").lower()
+                in ("1", "true", "yes"),
+            )
+        self.profiler = profiler
+
+    def start_profiling(
+        self, output_dir: Optional[str] = None, trace_memory: bool = False
+    ) -> Profiler:
+        self.profiler = Profiler(
+            name=self.name, output_dir=output_dir, trace_memory=trace_memory
+        )
+        return self.profiler
+
+    def stop_profiling(self) -> List[str]:
+        """
+        Stops profiling, and returns the paths of the files written.
+        """
+        profiler, self.profiler = self.profiler, None
+        if profiler is None:
+            return []
+        return profiler.dump()
+
+    def process_upstream_event(self, *args: Any, **kwargs: Any):
+        profiler = self.profiler
+        if profiler is None:
+            return super(ProfiledProcessApplication, self).process_upstream_event(
+                *args, **kwargs
+            )
+        enabled = profiler.enable()
+        try:
+            return super(ProfiledProcessApplication, self).process_upstream_event(
+                *args, **kwargs
+            )
+        finally:
+            if enabled:
+                profiler.disable()
+
+    def get_event_from_notification(self, notification: Dict[str, Any]):
+        profiler = self.profiler
+        if profiler is None:
+            return super(ProfiledProcessApplication, self).get_event_from_notification(
+                notification
+            )
+        enabled = profiler.enable()
+        try:
+            return super(ProfiledProcessApplication, self).get_event_from_notification(
+                notification
+            )
+        finally:
+            if enabled:
+                profiler.disable()
+
+    def close(self) -> None:
+        self.stop_profiling()
+        super(ProfiledProcessApplication, self).close()
+
+
+@contextmanager
+def profiling(
+    *apps: ProfiledProcessApplication,
+    output_dir: Optional[str] = None,
+    trace_memory: bool = False
+) -> Iterator[List[str]]:
+    """
+    Profiles the given process applications within the context, and writes
+    the profiles on exit. Yields a list which is then extended with the
+    paths of the files written.
+    """
+    paths: List[str] = []
+    for app in apps:
+        app.start_profiling(output_dir=output_dir, trace_memory=trace_memory)
+    try:
+        yield paths
+    finally:
+        for app in apps:
+            paths.extend(app.stop_profiling())
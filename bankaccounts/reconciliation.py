@@ -0,0 +1,319 @@
+"""
+Reconciliation of read models, such as projections and caches of account
+status, against the events of the accounts.
+
+The events of all accounts are streamed from the notification log of the
+application that stores the accounts (``Accounts`` or
+``SimpleBankAccountApplication``), and the status of each account is
+computed as the events are read. The computed statuses are compared, in
+chunks of accounts and in parallel, with the statuses returned by a lookup
+function of the read model::
+
+    reconciler = Reconciler(accounts, lookup=view_lookup(view), allow_missing=True)
+    report = reconciler.run()
+    ...
+    report = reconciler.run(incremental=True)
+"""
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    Set,
+)
+from uuid import UUID
+
+from eventsourcing.application.simple import SimpleApplication
+from eventsourcing.domain.model.aggregate import BaseAggregateRoot
+from eventsourcing.exceptions import RepositoryKeyError
+
+from bankaccounts.system.views import (
+    AccountStatus,
+    AccountStatusView,
+    apply_account_event,
+    initial_account_status,
+)
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_MISMATCHES = 1000
+COMPARED_FIELDS = ("balance", "overdraft_limit", "is_closed")
+MISSING = "missing"
+
+Lookup = Callable[[Sequence[UUID]], Mapping[UUID, Any]]
+
+
+class Mismatch(NamedTuple):
+    account_id: UUID
+    field: str
+    expected: Any
+    actual: Any
+
+
+class ReconciliationReport(object):
+    def __init__(self, position: int, is_incremental: bool):
+        self.position = position
+        self.is_incremental = is_incremental
+        self.num_accounts = 0
+        self.num_events = 0
+        self.num_mismatches = 0
+        self.mismatches: List[Mismatch] = []
+        self.elapsed = 0.0
+
+    @property
+    def is_ok(self) -> bool:
+        return self.num_mismatches == 0
+
+    def summary(self) -> str:
+        return (
+            "{} accounts ({} events) checked up to notification {} in {:.3f}s, "
+            "{} mismatches".format(
+                self.num_accounts,
+                self.num_events,
+                self.position,
+                self.elapsed,
+                self.num_mismatches,
+            )
+        )
+
+
+def view_lookup(view: AccountStatusView) -> Lookup:
+    """
+    Returns a lookup function for an account status view.
+    """
+
+    def lookup(account_ids: Sequence[UUID]) -> Mapping[UUID, Any]:
+        statuses = {}
+        for account_id in account_ids:
+            status = view.get(account_id)
+            if status is not None:
+                statuses[account_id] = status
+        return statuses
+
+    return lookup
+
+
+class Reconciler(object):
+    """
+    Compares the statuses of accounts in a read model with the statuses
+    computed from the events of the accounts.
+
+    The read model is given as a lookup function, which is called with a
+    chunk of account IDs, and returns a mapping of account IDs to objects
+    with ``balance``, ``overdraft_limit`` and ``is_closed`` attributes.
+    Accounts missing from the mapping are mismatches, unless
+    ``allow_missing`` is set, for caches that hold only some accounts.
+
+    Statuses are computed for one partition of the accounts at a time,
+    by account ID hash, reading the notification log once per partition,
+    so that memory is bounded by the number of accounts in a partition.
+    Accounts that differ are checked again against the latest state of the
+    account, so that accounts changed whilst reconciling aren't reported.
+
+    Incremental runs only check the accounts changed since the previous
+    run, replaying them from the repository.
+    """
+
+    def __init__(
+        self,
+        app: SimpleApplication,
+        lookup: Lookup,
+        allow_missing: bool = False,
+        num_partitions: int = 1,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        max_mismatches: int = DEFAULT_MAX_MISMATCHES,
+        position: int = 0,
+    ):
+        assert num_partitions > 0, num_partitions
+        self.app = app
+        self.lookup = lookup
+        self.allow_missing = allow_missing
+        self.num_partitions = num_partitions
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.max_mismatches = max_mismatches
+        self.position = position
+
+    def run(self, incremental: bool = False) -> ReconciliationReport:
+        """
+        Reconciles the accounts, or only the accounts changed since the
+        previous run, up to the current end of the notification log.
+        """
+        started = time.time()
+        record_manager = self.app.event_store.record_manager
+        position = record_manager.get_max_notification_id()
+        report = ReconciliationReport(position, is_incremental=incremental)
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="reconciliation"
+        ) as executor:
+            for partition in range(self.num_partitions):
+                if incremental:
+                    statuses = self._replay_changed_accounts(
+                        partition, self.position, position, report, executor
+                    )
+                else:
+                    statuses = self._compute_statuses(partition, position, report)
+                report.num_accounts += len(statuses)
+                self._compare(statuses, report, executor)
+        self.position = position
+        report.elapsed = time.time() - started
+        return report
+
+    def _iter_events(
+        self, partition: int, start: int, stop: int
+    ) -> Iterator[BaseAggregateRoot.Event]:
+        """
+        Yields the events of the accounts in the partition, from the
+        notifications after ``start`` up to and including ``stop``.
+        """
+        record_manager = self.app.event_store.record_manager
+        event_mapper = self.app.event_store.event_mapper
+        names = record_manager.field_names
+        while start < stop:
+            page_stop = min(start + self.page_size, stop)
+            for notification in record_manager.get_notifications(start, page_stop):
+                # Skip other partitions before decoding the events.
+                originator_id = notification[names.sequence_id]
+                if not isinstance(originator_id, UUID):
+                    originator_id = UUID(originator_id)
+                if originator_id.int % self.num_partitions != partition:
+                    continue
+                yield event_mapper.event_from_topic_and_state(
+                    notification[names.topic], notification[names.state]
+                )
+            start = page_stop
+
+    def _compute_statuses(
+        self, partition: int, position: int, report: ReconciliationReport
+    ) -> Dict[UUID, AccountStatus]:
+        statuses: Dict[UUID, AccountStatus] = {}
+        for event in self._iter_events(partition, 0, position):
+            report.num_events += 1
+            account_id = event.originator_id
+            if isinstance(event, BaseAggregateRoot.Created):
+                statuses[account_id] = initial_account_status(event)
+            else:
+                statuses[account_id] = apply_account_event(
+                    statuses[account_id], event
+                )
+        return statuses
+
+    def _replay_changed_accounts(
+        self,
+        partition: int,
+        since: int,
+        position: int,
+        report: ReconciliationReport,
+        executor: ThreadPoolExecutor,
+    ) -> Dict[UUID, Any]:
+        changed: Set[UUID] = set()
+        for event in self._iter_events(partition, since, position):
+            report.num_events += 1
+            changed.add(event.originator_id)
+        statuses: Dict[UUID, Any] = {}
+        for chunk_statuses in self._map_chunks(self._get_accounts, changed, executor):
+            statuses.update(chunk_statuses)
+        return statuses
+
+    def _get_accounts(self, account_ids: Sequence[UUID]) -> Dict[UUID, Any]:
+        accounts = {}
+        for account_id in account_ids:
+            try:
+                accounts[account_id] = self.app.repository[account_id]
+            except RepositoryKeyError:
+                pass
+        return accounts
+
+    def _compare(
+        self,
+        statuses: Mapping[UUID, Any],
+        report: ReconciliationReport,
+        executor: ThreadPoolExecutor,
+    ) -> None:
+        def compare_chunk(account_ids: Sequence[UUID]) -> List[Mismatch]:
+            return self._compare_chunk(
+                account_ids, statuses, self.lookup(account_ids)
+            )
+
+        differing: List[UUID] = []
+        for mismatches in self._map_chunks(compare_chunk, statuses, executor):
+            differing.extend(m.account_id for m in mismatches)
+        if not differing:
+            return
+
+        # Check again against the latest state, in case accounts were changed.
+        differing = list(dict.fromkeys(differing))
+        for account_ids in _chunks(differing, self.chunk_size):
+            mismatches = self._compare_chunk(
+                account_ids, self._get_accounts(account_ids), self.lookup(account_ids)
+            )
+            report.num_mismatches += len(mismatches)
+            free = self.max_mismatches - len(report.mismatches)
+            report.mismatches.extend(mismatches[: max(free, 0)])
+
+    def _compare_chunk(
+        self,
+        account_ids: Sequence[UUID],
+        expected: Mapping[UUID, Any],
+        actual: Mapping[UUID, Any],
+    ) -> List[Mismatch]:
+        mismatches = []
+        for account_id in account_ids:
+            expected_status = expected.get(account_id)
+            actual_status = actual.get(account_id)
+            if expected_status is None:
+                continue
+            if actual_status is None:
+                if not self.allow_missing:
+                    mismatches.append(Mismatch(account_id, MISSING, None, None))
+                continue
+            for field in COMPARED_FIELDS:
+                expected_value = getattr(expected_status, field)
+                actual_value = getattr(actual_status, field)
+                if expected_value != actual_value:
+                    mismatches.append(
+                        Mismatch(account_id, field, expected_value, actual_value)
+                    )
+        return mismatches
+
+    def _map_chunks(
+        self,
+        func: Callable[[Sequence[UUID]], Any],
+        account_ids: Iterable[UUID],
+        executor: ThreadPoolExecutor,
+    ) -> Iterator[Any]:
+        """
+        Calls the function with chunks of account IDs in the executor, and
+        yields the results in order, limiting the number of chunks in flight.
+        """
+        pending: Deque[Future] = deque()
+        for chunk in _chunks(account_ids, self.chunk_size):
+            pending.append(executor.submit(func, chunk))
+            if len(pending) >= self.max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _chunks(items: Iterable[UUID], size: int) -> Iterator[List[UUID]]:
+    chunk: List[UUID] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,17 +1,53 @@
+from contextlib import contextmanager
 from decimal import Decimal
+from typing import Any, Callable, ContextManager, Iterable, Iterator, Optional
 from uuid import UUID
 
 from eventsourcing.application.simple import SimpleApplication
 
 from bankaccounts.domainmodel import BankAccount
+from bankaccounts.locking import StripedLockManager
+from bankaccounts.onboarding import (
+    DEFAULT_BATCH_SIZE,
+    AccountSpec,
+    OnboardingProgress,
+    onboard_accounts,
+)
+
+
+@contextmanager
+def _no_lock() -> Iterator[None]:
+    yield
 
 
 class SimpleBankAccountApplication(SimpleApplication):
+    def __init__(
+        self, lock_manager: Optional[StripedLockManager] = None, **kwargs: Any
+    ):
+        super(SimpleBankAccountApplication, self).__init__(**kwargs)
+        # Threads that change the same accounts wait for each other.
+        self.lock_manager = lock_manager
+
+    def lock_accounts(self, *account_ids: UUID) -> ContextManager:
+        if self.lock_manager is None:
+            return _no_lock()
+        return self.lock_manager.lock(*account_ids)
+
     def create_account(self) -> UUID:
         account = BankAccount.__create__()
         self.save(account)
         return account.id
 
+    def create_accounts(
+        self,
+        specs: Iterable[AccountSpec],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        progress: Optional[Callable[[OnboardingProgress], None]] = None,
+    ) -> OnboardingProgress:
+        return onboard_accounts(
+            self.save, specs, batch_size=batch_size, progress=progress
+        )
+
     def get_account(self, account_id: UUID) -> BankAccount:
         account = self.repository[account_id]
         assert isinstance(account, BankAccount)
@@ -22,34 +58,39 @@ class SimpleBankAccountApplication(SimpleApplication):
         return account.balance
 
     def deposit_funds(self, credit_account_id: UUID, amount: Decimal) -> None:
-        account = self.get_account(credit_account_id)
-        account.append_transaction(amount)
-        self.save(account)
+        with self.lock_accounts(credit_account_id):
+            account = self.get_account(credit_account_id)
+            account.append_transaction(amount)
+            self.save(account)
 
     def withdraw_funds(self, debit_account_id: UUID, amount: Decimal) -> None:
-        account = self.get_account(debit_account_id)
-        account.append_transaction(-amount)
-        self.save(account)
+        with self.lock_accounts(debit_account_id):
+            account = self.get_account(debit_account_id)
+            account.append_transaction(-amount)
+            self.save(account)
 
     def transfer_funds(
         self, debit_account_id: UUID, credit_account_id: UUID, amount: Decimal
     ) -> None:
-        debit_account = self.get_account(debit_account_id)
-        credit_account = self.get_account(credit_account_id)
-        debit_account.append_transaction(-amount)
-        credit_account.append_transaction(amount)
-        self.save([debit_account, credit_account])
+        with self.lock_accounts(debit_account_id, credit_account_id):
+            debit_account = self.get_account(debit_account_id)
+            credit_account = self.get_account(credit_account_id)
+            debit_account.append_transaction(-amount)
+            credit_account.append_transaction(amount)
+            self.save([debit_account, credit_account])
 
     def set_overdraft_limit(self, account_id: UUID, overdraft_limit: Decimal) -> None:
-        account = self.get_account(account_id)
-        account.set_overdraft_limit(overdraft_limit)
-        self.save(account)
+        with self.lock_accounts(account_id):
+            account = self.get_account(account_id)
+            account.set_overdraft_limit(overdraft_limit)
+            self.save(account)
 
     def get_overdraft_limit(self, account_id: UUID) -> Decimal:
         account = self.get_account(account_id)
         return account.overdraft_limit
 
     def close_account(self, account_id: UUID) -> None:
-        account = self.get_account(account_id)
-        account.close()
-        self.save(account)
+        with self.lock_accounts(account_id):
+            account = self.get_account(account_id)
+            account.close()
+            self.save(account)
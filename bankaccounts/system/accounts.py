@@ -1,30 +1,98 @@
 from decimal import Decimal
+from typing import Callable, Iterable, Optional
 from uuid import UUID
 
 from eventsourcing.application.decorators import applicationpolicy
-from eventsourcing.application.process import ProcessApplication
+from eventsourcing.exceptions import RepositoryKeyError
 
 from bankaccounts.domainmodel import BankAccount
 from bankaccounts.exceptions import TransactionError
+from bankaccounts.onboarding import (
+    DEFAULT_BATCH_SIZE,
+    AccountSpec,
+    OnboardingProgress,
+    onboard_accounts,
+)
+from bankaccounts.profiling import ProfiledProcessApplication
+from bankaccounts.system.notificationlog import ReadAheadNotificationLogReader
 from bankaccounts.system.sagas import (
     DepositFundsSaga,
     TransferFundsSaga,
     WithdrawFundsSaga,
 )
+from bankaccounts.system.views import AccountStatus, get_account_status
+
 
+class Accounts(ProfiledProcessApplication):
+    use_single_pass_transfers = False
+
+    def __init__(
+        self, account_status_view=None, use_single_pass_transfers=None, **kwargs
+    ):
+        super(Accounts, self).__init__(**kwargs)
+        self.account_status_view = account_status_view
+        if use_single_pass_transfers is not None:
+            self.use_single_pass_transfers = use_single_pass_transfers
 
-class Accounts(ProcessApplication):
     def create_account(self) -> UUID:
         account = BankAccount.__create__()
         self.save(account)
         return account.id
 
+    def create_accounts(
+        self,
+        specs: Iterable[AccountSpec],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        progress: Optional[Callable[[OnboardingProgress], None]] = None,
+    ) -> OnboardingProgress:
+        """
+        Creates accounts in bulk, saving each batch of accounts atomically.
+        """
+        return onboard_accounts(
+            self.save, specs, batch_size=batch_size, progress=progress
+        )
+
     def get_account(self, repository, account_id: UUID) -> BankAccount:
         account = repository[account_id]
         assert isinstance(account, BankAccount)
         return account
 
+    def follow(self, upstream_application_name, notification_log):
+        super(Accounts, self).follow(upstream_application_name, notification_log)
+        if self.account_status_view is not None:
+            self.account_status_view.is_published = True
+
+    @property
+    def is_publishing_account_statuses(self) -> bool:
+        """
+        Whether this application updates the account status view, which it
+        only does if it processes events in this operating system process.
+        The multiprocess and Ray runners construct the applications that
+        process events in other processes, so the view isn't updated there.
+        """
+        return self.account_status_view is not None and bool(self.readers)
+
+    def get_account_status(self, account_id: UUID) -> AccountStatus:
+        """
+        Returns the status of an account from the account status view,
+        which is updated after new events are recorded, so that reads
+        neither wait for the processing of events nor replay the account.
+        Accounts that aren't in the view are retrieved and put in the view.
+        If this application doesn't update the view, the account is
+        retrieved from the repository.
+        """
+        if not self.is_publishing_account_statuses:
+            return get_account_status(self.get_account(self.repository, account_id))
+        assert self.account_status_view is not None
+        status = self.account_status_view.get(account_id)
+        if status is None:
+            account = self.get_account(self.repository, account_id)
+            status = self.account_status_view.put(account)
+        return status
+
     def get_balance(self, account_id: UUID) -> Decimal:
+        if self.is_publishing_account_statuses:
+            return self.get_account_status(account_id).balance
         account = self.get_account(self.repository, account_id)
         return account.balance
 
@@ -34,6 +102,8 @@ class Accounts(ProcessApplication):
         self.save(account)
 
     def get_overdraft_limit(self, account_id: UUID) -> Decimal:
+        if self.is_publishing_account_statuses:
+            return self.get_account_status(account_id).overdraft_limit
         account = self.get_account(self.repository, account_id)
         return account.overdraft_limit
 
@@ -42,6 +112,21 @@ class Accounts(ProcessApplication):
         account.close()
         self.save(account)
 
+    def record_process_event(self, process_event):
+        new_records = super(Accounts, self).record_process_event(process_event)
+        if self.is_publishing_account_statuses:
+            self.update_account_status_view(process_event.domain_events)
+        return new_records
+
+    def update_account_status_view(self, events):
+        unknown_account_ids = self.account_status_view.update(events)
+        for account_id in unknown_account_ids:
+            try:
+                account = self.get_account(self.repository, account_id)
+            except RepositoryKeyError:
+                continue
+            self.account_status_view.put(account)
+
     @applicationpolicy
     def policy(self, repository, event):
         pass
@@ -66,6 +151,14 @@ class Accounts(ProcessApplication):
 
     @policy.register(TransferFundsSaga.Created)
     def _(self, repository, event):
+        if self.use_single_pass_transfers and self._transfer_funds(
+            repository=repository,
+            transaction_id=event.originator_id,
+            debit_account_id=event.debit_account_id,
+            credit_account_id=event.credit_account_id,
+            amount=event.amount,
+        ):
+            return
         self._append_transaction(
             repository=repository,
             transaction_id=event.originator_id,
@@ -91,9 +184,77 @@ class Accounts(ProcessApplication):
             amount=event.amount,
         )
 
+    def _transfer_funds(
+        self, repository, transaction_id, debit_account_id, credit_account_id, amount
+    ) -> bool:
+        """
+        Debits and credits the accounts together, so the transfer completes
+        in one step. Returns False, without changing the accounts, if the
+        transfer should instead be made by the saga one account at a time.
+        """
+        if debit_account_id == credit_account_id:
+            return False
+        try:
+            debit_account = self.get_account(repository, debit_account_id)
+            credit_account = self.get_account(repository, credit_account_id)
+            credit_account.check_account_is_not_closed()
+            credit_account.check_has_sufficient_funds(amount)
+        except (RepositoryKeyError, TransactionError):
+            return False
+        try:
+            debit_account.append_transaction(
+                -amount, transaction_id=transaction_id, is_single_pass=True
+            )
+        except TransactionError as e:
+            debit_account.record_error(error=e, transaction_id=transaction_id)
+            return True
+        credit_account.append_transaction(
+            amount, transaction_id=transaction_id, is_single_pass=True
+        )
+        return True
+
     def _append_transaction(self, repository, transaction_id, account_id, amount):
         account = self.get_account(repository=repository, account_id=account_id)
         try:
             account.append_transaction(amount, transaction_id=transaction_id)
         except TransactionError as e:
             account.record_error(error=e, transaction_id=transaction_id)
+
+
+class SinglePassTransferAccounts(Accounts):
+    """
+    Accounts application with single-pass transfers enabled by its class,
+    so that they are also enabled by runners that construct applications
+    from their classes in other processes (the multiprocess and Ray
+    runners). It has the same name as the Accounts application.
+    """
+
+    use_single_pass_transfers = True
+
+    @classmethod
+    def create_name(cls):
+        return Accounts.create_name()
+
+
+class ReadAheadAccounts(Accounts):
+    """
+    Accounts application that reads its upstream notification logs through
+    the read-ahead cache, by its class, so that the cache is also used by
+    the multiprocess and Ray runners. It has the same name as the Accounts
+    application.
+    """
+
+    notification_log_reader_class = ReadAheadNotificationLogReader
+
+    @classmethod
+    def create_name(cls):
+        return Accounts.create_name()
+
+
+class ReadAheadSinglePassTransferAccounts(SinglePassTransferAccounts):
+    """
+    Accounts application with single-pass transfers, that reads its upstream
+    notification logs through the read-ahead cache.
+    """
+
+    notification_log_reader_class = ReadAheadNotificationLogReader
@@ -1,7 +1,16 @@
+import time
 from uuid import UUID
 
 from eventsourcing.application.command import CommandProcess
 from eventsourcing.domain.model.command import Command
+from eventsourcing.exceptions import RecordConflictError, RepositoryKeyError
+
+from bankaccounts.system.idempotency import (
+    DEFAULT_IDEMPOTENCY_CACHE_SIZE,
+    DEFAULT_IDEMPOTENCY_KEY_TTL,
+    IdempotencyCache,
+    IdempotencyKey,
+)
 
 
 class BaseCommand(Command):
@@ -31,25 +40,135 @@ class TransferFundsCommand(BaseCommand):
 
 
 class Commands(CommandProcess):
-    def deposit_funds(self, credit_account_id, amount) -> UUID:
+    idempotency_key_ttl = DEFAULT_IDEMPOTENCY_KEY_TTL
+    idempotency_cache_size = DEFAULT_IDEMPOTENCY_CACHE_SIZE
+
+    def __init__(self, account_status_view=None, **kwargs):
+        super(Commands, self).__init__(**kwargs)
+        self.account_status_view = account_status_view
+        self.idempotency_cache = IdempotencyCache(
+            max_size=self.idempotency_cache_size, ttl=self.idempotency_key_ttl
+        )
+
+    def deposit_funds(self, credit_account_id, amount, idempotency_key=None) -> UUID:
+        transaction_id = self.get_transaction_id(idempotency_key)
+        if transaction_id is not None:
+            return transaction_id
+        self.check_transaction(credit_account_id, amount)
         cmd = DepositFundsCommand.__create__(
             credit_account_id=credit_account_id, amount=amount
         )
-        self.save(cmd)
-        return cmd.id
+        return self.save_command(cmd, idempotency_key)
 
-    def withdraw_funds(self, debit_account_id, amount):
+    def withdraw_funds(self, debit_account_id, amount, idempotency_key=None):
+        transaction_id = self.get_transaction_id(idempotency_key)
+        if transaction_id is not None:
+            return transaction_id
+        self.check_transaction(debit_account_id, -amount)
         cmd = WithdrawFundsCommand.__create__(
             debit_account_id=debit_account_id, amount=amount
         )
-        self.save(cmd)
-        return cmd.id
+        return self.save_command(cmd, idempotency_key)
 
-    def transfer_funds(self, debit_account_id, credit_account_id, amount):
+    def transfer_funds(
+        self, debit_account_id, credit_account_id, amount, idempotency_key=None
+    ):
+        transaction_id = self.get_transaction_id(idempotency_key)
+        if transaction_id is not None:
+            return transaction_id
+        self.check_transaction(debit_account_id, -amount)
+        self.check_transaction(credit_account_id, amount)
         cmd = TransferFundsCommand.__create__(
             debit_account_id=debit_account_id,
             credit_account_id=credit_account_id,
             amount=amount,
         )
-        self.save(cmd)
+        return self.save_command(cmd, idempotency_key)
+
+    @property
+    def uses_account_status_view(self) -> bool:
+        """
+        Whether there is an account status view that is updated by an
+        Accounts application in this operating system process. Under the
+        multiprocess and Ray runners, Accounts processes events in another
+        process, so the view isn't used, and pending credits aren't added.
+        """
+        view = self.account_status_view
+        return view is not None and view.is_published
+
+    def check_transaction(self, account_id, amount):
+        """
+        Rejects a transaction that is bound to fail, if there is an account
+        status view. The authoritative check is still made by the account.
+        """
+        if self.uses_account_status_view:
+            self.account_status_view.check_transaction(account_id, amount)
+
+    def get_transaction_id(self, idempotency_key):
+        """
+        Returns the ID of the transaction already recorded for the given
+        idempotency key, or None if the key is new or has expired.
+        """
+        if idempotency_key is None:
+            return None
+        transaction_id = self.idempotency_cache.get(idempotency_key)
+        if transaction_id is not None:
+            return transaction_id
+        key = self.get_idempotency_key(idempotency_key)
+        if key is None or key.has_expired(self.idempotency_cache.ttl):
+            return None
+        self.idempotency_cache.put(
+            idempotency_key, key.transaction_id, float(key.__last_modified__)
+        )
+        return key.transaction_id
+
+    def get_idempotency_key(self, idempotency_key):
+        try:
+            key = self.repository[IdempotencyKey.create_id(idempotency_key)]
+        except RepositoryKeyError:
+            return None
+        assert isinstance(key, IdempotencyKey)
+        return key
+
+    def save_command(self, cmd, idempotency_key=None) -> UUID:
+        view = self.account_status_view if self.uses_account_status_view else None
+        if view is not None and hasattr(cmd, "credit_account_id"):
+            # Count the credit as available funds until it has been applied.
+            view.add_pending_credit(
+                transaction_id=cmd.id,
+                account_id=cmd.credit_account_id,
+                amount=cmd.amount,
+                refund_account_id=getattr(cmd, "debit_account_id", None),
+            )
+        transaction_id = None
+        try:
+            transaction_id = self._save_command(cmd, idempotency_key)
+        finally:
+            if view is not None and transaction_id != cmd.id:
+                view.discard_pending_credit(cmd.id)
+        return transaction_id
+
+    def _save_command(self, cmd, idempotency_key) -> UUID:
+        if idempotency_key is None:
+            self.save(cmd)
+            return cmd.id
+
+        key = self.get_idempotency_key(idempotency_key)
+        if key is None:
+            key = IdempotencyKey.__create__(
+                originator_id=IdempotencyKey.create_id(idempotency_key),
+                transaction_id=cmd.id,
+            )
+        else:
+            key.reassign(cmd.id)
+        try:
+            # Save the key first, so a conflict stops the command being recorded.
+            self.save([key, cmd])
+        except RecordConflictError:
+            # A concurrent request with the same key was recorded first.
+            transaction_id = self.get_transaction_id(idempotency_key)
+            if transaction_id is None:
+                raise
+            return transaction_id
+        self.idempotency_cache.put(idempotency_key, cmd.id, time.time())
         return cmd.id
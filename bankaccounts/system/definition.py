@@ -1,13 +1,77 @@
 from eventsourcing.system.definition import System
-from bankaccounts.system.accounts import Accounts
+
+from bankaccounts.infrastructure import PooledSQLAlchemyApplication
+from bankaccounts.system.accounts import (
+    Accounts,
+    ReadAheadAccounts,
+    ReadAheadSinglePassTransferAccounts,
+    SinglePassTransferAccounts,
+)
 from bankaccounts.system.commands import Commands
-from bankaccounts.system.sagas import Sagas
+from bankaccounts.system.sagas import ReadAheadSagas, Sagas
+from bankaccounts.system.views import AccountStatusView
 
 
 class BankAccountSystem(System):
-    def __init__(self, infrastructure_class=None, **kwargs):
+    def __init__(
+        self,
+        infrastructure_class=None,
+        pool_size=None,
+        max_overflow=None,
+        pool_timeout=None,
+        pool_pre_ping=None,
+        use_read_ahead_cache=False,
+        use_account_status_view=False,
+        use_single_pass_transfers=None,
+        **kwargs
+    ):
+        # Single-pass transfers and the read-ahead cache are enabled by the
+        # classes of the applications, since the multiprocess and Ray runners
+        # construct applications in other processes without calling
+        # construct_app(). Commands doesn't follow other applications.
+        if use_read_ahead_cache:
+            sagas_class = ReadAheadSagas
+            accounts_class = (
+                ReadAheadSinglePassTransferAccounts
+                if use_single_pass_transfers
+                else ReadAheadAccounts
+            )
+        else:
+            sagas_class = Sagas
+            accounts_class = (
+                SinglePassTransferAccounts if use_single_pass_transfers else Accounts
+            )
         super(BankAccountSystem, self).__init__(
-            Commands | Sagas | Accounts | Sagas,
+            Commands | sagas_class | accounts_class | sagas_class,
             infrastructure_class=infrastructure_class,
             **kwargs
         )
+        self.pool_kwargs = {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": pool_timeout,
+            "pool_pre_ping": pool_pre_ping,
+        }
+        self.use_read_ahead_cache = use_read_ahead_cache
+        # The account status view is shared by Commands and Accounts, and
+        # is only used when Accounts processes events in the same process.
+        self.account_status_view = (
+            AccountStatusView() if use_account_status_view else None
+        )
+        self.use_single_pass_transfers = use_single_pass_transfers
+
+    def construct_app(self, process_class, infrastructure_class=None, **kwargs):
+        infrastructure_class = infrastructure_class or self.infrastructure_class
+        if (
+            isinstance(infrastructure_class, type)
+            and issubclass(infrastructure_class, PooledSQLAlchemyApplication)
+        ) or issubclass(process_class, PooledSQLAlchemyApplication):
+            for name, value in self.pool_kwargs.items():
+                kwargs.setdefault(name, value)
+        if self.account_status_view is not None and issubclass(
+            process_class, (Commands, Accounts)
+        ):
+            kwargs.setdefault("account_status_view", self.account_status_view)
+        return super(BankAccountSystem, self).construct_app(
+            process_class, infrastructure_class=infrastructure_class, **kwargs
+        )
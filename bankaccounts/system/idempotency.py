@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+from eventsourcing.domain.model.aggregate import BaseAggregateRoot
+
+DEFAULT_IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+DEFAULT_IDEMPOTENCY_CACHE_SIZE = 10000
+
+
+class IdempotencyKey(BaseAggregateRoot):
+    """
+    Records the transaction created for a client-supplied idempotency key.
+
+    The aggregate ID is derived from the key, so looking up a key is a
+    read of a single aggregate, and recording the same key twice
+    conflicts in the event store.
+    """
+
+    __subclassevents__ = True
+
+    def __init__(self, *, transaction_id: UUID, **kwargs):
+        super(IdempotencyKey, self).__init__(**kwargs)
+        self.transaction_id = transaction_id
+
+    @staticmethod
+    def create_id(idempotency_key: str) -> UUID:
+        return uuid5(NAMESPACE_URL, "/idempotency_keys/{}".format(idempotency_key))
+
+    def has_expired(self, ttl: float) -> bool:
+        return float(self.__last_modified__) + ttl < time.time()
+
+    def reassign(self, transaction_id: UUID) -> None:
+        self.__trigger_event__(self.Reassigned, transaction_id=transaction_id)
+
+    class Reassigned(BaseAggregateRoot.Event):
+        @property
+        def transaction_id(self) -> UUID:
+            return self.__dict__["transaction_id"]
+
+        def mutate(self, obj: "IdempotencyKey") -> None:
+            obj.transaction_id = self.transaction_id
+
+
+class IdempotencyCache(object):
+    """
+    Bounded, in-memory cache of idempotency keys that have been recorded,
+    which avoids reading the key aggregate when a client retries.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_IDEMPOTENCY_CACHE_SIZE,
+        ttl: float = DEFAULT_IDEMPOTENCY_KEY_TTL,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[str, Tuple[UUID, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, idempotency_key: str) -> Optional[UUID]:
+        with self._lock:
+            try:
+                transaction_id, recorded_on = self._items[idempotency_key]
+            except KeyError:
+                return None
+            if recorded_on + self.ttl < time.time():
+                del self._items[idempotency_key]
+                return None
+            self._items.move_to_end(idempotency_key)
+            return transaction_id
+
+    def put(self, idempotency_key: str, transaction_id: UUID, recorded_on: float):
+        with self._lock:
+            self._items[idempotency_key] = (transaction_id, recorded_on)
+            self._items.move_to_end(idempotency_key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,177 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Dict, Optional
+from weakref import WeakKeyDictionary
+
+from eventsourcing.application.notificationlog import (
+    AbstractNotificationLog,
+    LocalNotificationLog,
+    NotificationLogReader,
+    Section,
+)
+
+DEFAULT_MAX_SECTIONS = 100
+
+
+class ReadAheadNotificationLog(AbstractNotificationLog):
+    """
+    Presents the sections of a local notification log, keeping a bounded
+    cache of recently read sections and prefetching the next section
+    whilst the current one is being processed.
+
+    Only complete sections (those with a link to a next section) are
+    cached, since the items of a complete section can't change.
+    """
+
+    prefetch_executor: Optional[ThreadPoolExecutor] = None
+    prefetch_executor_lock = Lock()
+    prefetch_executor_pid = os.getpid()
+
+    def __init__(
+        self,
+        notification_log: LocalNotificationLog,
+        max_sections: int = DEFAULT_MAX_SECTIONS,
+        prefetch: bool = True,
+    ):
+        self.notification_log = notification_log
+        self.max_sections = max_sections
+        self.prefetch = prefetch
+        self._sections: OrderedDict[str, Section] = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+
+    @property
+    def section_size(self) -> int:
+        return self.notification_log.section_size
+
+    def __getitem__(self, section_id: str) -> Section:
+        with self._lock:
+            section = self._sections.get(section_id)
+            if section is not None:
+                self._sections.move_to_end(section_id)
+                self.hits += 1
+                self._prefetch_next(section)
+                return section
+            pending = self._pending.get(section_id)
+
+        section = None
+        if pending is not None:
+            # Wait for the prefetched section, rather than reading it again.
+            try:
+                section = pending.result()
+            except Exception:
+                pass
+        is_hit = section is not None
+        if section is None:
+            section = self.notification_log[section_id]
+
+        with self._lock:
+            if is_hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._put_section(section_id, section)
+            self._prefetch_next(section)
+        return section
+
+    def _put_section(self, section_id: str, section: Section) -> None:
+        if section.next_id is None or section_id != section.section_id:
+            return
+        self._sections[section_id] = section
+        self._sections.move_to_end(section_id)
+        while len(self._sections) > self.max_sections:
+            self._sections.popitem(last=False)
+
+    def _prefetch_next(self, section: Section) -> None:
+        next_id = section.next_id
+        if not self.prefetch or next_id is None:
+            return
+        if next_id in self._sections or next_id in self._pending:
+            return
+        self.prefetches += 1
+        self._pending[next_id] = self.get_prefetch_executor().submit(
+            self._fetch, next_id
+        )
+
+    def _fetch(self, section_id: str) -> Section:
+        try:
+            section = self.notification_log[section_id]
+            with self._lock:
+                self._put_section(section_id, section)
+            return section
+        finally:
+            with self._lock:
+                self._pending.pop(section_id, None)
+
+    @classmethod
+    def get_prefetch_executor(cls) -> ThreadPoolExecutor:
+        # Child processes start their own executor, since the worker threads
+        # of the parent's executor don't exist after a fork.
+        if cls.prefetch_executor_pid != os.getpid():
+            cls.prefetch_executor_lock = Lock()
+            cls.prefetch_executor = None
+            cls.prefetch_executor_pid = os.getpid()
+        with cls.prefetch_executor_lock:
+            if cls.prefetch_executor is None:
+                cls.prefetch_executor = ThreadPoolExecutor(
+                    max_workers=4, thread_name_prefix="notification-prefetch"
+                )
+            return cls.prefetch_executor
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefetches": self.prefetches,
+                "cached_sections": len(self._sections),
+            }
+
+
+_read_ahead_logs: WeakKeyDictionary = WeakKeyDictionary()
+_read_ahead_logs_lock = Lock()
+
+
+def get_read_ahead_log(
+    notification_log: LocalNotificationLog, max_sections: int = DEFAULT_MAX_SECTIONS
+) -> ReadAheadNotificationLog:
+    """
+    Returns the read-ahead log of the given notification log, so that
+    followers in the same process share one cache per upstream log.
+    """
+    with _read_ahead_logs_lock:
+        try:
+            return _read_ahead_logs[notification_log]
+        except KeyError:
+            read_ahead_log = ReadAheadNotificationLog(
+                notification_log, max_sections=max_sections
+            )
+            _read_ahead_logs[notification_log] = read_ahead_log
+            return read_ahead_log
+
+
+class ReadAheadNotificationLogReader(NotificationLogReader):
+    """
+    Reads local notification logs through their shared read-ahead log.
+    """
+
+    max_sections = DEFAULT_MAX_SECTIONS
+
+    def __init__(
+        self,
+        notification_log: AbstractNotificationLog,
+        use_direct_query_if_available: bool = False,
+    ):
+        if isinstance(notification_log, LocalNotificationLog):
+            notification_log = get_read_ahead_log(
+                notification_log, max_sections=self.max_sections
+            )
+        super(ReadAheadNotificationLogReader, self).__init__(
+            notification_log,
+            use_direct_query_if_available=use_direct_query_if_available,
+        )
@@ -0,0 +1,406 @@
+"""
+Ray runner with options for partitioning the system and batching the
+delivery of notifications between actors.
+
+Importing this module starts or connects to a Ray cluster, as importing
+``eventsourcing.system.ray`` does. Set ``ray_init_kwargs`` in
+``eventsourcing.system.raysettings`` first to configure the cluster.
+"""
+import os
+import traceback
+from queue import Empty
+from threading import Lock
+from time import sleep
+from typing import Any, Dict, List, Optional, Type
+from uuid import UUID
+
+import ray
+import ray.util.queue
+from eventsourcing.application.popo import PopoApplication
+from eventsourcing.application.process import ProcessApplication
+from eventsourcing.application.simple import PromptToPull
+from eventsourcing.exceptions import ExceptionWrapper, ProgrammingError
+from eventsourcing.infrastructure.base import (
+    DEFAULT_PIPELINE_ID,
+    RecordManagerWithNotifications,
+)
+from eventsourcing.system.definition import System
+from eventsourcing.system.rayhelpers import RayPrompt
+from eventsourcing.system.raysettings import ray_init_kwargs
+
+# Ray workers import this module to construct the actors, and importing
+# eventsourcing.system.ray calls ray.init() in workers, which are connected.
+ray_init_kwargs.setdefault("ignore_reinit_error", True)
+
+from eventsourcing.system.ray import (  # noqa: E402
+    AttributeProxy,
+    ProcessApplicationProxy,
+    RayProcess,
+    RayRunner,
+)
+
+DEFAULT_PAGE_SIZE = 100
+PROGRESS_POLL_INTERVAL = 0.05
+
+# Environment variables that configure the infrastructure of the actors.
+INFRASTRUCTURE_ENV_VARS = (
+    "DB_URI",
+    "FILE_STORE_PATH",
+    "FILE_STORE_SEGMENT_SIZE",
+    "FILE_STORE_SYNC",
+)
+
+
+class NotificationsPrompt(RayPrompt):
+    """
+    Prompt that carries the new notifications of the upstream process,
+    either in the prompt or as a reference to an object in the Ray object
+    store, so the downstream process doesn't have to pull them.
+    """
+
+    def __init__(
+        self,
+        process_name: str,
+        pipeline_id: int,
+        head_notification_id: Optional[int] = None,
+        notifications: Any = (),
+    ):
+        super(NotificationsPrompt, self).__init__(
+            process_name, pipeline_id, head_notification_id
+        )
+        self.notifications = notifications
+
+
+class TunedRayProcess(RayProcess.__ray_actor_class__):  # type: ignore
+    """
+    Actor that pulls notifications in larger pages, prompts downstream
+    processes once per batch of processed events rather than once per
+    event, coalesces queued prompts, and optionally pushes new notifications
+    with the prompts.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        push_notifications: bool = True,
+        notifications_by_reference: bool = False,
+        **kwargs: Any
+    ):
+        # Set before the base class starts the threads that use them.
+        self.page_size = page_size
+        self.push_notifications = push_notifications
+        self.notifications_by_reference = notifications_by_reference
+        self._pushed_lock = Lock()
+        self._pushed_notifications: Dict[str, Dict[int, dict]] = {}
+        self._last_pushed_id: Optional[int] = None
+        super(TunedRayProcess, self).__init__(*args, **kwargs)
+
+    def prompt(self, prompt: RayPrompt) -> None:
+        if isinstance(prompt, NotificationsPrompt) and prompt.notifications:
+            notifications = prompt.notifications
+            if isinstance(notifications, ray.ObjectRef):
+                notifications = ray.get(notifications)
+            with self._pushed_lock:
+                pushed = self._pushed_notifications.setdefault(prompt.process_name, {})
+                for notification in notifications:
+                    pushed[notification["id"]] = notification
+        super(TunedRayProcess, self).prompt(prompt)
+
+    def _process_prompts(self) -> None:
+        self.positions_initialised.wait()
+        while not self.has_been_stopped.is_set():
+            try:
+                self._has_been_prompted.wait()
+                self._has_been_prompted.clear()
+                for upstream_name in self.upstream_processes:
+                    self._pull_notifications(upstream_name)
+            except Exception as e:
+                if not self.has_been_stopped.is_set():
+                    print(traceback.format_exc())
+                    print("Continuing after error in 'process prompts' thread:", e)
+                    sleep(1)
+
+    def _pull_notifications(self, upstream_name: str) -> None:
+        with self.heads_lock:
+            head = self.heads.get(upstream_name)
+        with self.positions_lock:
+            position = self.positions.get(upstream_name) or 0
+        if head is not None and position >= head:
+            return
+
+        # Take pushed notifications that follow on from the position.
+        notifications = []
+        with self._pushed_lock:
+            pushed = self._pushed_notifications.get(upstream_name, {})
+            next_id = position + 1
+            while next_id in pushed and len(notifications) < self.page_size:
+                notifications.append(pushed.pop(next_id))
+                next_id += 1
+            for notification_id in [i for i in pushed if i < next_id]:
+                del pushed[notification_id]
+
+        # Pull the rest of the page, including any notifications recorded
+        # since the prompt.
+        if len(notifications) < self.page_size and (head is None or next_id <= head):
+            last_id = position + self.page_size
+            upstream_process = self.upstream_processes[upstream_name]
+            notifications += ray.get(
+                upstream_process.get_notifications.remote(next_id, last_id)
+            )
+
+        if not notifications:
+            return
+        if len(notifications) >= self.page_size:
+            self._has_been_prompted.set()
+        with self.positions_lock:
+            self.positions[upstream_name] = notifications[-1]["id"]
+
+        queue_item = []
+        for notification in notifications:
+            self.process_application.check_causal_dependencies(
+                upstream_name, notification.get("causal_dependencies")
+            )
+            event = self.process_application.get_event_from_notification(notification)
+            queue_item.append((event, notification["id"], upstream_name))
+        self.upstream_event_queue.put(queue_item)
+
+    def _process_events(self) -> None:
+        while not self.has_been_stopped.is_set():
+            try:
+                self._process_event_batch()
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Continuing after error in 'process events' thread:", e)
+                sleep(1)
+
+    def _process_event_batch(self) -> None:
+        queue_item = self.upstream_event_queue.get()
+        self.upstream_event_queue.task_done()
+        if queue_item is None or self.has_been_stopped.is_set():
+            return
+        has_new_notifications = False
+        for domain_event, notification_id, upstream_name in queue_item:
+            while not self.has_been_stopped.is_set():
+                try:
+                    new_events, _ = self.do_db_job(
+                        method=self.process_application.process_upstream_event,
+                        args=(domain_event, notification_id, upstream_name),
+                        kwargs={},
+                    )
+                    break
+                except Exception as e:
+                    print(traceback.format_exc())
+                    self._print_timecheck("Retrying to reprocess event after error:", e)
+                    sleep(1)
+            if self.has_been_stopped.is_set():
+                return
+            if any(e.__notifiable__ for e in new_events):
+                has_new_notifications = True
+
+        # Prompt once for the whole batch.
+        if has_new_notifications:
+            self.downstream_prompt_queue.put(
+                PromptToPull(
+                    self.process_application.name, self.process_application.pipeline_id
+                )
+            )
+
+    def _push_prompts(self) -> None:
+        while not self.has_been_stopped.is_set():
+            try:
+                self._push_prompt()
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Continuing after error in 'push prompts' thread:", e)
+                sleep(1)
+
+    def _push_prompt(self) -> None:
+        items = [self.downstream_prompt_queue.get()]
+        self.downstream_prompt_queue.task_done()
+        # Coalesce the prompts that are already queued.
+        while True:
+            try:
+                items.append(self.downstream_prompt_queue.get_nowait())
+                self.downstream_prompt_queue.task_done()
+            except Empty:
+                break
+        if None in items or self.has_been_stopped.is_set():
+            return
+        if not self.downstream_processes:
+            return
+
+        head_notification_id = self._get_max_notification_id()
+        notifications: Any = ()
+        if self.push_notifications and head_notification_id:
+            notifications = self.do_db_job(
+                self._get_new_notifications, (head_notification_id,), {}
+            )
+            if notifications and self.notifications_by_reference:
+                # Downstream processes get the same object from the object store.
+                notifications = ray.put(notifications)
+        prompt = NotificationsPrompt(
+            self.process_application.name,
+            self.process_application.pipeline_id,
+            head_notification_id,
+            notifications,
+        )
+        ray.get(
+            [
+                ray_process.prompt.remote(prompt)
+                for ray_process in self.downstream_processes.values()
+            ]
+        )
+
+    def _get_new_notifications(self, head_notification_id: int) -> List[dict]:
+        # Push at most a page, downstream processes pull any others.
+        first_id = max(
+            (self._last_pushed_id or 0) + 1, head_notification_id - self.page_size + 1
+        )
+        self._last_pushed_id = head_notification_id
+        if first_id > head_notification_id:
+            return []
+        return self._get_notifications(first_id, head_notification_id)
+
+    def _get_notifications(
+        self, first_notification_id: int, last_notification_id: int
+    ) -> List[dict]:
+        record_manager = self.process_application.event_store.record_manager
+        assert isinstance(record_manager, RecordManagerWithNotifications)
+        return list(
+            record_manager.get_notifications(
+                first_notification_id - 1, last_notification_id
+            )
+        )
+
+
+TunedRayProcessActor = ray.remote(TunedRayProcess)
+
+
+class CallbackAttributeProxy(AttributeProxy):
+    """
+    Calls a method of a process application in its actor, like the library's
+    proxy, except that the calls the actor makes to a ``progress`` callback
+    argument are delivered, through a Ray queue, to the callback in this
+    process, whilst the method runs.
+    """
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        progress = kwargs.get("progress")
+        if progress is None:
+            return super(CallbackAttributeProxy, self).__call__(*args, **kwargs)
+        # The queue's actor exits when the queue is no longer referenced.
+        queue = ray.util.queue.Queue()
+        kwargs["progress"] = queue.put
+        ray_id = self.ray_process.call.remote(self.attribute_name, *args, **kwargs)
+        is_done = False
+        while not is_done:
+            is_done = bool(ray.wait([ray_id], timeout=PROGRESS_POLL_INTERVAL)[0])
+            # The actor's calls have been queued when the method returns.
+            for report in queue.get_nowait_batch(queue.qsize()):
+                progress(report)
+        return_value = ray.get(ray_id)
+        if isinstance(return_value, ExceptionWrapper):
+            raise return_value.e
+        return return_value
+
+
+class CallbackProcessApplicationProxy(ProcessApplicationProxy):
+    def __getattr__(self, item: str) -> CallbackAttributeProxy:
+        return CallbackAttributeProxy(self.ray_process, item)
+
+
+class TunedRayRunner(RayRunner):
+    """
+    Ray runner that can run the system in several partitions, and that
+    batches the delivery of notifications between actors.
+
+    Each partition is a pipeline with its own actor for each process
+    application, so ``num_partitions`` actors process the events of each
+    process application. The partitions share the database, so they need
+    infrastructure that is shared between operating system processes, such
+    as SQLAlchemy with a database server or an SQLite file. Commands should
+    be sent to the partition of their account, see ``get_pipeline_id()``.
+    """
+
+    def __init__(
+        self,
+        system: System,
+        num_partitions: int = 1,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        push_notifications: bool = True,
+        notifications_by_reference: bool = False,
+        **kwargs: Any
+    ):
+        assert num_partitions > 0, num_partitions
+        kwargs.setdefault("pipeline_ids", range(num_partitions))
+        super(TunedRayRunner, self).__init__(system, **kwargs)
+        self.actor_options = {
+            "page_size": page_size,
+            "push_notifications": push_notifications,
+            "notifications_by_reference": notifications_by_reference,
+        }
+
+    def start(self) -> None:
+        infrastructure_class = self.infrastructure_class
+        if (
+            len(self.pipeline_ids) > 1
+            and isinstance(infrastructure_class, type)
+            and issubclass(infrastructure_class, PopoApplication)
+        ):
+            raise ProgrammingError("Partitions can't share POPO infrastructure")
+
+        env_vars = {
+            name: os.environ[name]
+            for name in INFRASTRUCTURE_ENV_VARS
+            if name in os.environ
+        }
+        if self.db_uri:
+            env_vars["DB_URI"] = self.db_uri
+
+        for pipeline_id in self.pipeline_ids:
+            for process_name, process_class in self.system.process_classes.items():
+                self.ray_processes[
+                    (process_name, pipeline_id)
+                ] = TunedRayProcessActor.remote(
+                    application_process_class=process_class,
+                    infrastructure_class=infrastructure_class,
+                    env_vars=env_vars,
+                    poll_interval=self.poll_interval,
+                    pipeline_id=pipeline_id,
+                    setup_tables=self.setup_tables,
+                    **self.actor_options
+                )
+
+        init_ids = []
+        for (process_name, pipeline_id), ray_process in self.ray_processes.items():
+            upstream_processes = {
+                name: self.ray_processes[(name, pipeline_id)]
+                for name in self.system.upstream_names[process_name]
+            }
+            downstream_processes = {
+                name: self.ray_processes[(name, pipeline_id)]
+                for name in self.system.downstream_names[process_name]
+            }
+            init_ids.append(
+                ray_process.init.remote(upstream_processes, downstream_processes)
+            )
+        ray.get(init_ids)
+
+    def get(
+        self, process_class: Type[ProcessApplication], pipeline_id=DEFAULT_PIPELINE_ID
+    ) -> Any:
+        """
+        Returns a proxy of the application in its actor, which delivers the
+        calls of ``progress`` callbacks back to this process.
+        """
+        assert issubclass(process_class, ProcessApplication)
+        ray_process = self.get_ray_process(process_class.create_name(), pipeline_id)
+        return CallbackProcessApplicationProxy(ray_process)
+
+    def get_pipeline_id(self, partition_key: UUID) -> int:
+        """
+        Returns the pipeline ID of the partition of the given key, such as
+        an account ID.
+        """
+        return self.pipeline_ids[partition_key.int % len(self.pipeline_ids)]
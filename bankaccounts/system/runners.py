@@ -0,0 +1,426 @@
+"""
+Multi-threaded and multiprocess runners with adaptive scheduling of the
+followers.
+
+The library's runners pull once for each prompt, so a burst of upstream
+events causes a burst of small pulls, and poll on a fixed interval when
+idle. The followers of these runners coalesce the prompts that are queued
+into one pull per upstream application, pull again in bounded batches
+whilst there is a backlog, and back off exponentially when polls find nothing.
+"""
+import multiprocessing
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from queue import Empty, Queue
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    MutableSequence,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from eventsourcing.application.process import ProcessApplication, PromptToQuit
+from eventsourcing.application.simple import Prompt, PromptToPull
+from eventsourcing.domain.model.decorators import retry
+from eventsourcing.exceptions import (
+    CausalDependencyFailed,
+    EventSourcingError,
+    OperationalError,
+    ProgrammingError,
+    RecordConflictError,
+)
+from eventsourcing.system import multiprocess, runner
+from eventsourcing.system.definition import System
+from eventsourcing.system.multiprocess import MultiprocessRunner, OperatingSystemProcess
+from eventsourcing.system.runner import (
+    MultiThreadedRunner,
+    PromptQueuedApplicationThread,
+)
+
+DEFAULT_MIN_POLL_INTERVAL = 0.5
+DEFAULT_MAX_POLL_INTERVAL = 60.0
+DEFAULT_BACKOFF_FACTOR = 2.0
+DEFAULT_EAGER_THRESHOLD = 50
+
+
+_constructed_by_lock = threading.Lock()
+
+
+@contextmanager
+def _constructed_by(
+    module: ModuleType, class_name: str, factory: Callable[..., Any]
+) -> Iterator[None]:
+    """
+    Has the runners of the library's module construct their application
+    threads or operating system processes with the given factory, whilst
+    a runner is being started, since the library has no hook for this.
+
+    The library's class is put back whilst the factory runs, because its
+    constructor refers to it by name.
+    """
+
+    def construct(*args: Any, **kwargs: Any) -> Any:
+        setattr(module, class_name, original)
+        try:
+            return factory(*args, **kwargs)
+        finally:
+            setattr(module, class_name, construct)
+
+    with _constructed_by_lock:
+        original = getattr(module, class_name)
+        setattr(module, class_name, construct)
+        try:
+            yield
+        finally:
+            setattr(module, class_name, original)
+
+
+class AdaptivePolling(NamedTuple):
+    """
+    Scheduling options of the followers.
+
+    Polls start at ``min_poll_interval``, and the interval is multiplied by
+    ``backoff_factor`` after each poll that finds nothing, up to
+    ``max_poll_interval``. Prompted pulls process at most ``eager_threshold``
+    notifications, and a pull that reaches the limit is followed by another
+    pull without waiting for a prompt.
+    After a prompt, followers wait ``coalesce_window`` seconds for more
+    prompts before pulling.
+    """
+
+    min_poll_interval: float = DEFAULT_MIN_POLL_INTERVAL
+    max_poll_interval: float = DEFAULT_MAX_POLL_INTERVAL
+    backoff_factor: float = DEFAULT_BACKOFF_FACTOR
+    eager_threshold: int = DEFAULT_EAGER_THRESHOLD
+    coalesce_window: float = 0.0
+
+    def backoff(self, poll_interval: float) -> float:
+        return min(poll_interval * self.backoff_factor, self.max_poll_interval)
+
+
+class FollowerStats(object):
+    """
+    Counts the prompts received by a follower, and the pulls it has done.
+
+    The counts are kept in a sequence of numbers, which can be a shared
+    memory array, so the parent process can read the counts of the followers
+    of the multiprocess runner.
+    """
+
+    fields = (
+        "prompts_received",
+        "pulls",
+        "eager_pulls",
+        "polls",
+        "empty_pulls",
+        "notifications_processed",
+        "poll_interval",
+    )
+
+    def __init__(self, values: Optional[MutableSequence[float]] = None):
+        if values is None:
+            values = [0] * len(self.fields)
+        assert len(values) == len(self.fields), values
+        self._values = values
+        self._indexes = {name: i for i, name in enumerate(self.fields)}
+
+    @classmethod
+    def shared(cls) -> "FollowerStats":
+        return cls(multiprocessing.RawArray("d", len(cls.fields)))
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            index = self.__dict__["_indexes"][name]
+        except KeyError:
+            raise AttributeError(name)
+        value = self._values[index]
+        return value if name == "poll_interval" else int(value)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self._values[self._indexes[name]] += amount
+
+    def set(self, name: str, value: float) -> None:
+        self._values[self._indexes[name]] = value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.fields}
+
+
+class AdaptivePromptLoop(ABC):
+    """
+    Loop on an inbox of prompts, for the application threads and operating
+    system processes of the adaptive runners.
+    """
+
+    if TYPE_CHECKING:
+        inbox: Queue
+        polling: AdaptivePolling
+        stats: FollowerStats
+
+    @abstractmethod
+    def run_process(
+        self, prompt: Optional[Prompt] = None, advance_by: Optional[int] = None
+    ) -> int:
+        """
+        Pulls and processes new notifications, up to ``advance_by`` from each
+        upstream application, and returns how many.
+        """
+
+    @abstractmethod
+    def close_process(self) -> None:
+        """
+        Closes the process application.
+        """
+
+    def loop_adaptively(self) -> None:
+        poll_interval = self.polling.min_poll_interval
+        while True:
+            self.stats.set("poll_interval", poll_interval)
+            try:
+                item = self.inbox.get(timeout=poll_interval)
+            except Empty:
+                # Polling after a timeout, less often whilst nothing is found.
+                self.stats.increment("polls")
+                if self._pull():
+                    poll_interval = self.polling.min_poll_interval
+                else:
+                    poll_interval = self.polling.backoff(poll_interval)
+                continue
+            self.inbox.task_done()
+
+            # Coalesce the prompts that are queued.
+            if self.polling.coalesce_window:
+                time.sleep(self.polling.coalesce_window)
+            items = [item] + self._get_queued_items()
+            self.stats.increment("prompts_received", len(items))
+            if any(isinstance(i, PromptToQuit) for i in items):
+                self.close_process()
+                break
+            prompts: Dict[Tuple[str, int], PromptToPull] = {}
+            for item in items:
+                if not isinstance(item, PromptToPull):
+                    raise ProgrammingError("Unsupported prompt: {}".format(item))
+                prompts[(item.process_name, item.pipeline_id)] = item
+
+            # Pull batches of up to eager_threshold notifications from each
+            # upstream application in turn, whilst there is a backlog.
+            eager_threshold = self.polling.eager_threshold
+            backlog = list(prompts.values())
+            self.stats.increment("pulls", len(backlog))
+            while backlog:
+                backlog = [
+                    prompt
+                    for prompt in backlog
+                    if self._pull(prompt, eager_threshold) >= eager_threshold
+                ]
+                self.stats.increment("eager_pulls", len(backlog))
+            poll_interval = self.polling.min_poll_interval
+
+    def _get_queued_items(self) -> List[Union[Prompt, str]]:
+        items = []
+        while True:
+            try:
+                items.append(self.inbox.get_nowait())
+            except Empty:
+                return items
+            self.inbox.task_done()
+
+    def _pull(
+        self, prompt: Optional[PromptToPull] = None, advance_by: Optional[int] = None
+    ) -> int:
+        num_processed = self.run_process(prompt, advance_by) or 0
+        if num_processed:
+            self.stats.increment("notifications_processed", num_processed)
+        else:
+            self.stats.increment("empty_pulls")
+        return num_processed
+
+
+class AdaptiveApplicationThread(AdaptivePromptLoop, PromptQueuedApplicationThread):
+    def __init__(
+        self,
+        *,
+        polling: AdaptivePolling,
+        stats: Optional[FollowerStats] = None,
+        **kwargs: Any
+    ):
+        kwargs.setdefault("poll_interval", polling.min_poll_interval)
+        super(AdaptiveApplicationThread, self).__init__(**kwargs)
+        self.polling = polling
+        self.stats = stats or FollowerStats()
+
+    def loop_on_prompts(self) -> None:
+        self.is_running.set()
+        self.loop_adaptively()
+
+    def run_process(
+        self, prompt: Optional[Prompt] = None, advance_by: Optional[int] = None
+    ) -> int:
+        try:
+            return self._run_process(prompt, advance_by)
+        except EventSourcingError:
+            return 0
+
+    @retry(CausalDependencyFailed, max_attempts=100, wait=0.2)
+    @retry((OperationalError, RecordConflictError), max_attempts=100, wait=0.01)
+    def _run_process(
+        self, prompt: Optional[Prompt] = None, advance_by: Optional[int] = None
+    ) -> int:
+        return self.app.run(prompt, advance_by)
+
+    def close_process(self) -> None:
+        self.app.close()
+
+
+class AdaptiveOperatingSystemProcess(AdaptivePromptLoop, OperatingSystemProcess):
+    def __init__(
+        self,
+        *args: Any,
+        polling: AdaptivePolling,
+        stats: Optional[FollowerStats] = None,
+        **kwargs: Any
+    ):
+        kwargs.setdefault("poll_interval", polling.min_poll_interval)
+        super(AdaptiveOperatingSystemProcess, self).__init__(*args, **kwargs)
+        self.polling = polling
+        self.stats = stats or FollowerStats.shared()
+
+    @retry(CausalDependencyFailed, max_attempts=100, wait=0.1)
+    def loop_on_prompts(self) -> None:
+        # Run once, in case prompts were missed.
+        self.run_process()
+        self.loop_adaptively()
+
+    @retry((OperationalError, RecordConflictError), max_attempts=100, wait=0.1)
+    def run_process(
+        self, prompt: Optional[Prompt] = None, advance_by: Optional[int] = None
+    ) -> int:
+        return self.process.run(prompt, advance_by)
+
+    def close_process(self) -> None:
+        self.process.close()
+
+
+class AdaptiveMultiThreadedRunner(MultiThreadedRunner):
+    """
+    Runs a system with a thread for each process, with adaptive scheduling.
+
+    The ``poll_interval`` is the minimum poll interval. The counts of each
+    process application's thread are in ``follower_stats``, by name.
+    """
+
+    def __init__(
+        self,
+        system: System,
+        poll_interval: Optional[float] = None,
+        max_poll_interval: float = DEFAULT_MAX_POLL_INTERVAL,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        eager_threshold: int = DEFAULT_EAGER_THRESHOLD,
+        coalesce_window: float = 0.0,
+        **kwargs: Any
+    ):
+        if kwargs.get("clock_speed"):
+            raise ProgrammingError("Adaptive runners can't be clocked")
+        self.polling = AdaptivePolling(
+            min_poll_interval=poll_interval or DEFAULT_MIN_POLL_INTERVAL,
+            max_poll_interval=max_poll_interval,
+            backoff_factor=backoff_factor,
+            eager_threshold=eager_threshold,
+            coalesce_window=coalesce_window,
+        )
+        super(AdaptiveMultiThreadedRunner, self).__init__(
+            system, poll_interval=self.polling.min_poll_interval, **kwargs
+        )
+        self.follower_stats: Dict[str, FollowerStats] = {}
+
+    def start(self) -> None:
+        with _constructed_by(
+            runner, "PromptQueuedApplicationThread", self.create_thread
+        ):
+            super(AdaptiveMultiThreadedRunner, self).start()
+
+    def create_thread(
+        self, *, process: ProcessApplication, poll_interval: float, **kwargs: Any
+    ) -> AdaptiveApplicationThread:
+        """
+        Constructs the thread of a process application, in place of the
+        library's ``PromptQueuedApplicationThread``.
+        """
+        stats = FollowerStats()
+        self.follower_stats[process.name] = stats
+        return AdaptiveApplicationThread(
+            process=process, polling=self.polling, stats=stats, **kwargs
+        )
+
+
+class AdaptiveMultiprocessRunner(MultiprocessRunner):
+    """
+    Runs a system with an operating system process for each process
+    application, with adaptive scheduling.
+
+    The ``poll_interval`` is the minimum poll interval. The counts of each
+    operating system process are in ``follower_stats``, by pipeline ID and
+    name, in shared memory.
+    """
+
+    def __init__(
+        self,
+        system: System,
+        poll_interval: Optional[float] = None,
+        max_poll_interval: float = DEFAULT_MAX_POLL_INTERVAL,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        eager_threshold: int = DEFAULT_EAGER_THRESHOLD,
+        coalesce_window: float = 0.0,
+        **kwargs: Any
+    ):
+        self.polling = AdaptivePolling(
+            min_poll_interval=poll_interval or DEFAULT_MIN_POLL_INTERVAL,
+            max_poll_interval=max_poll_interval,
+            backoff_factor=backoff_factor,
+            eager_threshold=eager_threshold,
+            coalesce_window=coalesce_window,
+        )
+        super(AdaptiveMultiprocessRunner, self).__init__(
+            system, poll_interval=self.polling.min_poll_interval, **kwargs
+        )
+        self.follower_stats: Dict[Tuple[int, str], FollowerStats] = {}
+
+    def start(self) -> None:
+        with _constructed_by(
+            multiprocess, "OperatingSystemProcess", self.create_os_process
+        ):
+            super(AdaptiveMultiprocessRunner, self).start()
+
+    def create_os_process(
+        self,
+        *,
+        application_process_class: Type[ProcessApplication],
+        pipeline_id: int,
+        poll_interval: float,
+        **kwargs: Any
+    ) -> AdaptiveOperatingSystemProcess:
+        """
+        Constructs the operating system process of a process application, in
+        place of the library's ``OperatingSystemProcess``.
+        """
+        stats = FollowerStats.shared()
+        name = application_process_class.create_name()
+        self.follower_stats[(pipeline_id, name)] = stats
+        return AdaptiveOperatingSystemProcess(
+            application_process_class=application_process_class,
+            pipeline_id=pipeline_id,
+            polling=self.polling,
+            stats=stats,
+            **kwargs
+        )
@@ -1,10 +1,11 @@
 from eventsourcing.application.decorators import applicationpolicy
-from eventsourcing.application.process import ProcessApplication
 from eventsourcing.domain.model.aggregate import BaseAggregateRoot
 from eventsourcing.domain.model.decorators import retry
 from eventsourcing.exceptions import RepositoryKeyError
 
 from bankaccounts.domainmodel import BankAccount
+from bankaccounts.profiling import ProfiledProcessApplication
+from bankaccounts.system.notificationlog import ReadAheadNotificationLogReader
 from bankaccounts.system.commands import (
     DepositFundsCommand,
     TransferFundsCommand,
@@ -73,7 +74,11 @@ class TransferFundsSaga(BaseSaga):
     def handle_bank_account_transaction_appended(
         self, event: BankAccount.TransactionAppended
     ):
-        if self.was_debit_account_debited(event):
+        if event.is_single_pass:
+            # Both accounts were updated together, so the credit completes it.
+            if self.was_credit_account_credited_in_single_pass(event):
+                self.saga_has_succeeded()
+        elif self.was_debit_account_debited(event):
             self.require_credit_account_credit()
         elif self.was_credit_account_credited(event):
             self.saga_has_succeeded()
@@ -94,6 +99,13 @@ class TransferFundsSaga(BaseSaga):
             and event.amount == self.amount
         )
 
+    def was_credit_account_credited_in_single_pass(self, event):
+        return (
+            self.has_debit_account_debited is False
+            and event.originator_id == self.credit_account_id
+            and event.amount == self.amount
+        )
+
     def was_debit_account_refunded(self, event):
         return (
             self.has_debit_account_debited is True
@@ -141,7 +153,7 @@ class TransferFundsSaga(BaseSaga):
             obj.errors.append(self.credit_account_error)
 
 
-class Sagas(ProcessApplication):
+class Sagas(ProfiledProcessApplication):
     def get_saga(self, transaction_id) -> BaseSaga:
         saga = self.repository[transaction_id]
         assert isinstance(saga, BaseSaga)
@@ -178,11 +190,28 @@ class Sagas(ProcessApplication):
 
     @policy.register(BankAccount.TransactionAppended)
     def _(self, repository, event):
-        saga: BaseSaga = repository[event.transaction_id]
-        saga.handle_bank_account_transaction_appended(event)
+        # Opening balances aren't made by sagas.
+        if event.transaction_id:
+            saga: BaseSaga = repository[event.transaction_id]
+            saga.handle_bank_account_transaction_appended(event)
 
     @policy.register(BankAccount.ErrorRecorded)
     def _(self, repository, event):
         if event.transaction_id:
             saga: BaseSaga = repository[event.transaction_id]
             saga.handle_bank_account_error_recorded(event)
+
+
+class ReadAheadSagas(Sagas):
+    """
+    Sagas application that reads its upstream notification logs through the
+    read-ahead cache, by its class, so that the cache is also used by the
+    multiprocess and Ray runners. It has the same name as the Sagas
+    application.
+    """
+
+    notification_log_reader_class = ReadAheadNotificationLogReader
+
+    @classmethod
+    def create_name(cls):
+        return Sagas.create_name()
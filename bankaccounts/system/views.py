@@ -0,0 +1,205 @@
+from collections import OrderedDict
+from decimal import Decimal
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+from uuid import UUID
+
+from eventsourcing.domain.model.aggregate import BaseAggregateRoot
+
+from bankaccounts.domainmodel import BankAccount
+from bankaccounts.exceptions import AccountClosedError, InsufficientFundsError
+
+DEFAULT_MAX_ACCOUNTS = 100000
+
+
+class AccountStatus(NamedTuple):
+    version: int
+    balance: Decimal
+    overdraft_limit: Decimal
+    is_closed: bool
+
+
+def initial_account_status(event: BaseAggregateRoot.Created) -> AccountStatus:
+    return AccountStatus(
+        version=event.originator_version,
+        balance=Decimal("0.00"),
+        overdraft_limit=Decimal("0.00"),
+        is_closed=False,
+    )
+
+
+def get_account_status(account: BankAccount) -> AccountStatus:
+    return AccountStatus(
+        version=account.__version__,
+        balance=account.balance,
+        overdraft_limit=account.overdraft_limit,
+        is_closed=account.is_closed,
+    )
+
+
+def apply_account_event(
+    status: AccountStatus, event: BaseAggregateRoot.Event
+) -> AccountStatus:
+    """
+    Returns the status of an account after the given event.
+    """
+    status = status._replace(version=event.originator_version)
+    if isinstance(event, BankAccount.TransactionAppended):
+        status = status._replace(balance=status.balance + event.amount)
+    elif isinstance(event, BankAccount.OverdraftLimitSet):
+        status = status._replace(overdraft_limit=event.overdraft_limit)
+    elif isinstance(event, BankAccount.Closed):
+        status = status._replace(is_closed=True)
+    return status
+
+
+class PendingCredit(NamedTuple):
+    account_id: UUID
+    amount: Decimal
+    refund_account_id: Optional[UUID]
+
+
+class AccountStatusView(object):
+    """
+    In-memory view of the status of recently used accounts.
+
+    The view is updated by the Accounts process application after it has
+    recorded new events, and so it is only useful when Commands and Accounts
+    run in the same operating system process. The view is marked as
+    ``is_published`` when an Accounts application that updates it starts
+    following its upstream applications, and isn't used until then.
+    Statuses are immutable, so they can be read without locking. Credits
+    that have been requested but not yet applied are counted as available
+    funds, so that a transaction is only rejected if it is bound to fail.
+    """
+
+    def __init__(self, max_accounts: int = DEFAULT_MAX_ACCOUNTS):
+        self.max_accounts = max_accounts
+        self.is_published = False
+        self._statuses: OrderedDict[UUID, AccountStatus] = OrderedDict()
+        self._pending_credits: Dict[UUID, PendingCredit] = {}
+        self._pending_totals: Dict[UUID, Decimal] = {}
+        self._lock = Lock()
+
+    def get(self, account_id: UUID) -> Optional[AccountStatus]:
+        return self._statuses.get(account_id)
+
+    def put(self, account: BankAccount) -> AccountStatus:
+        """
+        Puts the status of an account, unless a later status is known.
+
+        Returns the latest known status.
+        """
+        status = get_account_status(account)
+        with self._lock:
+            current = self._statuses.get(account.id)
+            if current is None or current.version < status.version:
+                self._set_status(account.id, status)
+                return status
+            return current
+
+    def update(self, events: Iterable[BaseAggregateRoot.Event]) -> Set[UUID]:
+        """
+        Applies newly recorded events to the view.
+
+        Returns the IDs of accounts whose status couldn't be derived
+        from the events, because their previous status isn't known.
+        """
+        unknown: Set[UUID] = set()
+        with self._lock:
+            for event in events:
+                account_id = event.originator_id
+                self._settle_pending_credit(event)
+                if isinstance(event, BaseAggregateRoot.Created):
+                    status: Optional[AccountStatus] = initial_account_status(event)
+                else:
+                    status = self._statuses.get(account_id)
+                    if status is not None:
+                        if event.originator_version <= status.version:
+                            continue
+                        if event.originator_version != status.version + 1:
+                            status = None
+                    if status is None:
+                        self._statuses.pop(account_id, None)
+                        unknown.add(account_id)
+                        continue
+                    status = apply_account_event(status, event)
+                self._set_status(account_id, status)
+                unknown.discard(account_id)
+        return unknown
+
+    def _set_status(self, account_id: UUID, status: AccountStatus) -> None:
+        self._statuses[account_id] = status
+        self._statuses.move_to_end(account_id)
+        while len(self._statuses) > self.max_accounts:
+            self._statuses.popitem(last=False)
+
+    def add_pending_credit(
+        self,
+        transaction_id: UUID,
+        account_id: UUID,
+        amount: Decimal,
+        refund_account_id: Optional[UUID] = None,
+    ) -> None:
+        with self._lock:
+            self._add_pending_credit(
+                transaction_id, PendingCredit(account_id, amount, refund_account_id)
+            )
+
+    def discard_pending_credit(self, transaction_id: UUID) -> None:
+        with self._lock:
+            self._remove_pending_credit(transaction_id)
+
+    def _add_pending_credit(self, transaction_id: UUID, credit: PendingCredit):
+        self._pending_credits[transaction_id] = credit
+        total = self._pending_totals.get(credit.account_id, Decimal("0.00"))
+        self._pending_totals[credit.account_id] = total + credit.amount
+
+    def _remove_pending_credit(self, transaction_id: UUID) -> Optional[PendingCredit]:
+        credit = self._pending_credits.pop(transaction_id, None)
+        if credit is not None:
+            total = self._pending_totals[credit.account_id] - credit.amount
+            if total:
+                self._pending_totals[credit.account_id] = total
+            else:
+                del self._pending_totals[credit.account_id]
+        return credit
+
+    def _settle_pending_credit(self, event: BaseAggregateRoot.Event) -> None:
+        transaction_id = event.__dict__.get("transaction_id")
+        if transaction_id is None:
+            return
+        credit = self._pending_credits.get(transaction_id)
+        if credit is None:
+            return
+        if isinstance(event, BankAccount.TransactionAppended):
+            if event.originator_id == credit.account_id:
+                self._remove_pending_credit(transaction_id)
+        elif isinstance(event, BankAccount.ErrorRecorded):
+            self._remove_pending_credit(transaction_id)
+            if event.originator_id == credit.account_id and credit.refund_account_id:
+                # Failed transfer credit, so the debit account will be refunded.
+                self._add_pending_credit(
+                    transaction_id,
+                    PendingCredit(credit.refund_account_id, credit.amount, None),
+                )
+
+    def check_transaction(self, account_id: UUID, amount: Decimal) -> None:
+        """
+        Raises a transaction error if a transaction is bound to fail.
+        """
+        status = self._statuses.get(account_id)
+        if status is None:
+            return
+        if status.is_closed:
+            raise AccountClosedError({"account_id": account_id})
+        pending = self._pending_totals.get(account_id, Decimal("0.00"))
+        if status.balance + pending + amount < -status.overdraft_limit:
+            raise InsufficientFundsError({"account_id": account_id})
+
+    def __len__(self) -> int:
+        return len(self._statuses)
+
+    def list_pending_credits(self) -> List[PendingCredit]:
+        with self._lock:
+            return list(self._pending_credits.values())
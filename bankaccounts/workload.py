@@ -0,0 +1,464 @@
+"""
+Generates synthetic workloads for the bank accounts applications,
+records them to files, and replays them deterministically.
+
+Generate a workload, and replay it against the system::
+
+    python -m bankaccounts.workload generate workload.jsonl --accounts 1000
+    python -m bankaccounts.workload replay workload.jsonl --system --runner threaded
+
+Replay a workload concurrently against the simple application, with
+accounts locked in the application::
+
+    python -m bankaccounts.workload replay workload.jsonl --threads 8 --lock-stripes 256
+"""
+import argparse
+import bisect
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from decimal import Decimal
+from threading import Lock, Thread
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from eventsourcing.exceptions import RecordConflictError
+
+from bankaccounts.exceptions import LockTimeoutError, TransactionError
+
+CREATE = "create"
+DEPOSIT = "deposit"
+WITHDRAW = "withdraw"
+TRANSFER = "transfer"
+SET_OVERDRAFT_LIMIT = "set_overdraft_limit"
+CLOSE = "close"
+
+DEFAULT_MAX_ATTEMPTS = 10
+
+DEFAULT_MIX = {
+    DEPOSIT: 0.4,
+    WITHDRAW: 0.3,
+    TRANSFER: 0.25,
+    SET_OVERDRAFT_LIMIT: 0.04,
+    CLOSE: 0.01,
+}
+
+
+class Operation(NamedTuple):
+    kind: str
+    account: int
+    other_account: Optional[int] = None
+    amount: Optional[Decimal] = None
+
+    def to_json(self) -> str:
+        d: Dict[str, Any] = {"kind": self.kind, "account": self.account}
+        if self.other_account is not None:
+            d["other_account"] = self.other_account
+        if self.amount is not None:
+            d["amount"] = str(self.amount)
+        return json.dumps(d)
+
+    @classmethod
+    def from_json(cls, line: str) -> "Operation":
+        d = json.loads(line)
+        amount = d.get("amount")
+        return cls(
+            kind=d["kind"],
+            account=d["account"],
+            other_account=d.get("other_account"),
+            amount=Decimal(amount) if amount is not None else None,
+        )
+
+
+class WorkloadGenerator(object):
+    """
+    Generates operations on a number of accounts, with account activity
+    following a Zipf distribution, so that a few accounts are hot.
+
+    A proportion of withdrawals and transfers (the overdraft rate) are
+    for amounts that exceed any balance, so that they fail.
+    """
+
+    def __init__(
+        self,
+        num_accounts: int = 100,
+        zipf_exponent: float = 1.1,
+        mix: Optional[Dict[str, float]] = None,
+        overdraft_rate: float = 0.05,
+        max_amount: Decimal = Decimal("100.00"),
+        seed: Optional[int] = None,
+    ):
+        assert num_accounts > 1, num_accounts
+        self.num_accounts = num_accounts
+        self.mix = mix or DEFAULT_MIX
+        self.overdraft_rate = overdraft_rate
+        self.max_amount = max_amount
+        self.random = random.Random(seed)
+
+        # Assign the Zipf ranks to accounts randomly, so hot accounts aren't
+        # just the first ones to be created.
+        ranked_accounts = list(range(num_accounts))
+        self.random.shuffle(ranked_accounts)
+        self.ranked_accounts = ranked_accounts
+        weights = [1 / rank ** zipf_exponent for rank in range(1, num_accounts + 1)]
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.kinds = list(self.mix.keys())
+        self.kind_cum_weights = list(itertools.accumulate(self.mix.values()))
+
+    def generate(self, num_operations: int) -> List[Operation]:
+        """
+        Returns operations that create the accounts, followed by
+        the given number of other operations.
+        """
+        operations = [Operation(CREATE, i) for i in range(self.num_accounts)]
+        for _ in range(num_operations):
+            operations.append(self.generate_operation())
+        return operations
+
+    def generate_operation(self) -> Operation:
+        kind = self.random.choices(self.kinds, cum_weights=self.kind_cum_weights)[0]
+        account = self.choose_account()
+        if kind == DEPOSIT:
+            return Operation(kind, account, amount=self.choose_amount())
+        elif kind == WITHDRAW:
+            return Operation(kind, account, amount=self.choose_debit_amount())
+        elif kind == TRANSFER:
+            other_account = self.choose_account()
+            while other_account == account:
+                other_account = self.choose_account()
+            return Operation(
+                kind, account, other_account, amount=self.choose_debit_amount()
+            )
+        elif kind == SET_OVERDRAFT_LIMIT:
+            return Operation(kind, account, amount=self.choose_amount())
+        elif kind == CLOSE:
+            return Operation(kind, account)
+        else:
+            raise ValueError("Unsupported operation: {}".format(kind))
+
+    def choose_account(self) -> int:
+        x = self.random.random() * self.cum_weights[-1]
+        rank = bisect.bisect(self.cum_weights, x)
+        return self.ranked_accounts[min(rank, self.num_accounts - 1)]
+
+    def choose_amount(self) -> Decimal:
+        cents = self.random.randint(1, int(self.max_amount * 100))
+        return Decimal(cents) / 100
+
+    def choose_debit_amount(self) -> Decimal:
+        if self.random.random() < self.overdraft_rate:
+            # More than could have been deposited in all the accounts.
+            return self.max_amount * self.num_accounts * 1000
+        return self.choose_amount()
+
+
+def save_workload(operations: Iterable[Operation], path: str) -> None:
+    with open(path, "w") as f:
+        for operation in operations:
+            f.write(operation.to_json())
+            f.write("\n")
+
+
+def load_workload(path: str) -> List[Operation]:
+    with open(path) as f:
+        return [Operation.from_json(line) for line in f if line.strip()]
+
+
+class ReplayResult(object):
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.conflicts = 0
+        self.elapsed = 0.0
+
+    @property
+    def num_operations(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def throughput(self) -> float:
+        if not self.elapsed:
+            return 0.0
+        return self.num_operations / self.elapsed
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        index = min(int(len(latencies) * p / 100), len(latencies) - 1)
+        return latencies[index]
+
+    def summary(self) -> str:
+        return (
+            "{} operations in {:.3f}s ({:.1f} ops/s), latency p50 {:.6f}s "
+            "p99 {:.6f}s, errors {}, conflicts {}".format(
+                self.num_operations,
+                self.elapsed,
+                self.throughput,
+                self.percentile(50),
+                self.percentile(99),
+                dict(self.errors),
+                self.conflicts,
+            )
+        )
+
+
+def replay_workload(
+    operations: Sequence[Operation],
+    accounts: Any,
+    commands: Any = None,
+    rate: Optional[float] = None,
+) -> ReplayResult:
+    """
+    Replays operations in order, either as fast as possible, or at the given
+    rate of operations per second.
+
+    Accounts are created and changed with the given ``accounts`` application,
+    and funds are moved with the given ``commands`` application. Replay
+    against a ``SimpleBankAccountApplication`` by giving it as ``accounts``
+    only, or against a ``BankAccountSystem`` by giving its ``Accounts`` and
+    ``Commands`` process applications. Errors raised by the applications
+    are counted by type (the system processes its commands asynchronously,
+    so in that case most errors are recorded on the sagas).
+    """
+    commands = commands or accounts
+    account_ids: Dict[int, Any] = {}
+    result = ReplayResult()
+    started = time.perf_counter()
+    for i, operation in enumerate(operations):
+        if rate:
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        op_started = time.perf_counter()
+        try:
+            apply_operation(operation, accounts, commands, account_ids)
+        except TransactionError as e:
+            result.errors[type(e).__name__] += 1
+        result.latencies.append(time.perf_counter() - op_started)
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def apply_operation(
+    operation: Operation, accounts: Any, commands: Any, account_ids: Dict[int, Any]
+) -> None:
+    if operation.kind == CREATE:
+        account_ids[operation.account] = accounts.create_account()
+    elif operation.kind == DEPOSIT:
+        commands.deposit_funds(account_ids[operation.account], operation.amount)
+    elif operation.kind == WITHDRAW:
+        commands.withdraw_funds(account_ids[operation.account], operation.amount)
+    elif operation.kind == TRANSFER:
+        commands.transfer_funds(
+            account_ids[operation.account],
+            account_ids[operation.other_account],
+            operation.amount,
+        )
+    elif operation.kind == SET_OVERDRAFT_LIMIT:
+        accounts.set_overdraft_limit(account_ids[operation.account], operation.amount)
+    elif operation.kind == CLOSE:
+        accounts.close_account(account_ids[operation.account])
+    else:
+        raise ValueError("Unsupported operation: {}".format(operation.kind))
+
+
+def stress_workload(
+    operations: Sequence[Operation],
+    app: Any,
+    num_threads: int = 8,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> ReplayResult:
+    """
+    Replays operations concurrently against a ``SimpleBankAccountApplication``,
+    with the accounts created first, and then the other operations shared
+    between ``num_threads`` threads.
+
+    Operations that conflict with concurrent operations on the same accounts
+    are retried, up to ``max_attempts`` attempts, and the conflicts are
+    counted. Operations that still conflict, or whose accounts can't be
+    locked in time, are counted as errors.
+    """
+    account_ids: Dict[int, Any] = {}
+    others = []
+    for operation in operations:
+        if operation.kind == CREATE:
+            apply_operation(operation, app, app, account_ids)
+        else:
+            others.append(operation)
+
+    result = ReplayResult()
+    lock = Lock()
+
+    def run(thread_operations: Sequence[Operation]) -> None:
+        for operation in thread_operations:
+            op_started = time.perf_counter()
+            conflicts = 0
+            error = None
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    apply_operation(operation, app, app, account_ids)
+                except RecordConflictError as e:
+                    conflicts += 1
+                    if attempt == max_attempts:
+                        error = type(e).__name__
+                    # Otherwise redo the load-mutate-save cycle.
+                    continue
+                except (TransactionError, LockTimeoutError) as e:
+                    error = type(e).__name__
+                break
+            latency = time.perf_counter() - op_started
+            with lock:
+                result.latencies.append(latency)
+                result.conflicts += conflicts
+                if error:
+                    result.errors[error] += 1
+
+    threads = [
+        Thread(target=run, args=(others[i::num_threads],)) for i in range(num_threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def main(args: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m bankaccounts.workload")
+    subparsers = parser.add_subparsers(dest="command")
+    # The required argument of add_subparsers() needs Python 3.7.
+    subparsers.required = True
+
+    generate_parser = subparsers.add_parser("generate", help="Generate a workload.")
+    generate_parser.add_argument("path")
+    generate_parser.add_argument("--accounts", type=int, default=100)
+    generate_parser.add_argument("--operations", type=int, default=10000)
+    generate_parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    generate_parser.add_argument("--overdraft-rate", type=float, default=0.05)
+    generate_parser.add_argument("--seed", type=int, default=None)
+
+    replay_parser = subparsers.add_parser("replay", help="Replay a workload.")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--rate", type=float, default=None)
+    replay_parser.add_argument("--system", action="store_true")
+    replay_parser.add_argument(
+        "--runner",
+        choices=[
+            "single",
+            "threaded",
+            "multiprocess",
+            "adaptive-threaded",
+            "adaptive-multiprocess",
+            "ray",
+        ],
+        default="single",
+    )
+    replay_parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Replay concurrently with the simple application.",
+    )
+    replay_parser.add_argument(
+        "--lock-stripes",
+        type=int,
+        default=0,
+        help="Lock accounts with this number of stripes in the simple application.",
+    )
+    infrastructure_group = replay_parser.add_mutually_exclusive_group()
+    infrastructure_group.add_argument(
+        "--sqlalchemy",
+        action="store_true",
+        help="Use SQLAlchemy infrastructure (configured with DB_URI).",
+    )
+    infrastructure_group.add_argument(
+        "--file",
+        action="store_true",
+        help="Use file infrastructure (configured with FILE_STORE_PATH).",
+    )
+
+    parsed = parser.parse_args(args)
+    if parsed.command == "generate":
+        generator = WorkloadGenerator(
+            num_accounts=parsed.accounts,
+            zipf_exponent=parsed.zipf_exponent,
+            overdraft_rate=parsed.overdraft_rate,
+            seed=parsed.seed,
+        )
+        save_workload(generator.generate(parsed.operations), parsed.path)
+    else:
+        operations = load_workload(parsed.path)
+        result = replay(operations, parsed)
+        print(result.summary())
+
+
+def replay(operations: Sequence[Operation], parsed: argparse.Namespace):
+    if parsed.sqlalchemy:
+        from eventsourcing.application.sqlalchemy import SQLAlchemyApplication
+
+        infrastructure_class: Any = SQLAlchemyApplication
+    elif parsed.file:
+        from bankaccounts.filestore import FileApplication
+
+        infrastructure_class = FileApplication
+    else:
+        from eventsourcing.application.popo import PopoApplication
+
+        infrastructure_class = PopoApplication
+
+    if not parsed.system:
+        from bankaccounts.locking import StripedLockManager
+        from bankaccounts.simpleapplication import SimpleBankAccountApplication
+
+        lock_manager = None
+        if parsed.lock_stripes:
+            lock_manager = StripedLockManager(num_stripes=parsed.lock_stripes)
+        app_class = SimpleBankAccountApplication.mixin(infrastructure_class)
+        with app_class(lock_manager=lock_manager) as app:
+            if parsed.threads > 1:
+                return stress_workload(operations, app, num_threads=parsed.threads)
+            return replay_workload(operations, app, rate=parsed.rate)
+
+    from eventsourcing.system.multiprocess import MultiprocessRunner
+    from eventsourcing.system.runner import MultiThreadedRunner, SingleThreadedRunner
+
+    from bankaccounts.system.accounts import Accounts
+    from bankaccounts.system.commands import Commands
+    from bankaccounts.system.definition import BankAccountSystem
+    from bankaccounts.system.runners import (
+        AdaptiveMultiprocessRunner,
+        AdaptiveMultiThreadedRunner,
+    )
+
+    runner_class: Any
+    if parsed.runner == "ray":
+        # Ray is slow to import, so it is only imported when it is used.
+        from bankaccounts.system.rayrunner import TunedRayRunner
+
+        runner_class = TunedRayRunner
+    else:
+        runner_class = {
+            "single": SingleThreadedRunner,
+            "threaded": MultiThreadedRunner,
+            "multiprocess": MultiprocessRunner,
+            "adaptive-threaded": AdaptiveMultiThreadedRunner,
+            "adaptive-multiprocess": AdaptiveMultiprocessRunner,
+        }[parsed.runner]
+    system = BankAccountSystem(
+        infrastructure_class=infrastructure_class, setup_tables=True
+    )
+    with runner_class(system) as runner:
+        return replay_workload(
+            operations,
+            accounts=runner.get(Accounts),
+            commands=runner.get(Commands),
+            rate=parsed.rate,
+        )
+
+
+if __name__ == "__main__":
+    main()
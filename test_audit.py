@@ -0,0 +1,238 @@
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import TestCase
+
+from eventsourcing.application.popo import PopoApplication
+from eventsourcing.system.runner import SingleThreadedRunner
+
+from bankaccounts import audit
+from bankaccounts.audit import (
+    NPZ,
+    PARQUET,
+    STATE_FILENAME,
+    AuditExporter,
+    iter_tables,
+    to_minor_units,
+)
+from bankaccounts.onboarding import AccountSpec
+from bankaccounts.simpleapplication import SimpleBankAccountApplication
+from bankaccounts.system.accounts import Accounts
+from bankaccounts.system.commands import Commands
+from bankaccounts.system.definition import BankAccountSystem
+from bankaccounts.system.sagas import Sagas
+
+
+class WithBackend(TestCase):
+    backend = PARQUET
+
+    def setUp(self):
+        module = audit.pyarrow if self.backend == PARQUET else audit.numpy
+        if module is None:
+            self.skipTest("{} backend is not available".format(self.backend))
+        super().setUp()
+
+
+class TestToMinorUnits(TestCase):
+    def test_to_minor_units(self):
+        self.assertEqual(to_minor_units(Decimal("10.05")), (1005, 2))
+        self.assertEqual(to_minor_units(Decimal("-2")), (-200, 2))
+        self.assertEqual(to_minor_units(Decimal("1E+2")), (10000, 2))
+        self.assertEqual(to_minor_units(Decimal("0.001"), minor_units=3), (1, 3))
+
+        # Amounts with more decimal places have a larger scale.
+        self.assertEqual(to_minor_units(Decimal("0.005")), (5, 3))
+        self.assertEqual(to_minor_units(Decimal("-1.00510")), (-10051, 4))
+        for amount in ("0.015", "-1.0051", "123456.123456789", "7.10"):
+            value, scale = to_minor_units(Decimal(amount))
+            self.assertEqual(Decimal(value).scaleb(-scale), Decimal(amount))
+
+
+class TestAuditExportSimpleApplication(WithBackend):
+    def setUp(self):
+        super().setUp()
+        self.output_dir = tempfile.mkdtemp()
+        self.app = SimpleBankAccountApplication.mixin(PopoApplication)()
+
+    def tearDown(self):
+        self.app.close()
+        shutil.rmtree(self.output_dir)
+
+    def read_column(self, table_name, column_name):
+        values = []
+        for table in iter_tables(self.output_dir, table_name):
+            values.extend(table[column_name])
+        return values
+
+    def test_export_in_chunks_and_resume(self):
+        account_id1 = self.app.create_account()
+        account_id2 = self.app.create_account()
+        self.app.deposit_funds(account_id1, Decimal("10.05"))
+        self.app.transfer_funds(account_id1, account_id2, Decimal("2.00"))
+
+        exporter = AuditExporter(
+            self.output_dir, accounts=self.app, chunk_size=2, backend=self.backend
+        )
+        report = exporter.export()
+        self.assertEqual(report.num_notifications, 5)
+        self.assertEqual(report.num_rows["transactions"], 3)
+        self.assertEqual(report.positions, {"accounts": 5})
+        self.assertEqual(exporter.get_positions(), {"accounts": 5})
+        # The first chunk has no transactions.
+        self.assertEqual(len(report.paths), 2)
+        self.assertTrue(all(p.endswith("." + self.backend) for p in report.paths))
+        self.assertIn("3 transactions", report.summary())
+
+        self.assertEqual(self.read_column("transactions", "notification_id"), [3, 4, 5])
+        self.assertEqual(
+            self.read_column("transactions", "account_id"),
+            [str(account_id1), str(account_id1), str(account_id2)],
+        )
+        self.assertEqual(
+            self.read_column("transactions", "amount_minor"), [1005, -200, 200]
+        )
+        self.assertEqual(
+            self.read_column("transactions", "transaction_id"), ["", "", ""]
+        )
+
+        # Nothing new.
+        report = AuditExporter(self.output_dir, accounts=self.app).export()
+        self.assertEqual(report.num_notifications, 0)
+        self.assertEqual(report.paths, [])
+
+        # Resume from the last position.
+        self.app.withdraw_funds(account_id2, Decimal("0.50"))
+        report = AuditExporter(
+            self.output_dir, accounts=self.app, backend=self.backend
+        ).export()
+        self.assertEqual(report.num_notifications, 1)
+        self.assertEqual(report.positions, {"accounts": 6})
+        self.assertEqual(
+            self.read_column("transactions", "amount_minor"), [1005, -200, 200, -50]
+        )
+
+    def test_amounts_with_more_decimal_places_are_exported_exactly(self):
+        account_id = self.app.create_account()
+        amounts = [Decimal("1.005"), Decimal("2.00"), Decimal("-0.0001")]
+        for amount in amounts:
+            self.app.deposit_funds(account_id, amount)
+        report = AuditExporter(
+            self.output_dir, accounts=self.app, backend=self.backend
+        ).export()
+        self.assertEqual(report.positions, {"accounts": 4})
+        values = self.read_column("transactions", "amount_minor")
+        scales = self.read_column("transactions", "amount_scale")
+        self.assertEqual(values, [1005, 200, -1])
+        self.assertEqual(scales, [3, 2, 4])
+        self.assertEqual(
+            [Decimal(v).scaleb(-s) for v, s in zip(values, scales)], amounts
+        )
+
+    def test_interrupted_export_rewrites_chunk(self):
+        account_id = self.app.create_account()
+        self.app.deposit_funds(account_id, Decimal("1.00"))
+        exporter = AuditExporter(
+            self.output_dir, accounts=self.app, backend=self.backend
+        )
+        exporter.export()
+
+        # The state wasn't saved after the chunk was written.
+        os.remove(os.path.join(self.output_dir, STATE_FILENAME))
+        self.app.deposit_funds(account_id, Decimal("2.00"))
+        report = exporter.export()
+        self.assertEqual(report.num_notifications, 3)
+        self.assertEqual(self.read_column("transactions", "amount_minor"), [100, 200])
+
+    def test_bulk_onboarded_accounts(self):
+        self.app.create_accounts(
+            AccountSpec(opening_balance=Decimal(i), overdraft_limit=Decimal(1))
+            for i in range(1, 101)
+        )
+        report = AuditExporter(
+            self.output_dir, accounts=self.app, chunk_size=70, backend=self.backend
+        ).export()
+        self.assertEqual(report.num_notifications, 300)
+        self.assertEqual(len(report.paths), 5)
+        self.assertEqual(
+            sum(self.read_column("transactions", "amount_minor")), 505000
+        )
+
+
+class TestAuditExportSimpleApplicationNumpy(TestAuditExportSimpleApplication):
+    backend = NPZ
+
+
+class TestAuditExportSystem(WithBackend):
+    def setUp(self):
+        super().setUp()
+        self.output_dir = tempfile.mkdtemp()
+        self.runner = SingleThreadedRunner(
+            BankAccountSystem(infrastructure_class=PopoApplication)
+        )
+        self.runner.start()
+        self.accounts = self.runner.get(Accounts)
+        self.commands = self.runner.get(Commands)
+        self.sagas = self.runner.get(Sagas)
+
+    def tearDown(self):
+        self.runner.close()
+        shutil.rmtree(self.output_dir)
+
+    def test_export_transactions_errors_and_saga_outcomes(self):
+        account_id1 = self.accounts.create_account()
+        account_id2 = self.accounts.create_account()
+        deposit_id = self.commands.deposit_funds(account_id1, Decimal("10.00"))
+        withdraw_id = self.commands.withdraw_funds(account_id2, Decimal("1.00"))
+        transfer_id = self.commands.transfer_funds(
+            account_id1, account_id2, Decimal("2.50")
+        )
+
+        exporter = AuditExporter(
+            self.output_dir,
+            accounts=self.accounts,
+            sagas=self.sagas,
+            backend=self.backend,
+        )
+        report = exporter.export()
+        self.assertEqual(
+            report.num_rows, {"transactions": 3, "errors": 1, "saga_outcomes": 3}
+        )
+
+        (transactions,) = iter_tables(self.output_dir, "transactions")
+        self.assertEqual(transactions["amount_minor"], [1000, -250, 250])
+        self.assertEqual(
+            transactions["transaction_id"],
+            [str(deposit_id), str(transfer_id), str(transfer_id)],
+        )
+
+        (errors,) = iter_tables(self.output_dir, "errors")
+        self.assertEqual(errors["account_id"], [str(account_id2)])
+        self.assertEqual(errors["transaction_id"], [str(withdraw_id)])
+        self.assertEqual(errors["error_code"], ["insufficient_funds"])
+
+        outcomes = {}
+        for table in iter_tables(self.output_dir, "saga_outcomes"):
+            for transaction_id, saga_type, outcome, error_code in zip(
+                table["transaction_id"],
+                table["saga_type"],
+                table["outcome"],
+                table["error_code"],
+            ):
+                outcomes[transaction_id] = (saga_type, outcome, error_code)
+        self.assertEqual(
+            outcomes,
+            {
+                str(deposit_id): ("DepositFundsSaga", "succeeded", ""),
+                str(withdraw_id): (
+                    "WithdrawFundsSaga",
+                    "errored",
+                    "insufficient_funds",
+                ),
+                str(transfer_id): ("TransferFundsSaga", "succeeded", ""),
+            },
+        )
+
+
+class TestAuditExportSystemNumpy(TestAuditExportSystem):
+    backend = NPZ
@@ -1,8 +1,16 @@
 import os
+import shutil
+import tempfile
+import threading
+import time
 from decimal import Decimal
-from unittest import TestCase
+from queue import Empty, Queue
+from unittest import TestCase, skip
+from uuid import uuid4
 
 from eventsourcing.application.popo import PopoApplication
+from eventsourcing.application.process import PromptToQuit
+from eventsourcing.application.simple import PromptToPull
 from eventsourcing.application.sqlalchemy import SQLAlchemyApplication
 from eventsourcing.domain.model.decorators import retry
 from eventsourcing.exceptions import RepositoryKeyError
@@ -11,15 +19,31 @@ from eventsourcing.system.multiprocess import MultiprocessRunner
 from eventsourcing.system.runner import MultiThreadedRunner, SingleThreadedRunner
 
 from bankaccounts.exceptions import AccountClosedError, InsufficientFundsError
+from bankaccounts.filestore import FileApplication
+from bankaccounts.infrastructure import PooledSQLAlchemyApplication
+from bankaccounts.onboarding import AccountSpec
+from bankaccounts.simpleapplication import SimpleBankAccountApplication
 from bankaccounts.system.definition import BankAccountSystem
 from bankaccounts.system.accounts import Accounts
 from bankaccounts.system.sagas import Sagas
 from bankaccounts.system.commands import Commands
+from bankaccounts.system.notificationlog import (
+    ReadAheadNotificationLog,
+    ReadAheadNotificationLogReader,
+)
+from bankaccounts.system.runners import (
+    AdaptiveApplicationThread,
+    AdaptiveMultiprocessRunner,
+    AdaptiveMultiThreadedRunner,
+    AdaptivePolling,
+    FollowerStats,
+)
 
 
 class TestSystemSingleThreadedPopo(TestCase):
     runner_class = SingleThreadedRunner
     infrastructure_class = PopoApplication
+    system_kwargs = {}
     runner: AbstractSystemRunner
 
     @classmethod
@@ -27,7 +51,9 @@ class TestSystemSingleThreadedPopo(TestCase):
         # Run the system.
         cls.runner = cls.runner_class(
             BankAccountSystem(
-                infrastructure_class=cls.infrastructure_class, setup_tables=True
+                infrastructure_class=cls.infrastructure_class,
+                setup_tables=True,
+                **cls.system_kwargs
             )
         )
         cls.runner.start()
@@ -279,6 +305,86 @@ class TestSystemSingleThreadedPopo(TestCase):
                 account_id=account_id1, overdraft_limit=Decimal("5000.00")
             )
 
+    def test_deposit_funds_with_idempotency_key(self):
+        # Create an account.
+        account_id1 = self.accounts.create_account()
+
+        # Deposit funds, retrying with the same idempotency key.
+        idempotency_key = str(uuid4())
+        transaction_id1 = self.commands.deposit_funds(
+            account_id1, Decimal("200.00"), idempotency_key=idempotency_key
+        )
+        transaction_id2 = self.commands.deposit_funds(
+            account_id1, Decimal("200.00"), idempotency_key=idempotency_key
+        )
+
+        # Check the retry returned the existing transaction.
+        self.assertEqual(transaction_id1, transaction_id2)
+        self.assertSagaHasSucceeded(transaction_id1)
+
+        # Check balance - funds deposited once.
+        self.assertBalanceEquals(account_id1, Decimal("200.00"))
+
+    def test_transfer_funds_with_idempotency_key(self):
+        # Create two accounts and deposit funds.
+        account_id1 = self.accounts.create_account()
+        account_id2 = self.accounts.create_account()
+        self.commands.deposit_funds(account_id1, Decimal("200.00"))
+
+        # Transfer funds, retrying with the same idempotency key.
+        idempotency_key = str(uuid4())
+        transaction_ids = [
+            self.commands.transfer_funds(
+                debit_account_id=account_id1,
+                credit_account_id=account_id2,
+                amount=Decimal("50.00"),
+                idempotency_key=idempotency_key,
+            )
+            for _ in range(3)
+        ]
+
+        # Check the retries returned the existing transaction.
+        self.assertEqual(len(set(transaction_ids)), 1)
+        self.assertSagaHasSucceeded(transaction_ids[0])
+
+        # Check balances - funds transferred once.
+        self.assertBalanceEquals(account_id1, Decimal("150.00"))
+        self.assertBalanceEquals(account_id2, Decimal("50.00"))
+
+    def test_create_accounts(self):
+        account_id1, account_id2 = uuid4(), uuid4()
+        specs = [
+            AccountSpec(account_id1, opening_balance=Decimal("100.00")),
+            AccountSpec(account_id2, overdraft_limit=Decimal("50.00")),
+            AccountSpec(),
+        ]
+        report = self.accounts.create_accounts(specs, batch_size=2)
+        self.assertEqual(report.num_accounts, 3)
+        self.assertEqual(report.num_events, 5)
+        self.assertBalanceEquals(account_id1, Decimal("100.00"))
+        self.assertEqual(
+            self.accounts.get_overdraft_limit(account_id2), Decimal("50.00")
+        )
+
+        # Transfer funds between onboarded accounts.
+        transaction_id = self.commands.transfer_funds(
+            debit_account_id=account_id2,
+            credit_account_id=account_id1,
+            amount=Decimal("50.00"),
+        )
+        self.assertSagaHasSucceeded(transaction_id)
+        self.assertBalanceEquals(account_id1, Decimal("150.00"))
+        self.assertBalanceEquals(account_id2, Decimal("-50.00"))
+
+    def test_create_accounts_reports_progress(self):
+        specs = [AccountSpec() for _ in range(3)]
+        reports = []
+        report = self.accounts.create_accounts(
+            specs, batch_size=2, progress=reports.append
+        )
+        self.assertEqual([r.num_accounts for r in reports], [2, 3])
+        self.assertEqual(reports[-1], report)
+
     WAIT_TIME = .1
     MAX_ATTEMPTS = 25
 
@@ -308,6 +414,131 @@ class TestSystemSingleThreadedPopo(TestCase):
         return self.sagas.get_saga(transaction_id)
 
 
+class TestSystemSingleThreadedPopoWithReadAheadCache(TestSystemSingleThreadedPopo):
+    system_kwargs = {"use_read_ahead_cache": True}
+
+    def test_applications_use_read_ahead_reader(self):
+        # By their classes, so runners that construct applications in
+        # other processes also use the read-ahead cache.
+        for name in ("sagas", "accounts"):
+            process_class = self.runner.system.process_classes[name]
+            self.assertIs(
+                process_class.notification_log_reader_class,
+                ReadAheadNotificationLogReader,
+            )
+
+    def test_readers_use_read_ahead_log(self):
+        reader = self.sagas.readers["accounts"]
+        self.assertIsInstance(reader, ReadAheadNotificationLogReader)
+        self.assertIsInstance(reader.notification_log, ReadAheadNotificationLog)
+
+
+class TestSystemSingleThreadedPopoWithSinglePassTransfers(TestSystemSingleThreadedPopo):
+    system_kwargs = {"use_single_pass_transfers": True}
+
+    def test_transfer_funds_in_single_pass(self):
+        # Create two accounts and deposit funds.
+        account_id1 = self.accounts.create_account()
+        account_id2 = self.accounts.create_account()
+        self.commands.deposit_funds(account_id1, Decimal("200.00"))
+
+        # Transfer funds.
+        transaction_id = self.commands.transfer_funds(
+            debit_account_id=account_id1,
+            credit_account_id=account_id2,
+            amount=Decimal("50.00"),
+        )
+        self.assertSagaHasSucceeded(transaction_id)
+
+        # Check the saga didn't require the credit account to be credited.
+        saga = self.get_saga(transaction_id)
+        self.assertFalse(saga.has_debit_account_debited)
+        self.assertEqual(saga.__version__, 1)
+
+        # Check balances.
+        self.assertBalanceEquals(account_id1, Decimal("150.00"))
+        self.assertBalanceEquals(account_id2, Decimal("50.00"))
+
+
+class TestCommandsIdempotencyKeys(TestCase):
+    def test_index_is_bounded_and_keys_expire(self):
+        with Commands.mixin(PopoApplication)() as commands:
+            commands.idempotency_cache.max_size = 2
+            account_id = uuid4()
+
+            # The in-memory index is bounded.
+            transaction_ids = [
+                commands.deposit_funds(account_id, Decimal("1.00"), str(i))
+                for i in range(3)
+            ]
+            self.assertEqual(len(commands.idempotency_cache), 2)
+
+            # Evicted keys are found in the event store.
+            transaction_id = commands.deposit_funds(account_id, Decimal("1.00"), "0")
+            self.assertEqual(transaction_id, transaction_ids[0])
+
+            # Expired keys are assigned to a new transaction.
+            commands.idempotency_cache.ttl = -1
+            transaction_id = commands.deposit_funds(account_id, Decimal("1.00"), "0")
+            self.assertNotEqual(transaction_id, transaction_ids[0])
+            key = commands.get_idempotency_key("0")
+            self.assertEqual(key.transaction_id, transaction_id)
+
+
+class TestReadAheadNotificationLog(TestCase):
+    def test_complete_sections_are_cached(self):
+        app_class = SimpleBankAccountApplication.mixin(PopoApplication)
+        with app_class(notification_log_section_size=5) as app:
+            for _ in range(12):
+                app.create_account()
+
+            log = ReadAheadNotificationLog(
+                app.notification_log, max_sections=2, prefetch=False
+            )
+            reader = ReadAheadNotificationLogReader(log)
+            self.assertEqual(len(reader.list_notifications()), 12)
+            self.assertEqual(log.misses, 3)
+            self.assertEqual(log.hits, 0)
+
+            # The partial last section isn't cached.
+            self.assertEqual(log.stats()["cached_sections"], 2)
+
+            # Reading again hits the cache.
+            reader.seek(0)
+            self.assertEqual(len(reader.list_notifications()), 12)
+            self.assertEqual(log.hits, 2)
+            self.assertEqual(log.misses, 4)
+
+    def test_next_section_is_prefetched(self):
+        app_class = SimpleBankAccountApplication.mixin(PopoApplication)
+        with app_class(notification_log_section_size=5) as app:
+            for _ in range(12):
+                app.create_account()
+
+            log = ReadAheadNotificationLog(app.notification_log)
+            reader = ReadAheadNotificationLogReader(log)
+            self.assertEqual(len(reader.list_notifications()), 12)
+            self.assertEqual(log.prefetches, 2)
+            self.assertEqual(log.hits + log.misses, 3)
+            self.assertGreaterEqual(log.hits, 1)
+
+    def test_followers_share_read_ahead_log(self):
+        app_class = SimpleBankAccountApplication.mixin(PopoApplication)
+        with app_class() as app:
+            reader1 = ReadAheadNotificationLogReader(app.notification_log)
+            reader2 = ReadAheadNotificationLogReader(app.notification_log)
+            self.assertIs(reader1.notification_log, reader2.notification_log)
+
+    def test_prefetch_executor_of_other_process_is_not_used(self):
+        executor = ReadAheadNotificationLog.get_prefetch_executor()
+        self.assertIs(ReadAheadNotificationLog.get_prefetch_executor(), executor)
+
+        # As if this were a child process of the process that started it.
+        ReadAheadNotificationLog.prefetch_executor_pid = -1
+        self.addCleanup(executor.shutdown)
+        self.assertIsNot(ReadAheadNotificationLog.get_prefetch_executor(), executor)
+
+
 class WithMultiThreaded(TestCase):
     runner_class = MultiThreadedRunner
 
@@ -316,6 +547,14 @@ class WithMultiprocessing(TestCase):
     runner_class = MultiprocessRunner
 
 
+class WithAdaptiveMultiThreaded(TestCase):
+    runner_class = AdaptiveMultiThreadedRunner
+
+
+class WithAdaptiveMultiprocessing(TestCase):
+    runner_class = AdaptiveMultiprocessRunner
+
+
 class WithSQLAlchemy(TestCase):
     infrastructure_class = SQLAlchemyApplication
 
@@ -343,6 +582,46 @@ class WithSQLAlchemyInMemory(TestCase):
     infrastructure_class = SQLAlchemyApplication
 
 
+class WithPooledSQLAlchemyFile(TestCase):
+    infrastructure_class = PooledSQLAlchemyApplication
+    system_kwargs = {"pool_size": 4, "max_overflow": 4, "pool_pre_ping": True}
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tempdir = tempfile.mkdtemp()
+        db_path = os.path.join(cls.tempdir, "eventsourcing.db")
+        os.environ["DB_URI"] = "sqlite:///{}".format(db_path)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        super().tearDownClass()
+        try:
+            del os.environ["DB_URI"]
+        except KeyError:
+            pass
+        shutil.rmtree(cls.tempdir)
+
+
+class WithFileStore(TestCase):
+    infrastructure_class = FileApplication
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tempdir = tempfile.mkdtemp()
+        os.environ["FILE_STORE_PATH"] = cls.tempdir
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        super().tearDownClass()
+        try:
+            del os.environ["FILE_STORE_PATH"]
+        except KeyError:
+            pass
+        shutil.rmtree(cls.tempdir)
+
+
 class TestSystemSingleThreadedSQLAlchemy(WithSQLAlchemy, TestSystemSingleThreadedPopo):
     pass
 
@@ -353,6 +632,26 @@ class TestSystemSingleThreadedSQLAlchemyInMemory(
     pass
 
 
+class TestSystemSingleThreadedPooledSQLAlchemyFile(
+    WithPooledSQLAlchemyFile, TestSystemSingleThreadedPopo
+):
+    def test_pool_stats(self):
+        account_id1 = self.accounts.create_account()
+        transaction_id = self.commands.deposit_funds(account_id1, Decimal("1.00"))
+        self.assertSagaHasSucceeded(transaction_id)
+
+        # Applications share a session, and so report the same pool.
+        stats = self.accounts.pool_stats
+        self.assertIs(stats, self.commands.pool_stats)
+        self.assertGreater(stats.checkouts, 0)
+        self.assertGreaterEqual(stats.max_wait, stats.mean_wait)
+        self.assertEqual(stats.as_dict()["checkouts"], stats.checkouts)
+
+
+class TestSystemSingleThreadedFileStore(WithFileStore, TestSystemSingleThreadedPopo):
+    pass
+
+
 class TestSystemMultiThreadedPopo(WithMultiThreaded, TestSystemSingleThreadedPopo):
     pass
 
@@ -363,7 +662,434 @@ class TestSystemMultiThreadedSQLAlchemy(
     pass
 
 
+class TestSystemMultiThreadedPooledSQLAlchemyFile(
+    WithMultiThreaded, TestSystemSingleThreadedPooledSQLAlchemyFile
+):
+    pass
+
+
 class TestSystemMultiprocessingSQLAlchemy(
     WithMultiprocessing, WithSQLAlchemy, TestSystemSingleThreadedPopo
 ):
     pass
+
+
+class TestSystemMultiThreadedFileStore(
+    WithMultiThreaded, WithFileStore, TestSystemSingleThreadedPopo
+):
+    pass
+
+
+class TestSystemMultiprocessingFileStore(
+    WithMultiprocessing, WithFileStore, TestSystemSingleThreadedPopo
+):
+    pass
+
+
+class TestSystemMultiprocessingFileStoreWithReadAheadCache(
+    WithMultiprocessing, WithFileStore, TestSystemSingleThreadedPopoWithReadAheadCache
+):
+    @skip("The applications in this process don't follow other applications")
+    def test_readers_use_read_ahead_log(self):
+        pass
+
+
+class TestSystemMultiprocessingFileStoreWithAccountStatusView(
+    WithMultiprocessing, WithFileStore, TestSystemSingleThreadedPopo
+):
+    system_kwargs = {"use_account_status_view": True}
+
+    def test_balances_not_read_from_view_in_parent_process(self):
+        # The view in this process isn't updated by the Accounts
+        # application in the child process, so it isn't used for reads.
+        self.assertFalse(self.accounts.is_publishing_account_statuses)
+        account_id1 = self.accounts.create_account()
+        self.assertEqual(self.accounts.get_balance(account_id1), Decimal("0.00"))
+        transaction_id = self.commands.deposit_funds(account_id1, Decimal("10.00"))
+        self.assertSagaHasSucceeded(transaction_id)
+        self.assertEqual(self.accounts.get_balance(account_id1), Decimal("10.00"))
+        self.assertEqual(
+            self.accounts.get_account_status(account_id1).balance, Decimal("10.00")
+        )
+        self.assertEqual(len(self.accounts.account_status_view), 0)
+
+    def test_commands_do_not_precheck_in_parent_process(self):
+        view = self.commands.account_status_view
+        self.assertIsNotNone(view)
+        self.assertFalse(view.is_published)
+        self.assertFalse(self.commands.uses_account_status_view)
+
+        # Pending credits aren't added, since they wouldn't be settled.
+        account_id1 = self.accounts.create_account()
+        self.commands.deposit_funds(account_id1, Decimal("10.00"))
+        self.assertEqual(view.list_pending_credits(), [])
+
+        # The account makes the check.
+        transaction_id = self.commands.withdraw_funds(account_id1, Decimal("20.00"))
+        self.assertSagaHasNotSucceeded(
+            transaction_id, [InsufficientFundsError({"account_id": account_id1})]
+        )
+
+
+class TestSystemMultiprocessingFileStoreWithSinglePassTransfers(
+    WithMultiprocessing,
+    WithFileStore,
+    TestSystemSingleThreadedPopoWithSinglePassTransfers,
+):
+    pass
+
+
+class TestSystemAdaptiveMultiThreadedPopo(
+    WithAdaptiveMultiThreaded, TestSystemSingleThreadedPopo
+):
+    def get_follower_stats(self, name):
+        return self.runner.follower_stats[name]
+
+    def test_follower_stats(self):
+        account_id1 = self.accounts.create_account()
+        transaction_ids = [
+            self.commands.deposit_funds(account_id1, Decimal("1.00"))
+            for _ in range(20)
+        ]
+        for transaction_id in transaction_ids:
+            self.assertSagaHasSucceeded(transaction_id)
+
+        for name in ("sagas", "accounts"):
+            stats = self.get_follower_stats(name)
+            self.assertGreater(stats.prompts_received, 0)
+            self.assertLessEqual(stats.pulls, stats.prompts_received)
+            self.assertGreater(stats.notifications_processed, 0)
+            self.assertEqual(stats.as_dict()["pulls"], stats.pulls)
+
+
+class TestSystemAdaptiveMultiprocessingFileStore(
+    WithAdaptiveMultiprocessing, WithFileStore, TestSystemAdaptiveMultiThreadedPopo
+):
+    def get_follower_stats(self, name):
+        return self.runner.follower_stats[(0, name)]
+
+
+class FakeProcessApplication(object):
+    def __init__(self, backlog=0):
+        self.backlog = backlog
+        self.prompts = []
+        self.advance_bys = []
+        self.is_closed = threading.Event()
+
+    def run(self, prompt=None, advance_by=None):
+        self.prompts.append(prompt)
+        self.advance_bys.append(advance_by)
+        num_processed = min(self.backlog, advance_by or self.backlog)
+        self.backlog -= num_processed
+        return num_processed
+
+    def close(self):
+        self.is_closed.set()
+
+
+class ScriptedInbox(object):
+    """
+    Inbox that returns the given items in turn, timing out for each None,
+    and records the timeout of each get.
+    """
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.timeouts = []
+
+    def get(self, timeout=None):
+        self.timeouts.append(timeout)
+        item = self.items.pop(0)
+        if item is None:
+            raise Empty()
+        return item
+
+    def get_nowait(self):
+        raise Empty()
+
+    def task_done(self):
+        pass
+
+
+class TestAdaptiveApplicationThread(TestCase):
+    def start_thread(self, app, inbox, **kwargs):
+        stats = FollowerStats()
+        thread = AdaptiveApplicationThread(
+            process=app,
+            polling=AdaptivePolling(**kwargs),
+            stats=stats,
+            inbox=inbox,
+            outbox=None,
+        )
+        thread.start()
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(inbox.put, PromptToQuit())
+        return stats
+
+    def test_queued_prompts_are_coalesced(self):
+        app = FakeProcessApplication(backlog=5)
+        inbox = Queue()
+        for _ in range(10):
+            inbox.put(PromptToPull("sagas", 0))
+        inbox.put(PromptToPull("commands", 0))
+        stats = self.start_thread(app, inbox, min_poll_interval=10)
+        self.assertStatsEqual(stats, "empty_pulls", 1)
+        self.assertEqual(stats.pulls, 2)
+        self.assertEqual(stats.prompts_received, 11)
+        self.assertEqual(stats.notifications_processed, 5)
+        self.assertEqual(stats.polls, 0)
+        self.assertEqual(
+            [p.process_name for p in app.prompts], ["sagas", "commands"]
+        )
+
+    def test_pulls_eagerly_whilst_there_is_a_backlog(self):
+        app = FakeProcessApplication(backlog=35)
+        inbox = Queue()
+        inbox.put(PromptToPull("sagas", 0))
+        stats = self.start_thread(app, inbox, min_poll_interval=10, eager_threshold=10)
+        self.assertStatsEqual(stats, "notifications_processed", 35)
+        self.assertEqual(stats.pulls, 1)
+        self.assertEqual(stats.eager_pulls, 3)
+        self.assertEqual(app.advance_bys, [10, 10, 10, 10])
+
+    def test_eager_pulls_take_turns_between_upstream_applications(self):
+        app = FakeProcessApplication(backlog=25)
+        inbox = Queue()
+        inbox.put(PromptToPull("sagas", 0))
+        inbox.put(PromptToPull("commands", 0))
+        stats = self.start_thread(app, inbox, min_poll_interval=10, eager_threshold=10)
+        self.assertStatsEqual(stats, "empty_pulls", 1)
+        self.assertEqual(stats.notifications_processed, 25)
+        self.assertEqual(stats.pulls, 2)
+        self.assertEqual(stats.eager_pulls, 2)
+        self.assertEqual(
+            [p.process_name for p in app.prompts],
+            ["sagas", "commands", "sagas", "commands"],
+        )
+
+    def test_polls_back_off_when_idle(self):
+        app = FakeProcessApplication()
+        inbox = ScriptedInbox(
+            [None] * 5 + [PromptToPull("sagas", 0), None, PromptToQuit()]
+        )
+        stats = FollowerStats()
+        thread = AdaptiveApplicationThread(
+            process=app,
+            polling=AdaptivePolling(min_poll_interval=1, max_poll_interval=8),
+            stats=stats,
+            inbox=inbox,
+            outbox=None,
+        )
+        # Run the loop in this thread, with the inbox timing out instead
+        # of waiting.
+        thread.loop_adaptively()
+
+        # The poll interval doubles up to the maximum, and a prompt resets it.
+        self.assertEqual(inbox.timeouts, [1, 2, 4, 8, 8, 8, 1, 2])
+        self.assertEqual(stats.polls, 6)
+        self.assertEqual(stats.pulls, 1)
+        self.assertEqual(stats.empty_pulls, 7)
+        self.assertTrue(app.is_closed.is_set())
+
+    def test_prompt_to_quit_closes_application(self):
+        app = FakeProcessApplication()
+        inbox = Queue()
+        self.start_thread(app, inbox, min_poll_interval=10)
+        inbox.put(PromptToQuit())
+        self.assertTrue(app.is_closed.wait(timeout=10))
+
+    @retry(AssertionError, max_attempts=200, wait=0.01)
+    def assertStatsEqual(self, stats, name, expected):
+        self.assertEqual(getattr(stats, name), expected)
+
+
+class TestSystemSingleThreadedPopoWithAccountStatusView(TestCase):
+    runner_class = SingleThreadedRunner
+
+    WAIT_TIME = TestSystemSingleThreadedPopo.WAIT_TIME
+    MAX_ATTEMPTS = TestSystemSingleThreadedPopo.MAX_ATTEMPTS
+
+    def setUp(self) -> None:
+        self.runner = self.runner_class(
+            BankAccountSystem(
+                infrastructure_class=PopoApplication,
+                setup_tables=True,
+                use_account_status_view=True,
+            )
+        )
+        self.runner.start()
+        self.commands: Commands = self.runner.get(Commands)
+        self.sagas: Sagas = self.runner.get(Sagas)
+        self.accounts: Accounts = self.runner.get(Accounts)
+        self.view = self.accounts.account_status_view
+        self.assertTrue(self.view.is_published)
+        self.assertTrue(self.commands.uses_account_status_view)
+
+    def tearDown(self) -> None:
+        self.runner.close()
+
+    def test_withdraw_funds_rejected_by_precheck(self):
+        # Create an account and deposit funds.
+        account_id1 = self.accounts.create_account()
+        transaction_id = self.commands.deposit_funds(account_id1, Decimal("200.00"))
+        self.assertSagaHasSucceeded(transaction_id)
+        self.assertStatusBalanceEquals(account_id1, Decimal("200.00"))
+
+        # Fail to withdraw funds - rejected before a command is recorded.
+        num_records = self.count_command_records()
+        with self.assertRaises(InsufficientFundsError):
+            self.commands.withdraw_funds(account_id1, Decimal("200.01"))
+        self.assertEqual(self.count_command_records(), num_records)
+
+        # Withdraw within the overdraft limit.
+        self.accounts.set_overdraft_limit(account_id1, Decimal("100.00"))
+        transaction_id = self.commands.withdraw_funds(account_id1, Decimal("300.00"))
+        self.assertSagaHasSucceeded(transaction_id)
+        self.assertStatusBalanceEquals(account_id1, Decimal("-100.00"))
+        self.assertEqual(self.view.list_pending_credits(), [])
+
+    def test_transactions_on_closed_account_rejected_by_precheck(self):
+        # Create two accounts, and close one.
+        account_id1 = self.accounts.create_account()
+        account_id2 = self.accounts.create_account()
+        transaction_id = self.commands.deposit_funds(account_id2, Decimal("200.00"))
+        self.assertSagaHasSucceeded(transaction_id)
+        self.accounts.close_account(account_id1)
+
+        with self.assertRaises(AccountClosedError):
+            self.commands.deposit_funds(account_id1, Decimal("1.00"))
+
+        with self.assertRaises(AccountClosedError):
+            self.commands.transfer_funds(
+                debit_account_id=account_id2,
+                credit_account_id=account_id1,
+                amount=Decimal("50.00"),
+            )
+
+        # Check balances - should be unchanged.
+        self.assertEqual(self.accounts.get_balance(account_id1), Decimal("0.00"))
+        self.assertEqual(self.accounts.get_balance(account_id2), Decimal("200.00"))
+
+    def test_pending_credits_count_as_available_funds(self):
+        account_id1 = self.accounts.create_account()
+        self.view.add_pending_credit(uuid4(), account_id1, Decimal("50.00"))
+
+        # Not rejected, because a credit is pending.
+        transaction_id = self.commands.withdraw_funds(account_id1, Decimal("50.00"))
+
+        # The account still refuses the withdrawal.
+        self.assertSagaHasNotSucceeded(
+            transaction_id, [InsufficientFundsError({"account_id": account_id1})]
+        )
+
+    def test_accounts_unknown_to_view_are_not_prechecked(self):
+        account_id1 = self.accounts.create_account()
+        self.view._statuses.clear()
+        transaction_id = self.commands.withdraw_funds(account_id1, Decimal("50.00"))
+        self.assertSagaHasNotSucceeded(
+            transaction_id, [InsufficientFundsError({"account_id": account_id1})]
+        )
+
+        # The status is read again when the account is next changed.
+        self.assertEqual(self.view.get(account_id1).version, 1)
+
+    def test_balance_and_overdraft_limit_read_from_view(self):
+        account_id1 = self.accounts.create_account()
+        transaction_id = self.commands.deposit_funds(account_id1, Decimal("10.00"))
+        self.assertSagaHasSucceeded(transaction_id)
+        self.accounts.set_overdraft_limit(account_id1, Decimal("5.00"))
+        self.assertEqual(self.view.get(account_id1).version, 2)
+
+        # Reads don't use the repository.
+        repository = self.accounts._repository
+        self.accounts._repository = None
+        try:
+            self.assertEqual(self.accounts.get_balance(account_id1), Decimal("10.00"))
+            self.assertEqual(
+                self.accounts.get_overdraft_limit(account_id1), Decimal("5.00")
+            )
+        finally:
+            self.accounts._repository = repository
+
+        # Accounts that aren't in the view are retrieved and put in the view.
+        self.view._statuses.clear()
+        self.assertEqual(self.accounts.get_balance(account_id1), Decimal("10.00"))
+        self.assertEqual(self.view.get(account_id1).version, 2)
+        with self.assertRaises(RepositoryKeyError):
+            self.accounts.get_balance(uuid4())
+
+    def count_command_records(self):
+        record_manager = self.commands.event_store.record_manager
+        return record_manager.get_max_notification_id()
+
+    @retry(AssertionError, max_attempts=MAX_ATTEMPTS, wait=WAIT_TIME)
+    def assertStatusBalanceEquals(self, account_id, expected_balance):
+        self.assertEqual(self.view.get(account_id).balance, expected_balance)
+
+    assertSagaHasSucceeded = TestSystemSingleThreadedPopo.assertSagaHasSucceeded
+    assertSagaHasNotSucceeded = TestSystemSingleThreadedPopo.assertSagaHasNotSucceeded
+    get_saga = TestSystemSingleThreadedPopo.get_saga
+
+
+class TestSystemMultiThreadedPopoWithAccountStatusView(
+    WithMultiThreaded, TestSystemSingleThreadedPopoWithAccountStatusView
+):
+    def test_balance_reads_during_writes(self):
+        account_ids = [self.accounts.create_account() for _ in range(4)]
+        num_deposits = 25
+        throughputs = {}
+        for round_number, num_readers in enumerate((1, 2, 4), 1):
+            stop = threading.Event()
+            reads = [0] * num_readers
+            errors = []
+
+            def read(index):
+                # Balances only increase, since funds are only deposited.
+                last_balances = dict.fromkeys(account_ids, Decimal("0.00"))
+                try:
+                    while not stop.is_set():
+                        for account_id in account_ids:
+                            balance = self.accounts.get_balance(account_id)
+                            self.assertGreaterEqual(balance, last_balances[account_id])
+                            last_balances[account_id] = balance
+                        reads[index] += len(account_ids)
+                except Exception as e:
+                    errors.append(e)
+
+            readers = [
+                threading.Thread(target=read, args=(i,)) for i in range(num_readers)
+            ]
+            started = time.perf_counter()
+            for reader in readers:
+                reader.start()
+            for _ in range(num_deposits):
+                for account_id in account_ids:
+                    self.commands.deposit_funds(account_id, Decimal("1.00"))
+            expected = Decimal(num_deposits * round_number)
+            for account_id in account_ids:
+                self.assertBalanceEquals(account_id, expected)
+            stop.set()
+            for reader in readers:
+                reader.join()
+            throughputs[num_readers] = sum(reads) / (time.perf_counter() - started)
+            self.assertEqual(errors, [])
+
+            # Readers weren't blocked by the processing of the deposits.
+            self.assertTrue(all(reads))
+            self.assertGreater(sum(reads), num_deposits * len(account_ids))
+
+        # Readers don't contend with each other, so the total read throughput
+        # doesn't fall with more readers, whereas the total throughput of
+        # reads from the repository halves with four readers. With the GIL,
+        # more readers mostly take a larger share of it from the writers.
+        self.assertGreater(throughputs[4], 0.7 * throughputs[1], throughputs)
+
+    @retry(AssertionError, max_attempts=100, wait=0.05)
+    def assertBalanceEquals(self, account_id, expected_balance):
+        self.assertEqual(self.accounts.get_balance(account_id), expected_balance)
+
+
+class TestSystemMultiThreadedPopoWithSinglePassTransfers(
+    WithMultiThreaded, TestSystemSingleThreadedPopoWithSinglePassTransfers
+):
+    pass
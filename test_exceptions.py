@@ -0,0 +1,85 @@
+from unittest import TestCase
+from uuid import uuid4
+
+from eventsourcing.utils.topic import get_topic
+from eventsourcing.utils.transcoding import ObjectJSONDecoder, ObjectJSONEncoder
+
+from bankaccounts.domainmodel import BankAccount
+from bankaccounts.exceptions import (
+    AccountClosedError,
+    InsufficientFundsError,
+    TransactionError,
+    _error_classes,
+    get_error_class,
+)
+
+
+class CustomError(TransactionError):
+    pass
+
+
+class TestErrorEncoding(TestCase):
+    def setUp(self):
+        self.encoder = ObjectJSONEncoder()
+        self.decoder = ObjectJSONDecoder()
+
+    def roundtrip(self, obj):
+        return self.decoder.decode(self.encoder.encode(obj).decode("utf8"))
+
+    def test_errors_are_encoded_with_codes(self):
+        error = InsufficientFundsError({"account_id": uuid4()})
+        encoded = self.encoder.encode(error)
+        self.assertIn(b'"__error__":["insufficient_funds",', encoded)
+        self.assertNotIn(b"bankaccounts.exceptions", encoded)
+        decoded = self.roundtrip(error)
+        self.assertEqual(decoded, error)
+        self.assertIsInstance(decoded, InsufficientFundsError)
+        self.assertNotEqual(decoded, AccountClosedError(*error.args))
+
+    def test_error_without_code_uses_topic(self):
+        self.assertEqual(CustomError.code, get_topic(CustomError))
+        self.assertIs(get_error_class(CustomError.code), CustomError)
+        self.assertEqual(self.roundtrip(CustomError(1)), CustomError(1))
+
+    def test_error_codes_are_unique(self):
+        with self.assertRaises(ValueError):
+
+            class DuplicateError(TransactionError):
+                code = "account_closed"
+
+    def test_decode_errors_recorded_with_topics(self):
+        account_id = uuid4()
+        encoded = (
+            '{"__exception__":{"__topic__":"bankaccounts.exceptions#'
+            'AccountClosedError","args":{"__tuple__":[{"account_id":'
+            '{"UUID":"%s"}}]}}}' % account_id.hex
+        )
+        self.assertEqual(
+            self.decoder.decode(encoded),
+            AccountClosedError({"account_id": account_id}),
+        )
+
+    def test_error_recorded_constructs_error_when_used(self):
+        account = BankAccount.__create__()
+        error = AccountClosedError({"account_id": account.id})
+        account.record_error(error, transaction_id=uuid4())
+        event = account.__batch_pending_events__()[-1]
+        self.assertNotIn("error", event.__dict__)
+        self.assertEqual(event.__dict__["error_code"], "account_closed")
+        self.assertEqual(event.error, error)
+        self.assertEqual(self.roundtrip(event.__dict__)["error_args"], [error.args[0]])
+
+    def test_subclasses_without_codes_are_not_registered(self):
+        # Frameworks such as Ray derive and rename error classes dynamically.
+        for cause_class in (AccountClosedError, InsufficientFundsError):
+            derived = type("cls", (cause_class,), {})
+            derived.__name__ = derived.__qualname__ = "Derived({})".format(
+                cause_class.__name__
+            )
+            self.assertEqual(get_error_class(cause_class.code), cause_class)
+            self.assertNotIn(derived.code, _error_classes)
+
+        # Subclasses without codes are found by their topic.
+        self.assertEqual(CustomError.code, get_topic(CustomError))
+        self.assertNotIn(CustomError.code, _error_classes)
+        self.assertIs(get_error_class(CustomError.code), CustomError)
@@ -0,0 +1,240 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from threading import Thread
+from unittest import TestCase
+from uuid import uuid4
+
+from eventsourcing.exceptions import RecordConflictError
+
+from bankaccounts.domainmodel import BankAccount
+from bankaccounts.filestore import (
+    FRAME_HEADER,
+    SYNC_ALWAYS,
+    SYNC_NONE,
+    SYNC_GROUP,
+    FileApplication,
+    SegmentStore,
+    close_segment_store,
+    get_segment_store,
+)
+
+
+class TestSegmentStore(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.path)
+
+    def open_store(self, **kwargs):
+        store = SegmentStore(self.path, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def test_append_and_read(self):
+        store = self.open_store()
+        id1, id2 = uuid4(), uuid4()
+        self.assertEqual(store.append([(id1, 0, "a", b"0"), (id2, 0, "b", b"1")]), 1)
+        self.assertEqual(store.append([(id1, 1, "a", b"2")], ("upstream", 5)), 3)
+        self.assertEqual(store.max_notification_id(), 3)
+        self.assertEqual(store.get_notification_ids(id1), [1, 3])
+        self.assertEqual(store.get_notification_ids(id1, 1), [3])
+        self.assertEqual(store.read([3]), [(id1, 1, "a", b"2", 3)])
+        self.assertEqual(store.max_tracking_id("upstream"), 5)
+        self.assertEqual(store.max_tracking_id("other"), 0)
+        self.assertEqual(set(store.originator_ids()), {id1, id2})
+
+    def test_conflicts(self):
+        store = self.open_store(sync=SYNC_ALWAYS)
+        id1 = uuid4()
+        store.append([(id1, 0, "a", b"0")], ("upstream", 1))
+        with self.assertRaises(RecordConflictError):
+            store.append([(id1, 0, "a", b"0")])
+        with self.assertRaises(AssertionError):
+            store.append([(id1, 2, "a", b"0")])
+        with self.assertRaises(RecordConflictError):
+            store.append([(id1, 1, "a", b"0")], ("upstream", 1))
+        self.assertEqual(store.max_notification_id(), 1)
+
+    def test_recovery_after_rollover(self):
+        store = self.open_store(segment_size=256, sync=SYNC_NONE)
+        id1 = uuid4()
+        for version in range(20):
+            tracking = ("upstream", version + 1)
+            store.append([(id1, version, "topic", b"x" * 20)], tracking)
+        store.close()
+        names = sorted(os.listdir(self.path))
+        self.assertIn("segment-00000001.idx", names)
+        self.assertIn("segment-00000003.log", names)
+
+        store = self.open_store(segment_size=256)
+        self.assertEqual(store.get_notification_ids(id1), list(range(1, 21)))
+        self.assertEqual(store.read([20]), [(id1, 19, "topic", b"x" * 20, 20)])
+        self.assertEqual(store.max_tracking_id("upstream"), 20)
+
+    def test_follows_writes_of_other_stores(self):
+        store1 = self.open_store(segment_size=256)
+        store2 = self.open_store(segment_size=256)
+        id1 = uuid4()
+        for version in range(10):
+            store = store1 if version % 2 else store2
+            store.append([(id1, version, "topic", b"x" * 20)])
+        self.assertEqual(store1.get_notification_ids(id1), list(range(1, 11)))
+        self.assertEqual(store2.read([10]), store1.read([10]))
+
+    def test_torn_frame_is_repaired(self):
+        store = self.open_store(sync=SYNC_ALWAYS)
+        id1 = uuid4()
+        store.append([(id1, 0, "a", b"0")])
+        end = store._segments[-1].end
+        store.close()
+
+        # Write the header of a frame, but not the frame.
+        with open(os.path.join(self.path, "segment-00000001.log"), "r+b") as f:
+            f.seek(end)
+            f.write(FRAME_HEADER.pack(100, 12345))
+
+        store = self.open_store()
+        self.assertEqual(store.max_notification_id(), 1)
+        store.append([(id1, 1, "a", b"1")])
+        store.close()
+        store = self.open_store()
+        self.assertEqual(store.get_notification_ids(id1), [1, 2])
+
+    def test_deleted_records_are_not_read(self):
+        store = self.open_store(segment_size=256, sync=SYNC_NONE)
+        store2 = self.open_store(segment_size=256)
+        id1 = uuid4()
+        for version in range(10):
+            store.append([(id1, version, "topic", b"x" * 20)])
+        store.delete(id1, 1)
+        store.delete(id1, 1)
+        store.delete(id1, 20)
+        self.assertEqual(store.get_notification_ids(id1, 0, 3), [1, 3])
+        self.assertEqual(store.read([1, 2, 3]), store.read([1, 3]))
+        self.assertEqual(store.max_notification_id(), 10)
+
+        # Versions of deleted records aren't reused.
+        with self.assertRaises(RecordConflictError):
+            store.append([(id1, 1, "topic", b"x")])
+
+        # Tombstones are followed by other stores, and survive rollover.
+        self.assertEqual(store2.get_notification_ids(id1, 0, 3), [1, 3])
+        for version in range(10, 20):
+            store.append([(id1, version, "topic", b"x" * 20)])
+        store.delete(id1, 15)
+        store.close()
+        self.assertIn("segment-00000002.idx", os.listdir(self.path))
+        store = self.open_store(segment_size=256)
+        notification_ids = store.get_notification_ids(id1)
+        self.assertEqual(len(notification_ids), 18)
+        self.assertNotIn(2, notification_ids)
+        self.assertNotIn(16, notification_ids)
+
+    def test_concurrent_writers_share_flushes(self):
+        store = self.open_store()
+        ids = [uuid4() for _ in range(4)]
+
+        def write(originator_id):
+            for version in range(50):
+                store.append([(originator_id, version, "topic", b"x")])
+
+        threads = [Thread(target=write, args=(i,)) for i in ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.max_notification_id(), 200)
+        self.assertEqual(store._synced, 200)
+        for originator_id in ids:
+            self.assertEqual(len(store.get_notification_ids(originator_id)), 50)
+
+
+def append_in_child(path, originator_id):
+    store = get_segment_store(path, sync=SYNC_GROUP)
+    store.append([(originator_id, 1, "a", b"1")])
+    close_segment_store(path)
+
+
+class TestFork(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        close_segment_store(self.path)
+        shutil.rmtree(self.path)
+
+    def test_forked_child_opens_its_own_store(self):
+        # The parent's store has a flusher thread, which the child doesn't.
+        store = get_segment_store(self.path, sync=SYNC_GROUP)
+        originator_id = uuid4()
+        store.append([(originator_id, 0, "a", b"0")])
+        self.assertIsNotNone(store._flusher)
+
+        child = multiprocessing.get_context("fork").Process(
+            target=append_in_child, args=(self.path, originator_id)
+        )
+        child.start()
+        child.join(timeout=10)
+        if child.is_alive():
+            child.kill()
+        self.assertEqual(child.exitcode, 0)
+
+        self.assertIs(get_segment_store(self.path), store)
+        self.assertEqual(store.get_notification_ids(originator_id), [1, 2])
+
+    def test_store_of_other_process_is_not_used(self):
+        store = get_segment_store(self.path)
+        store.pid = -1
+        self.assertFalse(store.is_usable)
+        with self.assertRaises(ValueError):
+            store.max_notification_id()
+        self.assertIsNot(get_segment_store(self.path), store)
+
+
+class TestFileApplication(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_events_are_stored_in_files(self):
+        with FileApplication(
+            name="bank", path=self.path, persist_event_type=BankAccount.Event
+        ):
+            account = BankAccount.__create__()
+            account.append_transaction(10)
+            account.append_transaction(-3)
+            account.__save__()
+        close_segment_store(os.path.join(self.path, "bank"))
+
+        with FileApplication(name="bank", path=self.path) as app:
+            account = app.repository[account.id]
+            self.assertEqual(account.balance, 7)
+            events = app.event_store.list_events(account.id, gt=0, limit=1)
+            self.assertEqual(len(events), 1)
+            self.assertEqual(events[0].originator_version, 1)
+            records = app.event_store.record_manager.get_notification_records()
+            self.assertEqual([r.notification_id for r in records], [1, 2, 3])
+
+    def test_delete_record(self):
+        with FileApplication(
+            name="bank", path=self.path, persist_event_type=BankAccount.Event
+        ) as app:
+            account = BankAccount.__create__()
+            account.append_transaction(10)
+            account.__save__()
+            record_manager = app.event_store.record_manager
+            self.assertTrue(record_manager.can_delete_records)
+            record_manager.delete_record(record_manager.get_record(account.id, 1))
+            with self.assertRaises(IndexError):
+                record_manager.get_record(account.id, 1)
+            records = record_manager.get_notification_records()
+            self.assertEqual([r.notification_id for r in records], [1])
+        close_segment_store(os.path.join(self.path, "bank"))
@@ -0,0 +1,122 @@
+from decimal import Decimal
+from threading import Event, Thread
+from unittest import TestCase
+from uuid import uuid4
+
+from eventsourcing.application.popo import PopoApplication
+from eventsourcing.exceptions import RecordConflictError
+
+from bankaccounts.exceptions import LockTimeoutError, TransactionError
+from bankaccounts.locking import StripedLockManager
+from bankaccounts.simpleapplication import SimpleBankAccountApplication
+from bankaccounts.workload import (
+    CREATE,
+    DEPOSIT,
+    Operation,
+    WorkloadGenerator,
+    stress_workload,
+)
+
+
+class TestStripedLockManager(TestCase):
+    def test_accounts_sharing_a_stripe_are_locked_once(self):
+        manager = StripedLockManager(num_stripes=1, timeout=1)
+        with manager.lock(uuid4(), uuid4()):
+            pass
+
+    def test_lock_timeout(self):
+        manager = StripedLockManager(timeout=0.05)
+        account_id1, account_id2 = uuid4(), uuid4()
+        is_locked = Event()
+        is_done = Event()
+
+        def hold_lock():
+            with manager.lock(account_id1):
+                is_locked.set()
+                is_done.wait(timeout=10)
+
+        thread = Thread(target=hold_lock)
+        thread.start()
+        try:
+            self.assertTrue(is_locked.wait(timeout=10))
+            with self.assertRaises(LockTimeoutError) as cm:
+                with manager.lock(account_id2, account_id1):
+                    pass
+            self.assertNotIsInstance(cm.exception, TransactionError)
+
+            # The locks acquired before the timeout were released.
+            with manager.lock(account_id2, timeout=0):
+                pass
+        finally:
+            is_done.set()
+            thread.join()
+
+        with manager.lock(account_id1, account_id2):
+            pass
+
+    def test_transfers_in_opposite_directions_do_not_deadlock(self):
+        manager = StripedLockManager(timeout=10)
+        with SimpleBankAccountApplication.mixin(PopoApplication)(
+            lock_manager=manager
+        ) as app:
+            account_id1 = app.create_account()
+            account_id2 = app.create_account()
+            app.deposit_funds(account_id1, Decimal("100.00"))
+            app.deposit_funds(account_id2, Decimal("100.00"))
+            errors = []
+
+            def transfer(debit_account_id, credit_account_id):
+                try:
+                    for _ in range(50):
+                        app.transfer_funds(
+                            debit_account_id, credit_account_id, Decimal("1.00")
+                        )
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [
+                Thread(target=transfer, args=(account_id1, account_id2)),
+                Thread(target=transfer, args=(account_id2, account_id1)),
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(app.get_balance(account_id1), Decimal("100.00"))
+            self.assertEqual(app.get_balance(account_id2), Decimal("100.00"))
+
+
+class TestStressWorkload(TestCase):
+    def test_locked_accounts_do_not_conflict(self):
+        operations = WorkloadGenerator(
+            num_accounts=5,
+            mix={"deposit": 0.5, "withdraw": 0.2, "transfer": 0.3},
+            seed=1,
+        ).generate(400)
+        with SimpleBankAccountApplication.mixin(PopoApplication)(
+            lock_manager=StripedLockManager()
+        ) as app:
+            result = stress_workload(operations, app, num_threads=8)
+            self.assertEqual(result.num_operations, 400)
+            self.assertEqual(result.conflicts, 0)
+            self.assertIn("conflicts 0", result.summary())
+            self.assertEqual(set(result.errors), {"InsufficientFundsError"})
+
+    def test_conflicts_are_retried_at_most_max_attempts_times(self):
+        operations = [
+            Operation(CREATE, 0),
+            Operation(DEPOSIT, 0, amount=Decimal("1.00")),
+        ]
+        with SimpleBankAccountApplication.mixin(PopoApplication)() as app:
+            attempts = []
+
+            def deposit_funds(credit_account_id, amount):
+                attempts.append(credit_account_id)
+                raise RecordConflictError()
+
+            app.deposit_funds = deposit_funds
+            result = stress_workload(operations, app, num_threads=1, max_attempts=3)
+            self.assertEqual(len(attempts), 3)
+            self.assertEqual(result.conflicts, 3)
+            self.assertEqual(dict(result.errors), {"RecordConflictError": 1})
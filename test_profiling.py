@@ -0,0 +1,112 @@
+import os
+import pstats
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import TestCase
+
+from eventsourcing.application.popo import PopoApplication
+from eventsourcing.system.runner import SingleThreadedRunner
+
+from bankaccounts.profiling import Profiler, profiling
+from bankaccounts.system.accounts import Accounts
+from bankaccounts.system.commands import Commands
+from bankaccounts.system.definition import BankAccountSystem
+from bankaccounts.system.sagas import Sagas
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_context_manager(self):
+        with Profiler(name="bench", trace_memory=True) as profiler:
+            fib(15)
+        paths = profiler.dump(self.output_dir)
+        pid = os.getpid()
+        self.assertEqual(
+            [os.path.basename(p) for p in paths],
+            [
+                "bench-{}.pstats".format(pid),
+                "bench-{}.folded".format(pid),
+                "bench-{}.tracemalloc.txt".format(pid),
+            ],
+        )
+        stats = pstats.Stats(paths[0])
+        self.assertIn("fib", {func[2] for func in stats.stats})
+        with open(paths[1]) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, microseconds = line.rsplit(" ", 1)
+            self.assertGreater(int(microseconds), 0)
+        self.assertTrue(any("fib(test_profiling.py" in line for line in lines))
+
+    def test_nested_profilers_attribute_time_to_innermost(self):
+        outer = Profiler(name="outer")
+        inner = Profiler(name="inner")
+        with outer:
+            with inner:
+                fib(12)
+            fib(10)
+        outer_stats = pstats.Stats(outer.profile).stats
+        inner_stats = pstats.Stats(inner.profile).stats
+        fib_calls = {func[2]: stat[1] for func, stat in outer_stats.items()}
+        self.assertEqual(fib_calls["fib"], 177)
+        fib_calls = {func[2]: stat[1] for func, stat in inner_stats.items()}
+        self.assertEqual(fib_calls["fib"], 465)
+
+
+class TestProfilingProcessApplications(TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+        os.environ.pop("PROFILE_DIR", None)
+
+    def test_profiling_window(self):
+        system = BankAccountSystem(infrastructure_class=PopoApplication)
+        with SingleThreadedRunner(system) as runner:
+            accounts = runner.get(Accounts)
+            commands = runner.get(Commands)
+            account_id = accounts.create_account()
+            with profiling(
+                accounts, runner.get(Sagas), output_dir=self.output_dir
+            ) as paths:
+                for _ in range(10):
+                    commands.deposit_funds(account_id, Decimal("1.00"))
+            self.assertIsNone(accounts.profiler)
+
+        self.assertEqual(len(paths), 4)
+        accounts_stats = pstats.Stats(paths[0])
+        functions = {func[2] for func in accounts_stats.stats}
+        self.assertIn("call_policy", functions)
+        self.assertIn("mutate", functions)
+        self.assertIn("__trigger_event__", functions)
+        self.assertIn("get_event_from_notification", functions)
+
+    def test_profile_dir_environment_variable(self):
+        os.environ["PROFILE_DIR"] = self.output_dir
+        system = BankAccountSystem(infrastructure_class=PopoApplication)
+        with SingleThreadedRunner(system) as runner:
+            account_id = runner.get(Accounts).create_account()
+            runner.get(Commands).deposit_funds(account_id, Decimal("1.00"))
+
+        pid = os.getpid()
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)),
+            [
+                "accounts-{}.folded".format(pid),
+                "accounts-{}.pstats".format(pid),
+                "sagas-{}.folded".format(pid),
+                "sagas-{}.pstats".format(pid),
+            ],
+        )
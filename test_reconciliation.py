@@ -0,0 +1,197 @@
+import os
+import tempfile
+from decimal import Decimal
+from unittest import TestCase
+
+from eventsourcing.application.popo import PopoApplication
+from eventsourcing.application.sqlalchemy import SQLAlchemyApplication
+
+from bankaccounts.onboarding import AccountSpec
+from bankaccounts.reconciliation import MISSING, Mismatch, Reconciler, view_lookup
+from bankaccounts.simpleapplication import SimpleBankAccountApplication
+from bankaccounts.system.views import AccountStatus, AccountStatusView
+
+
+class TestReconciler(TestCase):
+    infrastructure_class = PopoApplication
+
+    def construct_app(self):
+        return SimpleBankAccountApplication.mixin(self.infrastructure_class)()
+
+    def setUp(self):
+        self.app = self.construct_app()
+        self.account_ids = []
+        for i in range(20):
+            account_id = self.app.create_account()
+            self.app.deposit_funds(account_id, Decimal("10.00") * (i + 1))
+            self.account_ids.append(account_id)
+        self.app.set_overdraft_limit(self.account_ids[0], Decimal("50.00"))
+        self.app.close_account(self.account_ids[1])
+        self.app.transfer_funds(self.account_ids[2], self.account_ids[3], Decimal("5"))
+
+        # A projection of the accounts, as a dict of statuses.
+        self.projection = {}
+        for account_id in self.account_ids:
+            account = self.app.get_account(account_id)
+            self.projection[account_id] = AccountStatus(
+                version=account.__version__,
+                balance=account.balance,
+                overdraft_limit=account.overdraft_limit,
+                is_closed=account.is_closed,
+            )
+
+    def tearDown(self):
+        self.app.close()
+
+    def lookup(self, account_ids):
+        return {i: self.projection[i] for i in account_ids if i in self.projection}
+
+    def test_full_run_without_mismatches(self):
+        reconciler = Reconciler(self.app, self.lookup, chunk_size=3, page_size=7)
+        report = reconciler.run()
+        self.assertTrue(report.is_ok, report.mismatches)
+        self.assertEqual(report.num_accounts, 20)
+        self.assertEqual(report.num_events, 44)
+        self.assertEqual(report.position, 44)
+        self.assertEqual(reconciler.position, 44)
+        self.assertIn("20 accounts (44 events)", report.summary())
+
+    def test_mismatches(self):
+        account_id1, account_id2, account_id3 = self.account_ids[4:7]
+        self.projection[account_id1] = self.projection[account_id1]._replace(
+            balance=Decimal("1.00")
+        )
+        self.projection[account_id2] = self.projection[account_id2]._replace(
+            is_closed=True, overdraft_limit=Decimal("1.00")
+        )
+        del self.projection[account_id3]
+
+        reconciler = Reconciler(self.app, self.lookup, chunk_size=3)
+        report = reconciler.run()
+        self.assertFalse(report.is_ok)
+        self.assertEqual(report.num_mismatches, 4)
+        self.assertEqual(
+            set(report.mismatches),
+            {
+                Mismatch(account_id1, "balance", Decimal("50.00"), Decimal("1.00")),
+                Mismatch(
+                    account_id2, "overdraft_limit", Decimal("0.00"), Decimal("1.00")
+                ),
+                Mismatch(account_id2, "is_closed", False, True),
+                Mismatch(account_id3, MISSING, None, None),
+            },
+        )
+
+        # Missing accounts can be allowed, and reported mismatches are capped.
+        reconciler = Reconciler(
+            self.app, self.lookup, allow_missing=True, max_mismatches=1
+        )
+        report = reconciler.run()
+        self.assertEqual(report.num_mismatches, 3)
+        self.assertEqual(len(report.mismatches), 1)
+
+    def test_accounts_changed_whilst_reconciling_are_not_reported(self):
+        account_id = self.account_ids[4]
+
+        def lookup(account_ids):
+            # The account and the projection are updated after the position.
+            if account_id in account_ids and self.app.get_balance(account_id) == 50:
+                self.app.deposit_funds(account_id, Decimal("1.00"))
+                self.projection[account_id] = self.projection[account_id]._replace(
+                    balance=Decimal("51.00")
+                )
+            return self.lookup(account_ids)
+
+        report = Reconciler(self.app, lookup).run()
+        self.assertTrue(report.is_ok, report.mismatches)
+
+    def test_partitions(self):
+        self.projection[self.account_ids[8]] = self.projection[
+            self.account_ids[8]
+        ]._replace(balance=Decimal("0.00"))
+        reconciler = Reconciler(self.app, self.lookup, num_partitions=3, chunk_size=2)
+        report = reconciler.run()
+        self.assertEqual(report.num_accounts, 20)
+        self.assertEqual(report.num_events, 44)
+        self.assertEqual(
+            report.mismatches,
+            [
+                Mismatch(
+                    self.account_ids[8], "balance", Decimal("90.00"), Decimal("0.00")
+                )
+            ],
+        )
+
+    def test_incremental(self):
+        reconciler = Reconciler(self.app, self.lookup)
+        self.assertTrue(reconciler.run(incremental=True).is_ok)
+        self.assertEqual(reconciler.position, 44)
+
+        # Nothing has changed.
+        report = reconciler.run(incremental=True)
+        self.assertTrue(report.is_ok)
+        self.assertEqual(report.num_accounts, 0)
+        self.assertEqual(report.num_events, 0)
+
+        # A change the projection has missed.
+        account_id = self.account_ids[10]
+        self.app.withdraw_funds(account_id, Decimal("10.00"))
+        # A tampered account that hasn't changed isn't checked.
+        self.projection[self.account_ids[11]] = self.projection[
+            self.account_ids[11]
+        ]._replace(balance=Decimal("0.00"))
+
+        report = reconciler.run(incremental=True)
+        self.assertTrue(report.is_incremental)
+        self.assertEqual(report.num_accounts, 1)
+        self.assertEqual(report.num_events, 1)
+        self.assertEqual(
+            report.mismatches,
+            [Mismatch(account_id, "balance", Decimal("100.00"), Decimal("110.00"))],
+        )
+        self.assertEqual(reconciler.position, 45)
+
+        # A full run finds both.
+        self.assertEqual(reconciler.run().num_mismatches, 2)
+
+    def test_bulk_onboarded_accounts(self):
+        self.app.create_accounts(
+            AccountSpec(opening_balance=Decimal(i), overdraft_limit=Decimal(1))
+            for i in range(1, 11)
+        )
+        report = Reconciler(self.app, self.lookup, allow_missing=True).run()
+        self.assertTrue(report.is_ok, report.mismatches)
+        self.assertEqual(report.num_accounts, 30)
+
+    def test_view_lookup(self):
+        view = AccountStatusView(max_accounts=5)
+        for account_id in self.account_ids:
+            view.put(self.app.get_account(account_id))
+        reconciler = Reconciler(self.app, view_lookup(view), allow_missing=True)
+        self.assertTrue(reconciler.run().is_ok)
+
+        # The view hasn't been updated.
+        self.app.deposit_funds(self.account_ids[-1], Decimal("1.00"))
+        report = reconciler.run(incremental=True)
+        self.assertEqual(report.num_mismatches, 1)
+        self.assertEqual(report.mismatches[0].field, "balance")
+
+        # Accounts not in the view aren't mismatches, unless required.
+        reconciler = Reconciler(self.app, view_lookup(view))
+        self.assertEqual(reconciler.run().num_mismatches, 16)
+
+
+class TestReconcilerWithSQLAlchemy(TestReconciler):
+    infrastructure_class = SQLAlchemyApplication
+
+    def construct_app(self):
+        # Accounts are retrieved in threads, which don't share an in-memory database.
+        fd, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        return SimpleBankAccountApplication.mixin(self.infrastructure_class)(
+            uri="sqlite:///" + self.db_path
+        )
+
+    def tearDown(self):
+        super(TestReconcilerWithSQLAlchemy, self).tearDown()
+        os.remove(self.db_path)
@@ -1,5 +1,6 @@
 from decimal import Decimal
 from unittest import TestCase
+from uuid import uuid4
 
 from eventsourcing.application.popo import PopoApplication
 
@@ -7,6 +8,7 @@ from bankaccounts.exceptions import (
     AccountClosedError,
     InsufficientFundsError,
 )
+from bankaccounts.onboarding import AccountSpec
 from bankaccounts.simpleapplication import SimpleBankAccountApplication
 
 
@@ -134,3 +136,27 @@ class TestSimpleBankAccountApplication(TestCase):
                 app.set_overdraft_limit(
                     account_id=account_id1, overdraft_limit=Decimal("500.00")
                 )
+
+    def test_create_accounts(self):
+        with SimpleBankAccountApplication.mixin(PopoApplication)() as app:
+            app: SimpleBankAccountApplication
+            account_ids = [uuid4() for _ in range(5)]
+            specs = (
+                AccountSpec(
+                    account_id,
+                    opening_balance=Decimal(i),
+                    overdraft_limit=Decimal("10.00"),
+                )
+                for i, account_id in enumerate(account_ids)
+            )
+            reports = []
+            report = app.create_accounts(specs, batch_size=2, progress=reports.append)
+            self.assertEqual([r.num_accounts for r in reports], [2, 4, 5])
+            self.assertEqual(report.num_events, 14)
+            self.assertGreater(report.throughput, 0)
+            self.assertEqual(app.get_balance(account_ids[4]), Decimal("4"))
+            self.assertEqual(app.get_overdraft_limit(account_ids[0]), Decimal("10.00"))
+
+            # Opening balances are checked against the overdraft limit.
+            with self.assertRaises(InsufficientFundsError):
+                app.create_accounts([AccountSpec(opening_balance=Decimal("-10.01"))])
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+from collections import Counter
+from contextlib import redirect_stdout
+from decimal import Decimal
+from io import StringIO
+from unittest import TestCase
+
+from eventsourcing.application.popo import PopoApplication
+from eventsourcing.system.runner import SingleThreadedRunner
+
+from bankaccounts.simpleapplication import SimpleBankAccountApplication
+from bankaccounts.system.accounts import Accounts
+from bankaccounts.system.commands import Commands
+from bankaccounts.system.definition import BankAccountSystem
+from bankaccounts.workload import (
+    CREATE,
+    TRANSFER,
+    WorkloadGenerator,
+    load_workload,
+    main,
+    replay_workload,
+    save_workload,
+)
+
+
+class TestWorkloadGenerator(TestCase):
+    def test_generate_is_deterministic(self):
+        operations1 = WorkloadGenerator(num_accounts=10, seed=1).generate(100)
+        operations2 = WorkloadGenerator(num_accounts=10, seed=1).generate(100)
+        operations3 = WorkloadGenerator(num_accounts=10, seed=2).generate(100)
+        self.assertEqual(len(operations1), 110)
+        self.assertEqual(operations1, operations2)
+        self.assertNotEqual(operations1, operations3)
+
+        # Accounts are created first.
+        self.assertEqual([o.kind for o in operations1[:10]], [CREATE] * 10)
+        self.assertNotIn(CREATE, [o.kind for o in operations1[10:]])
+
+        # Transfers are between different accounts.
+        for operation in operations1:
+            if operation.kind == TRANSFER:
+                self.assertNotEqual(operation.account, operation.other_account)
+
+    def test_account_activity_is_skewed(self):
+        generator = WorkloadGenerator(num_accounts=100, zipf_exponent=1.2, seed=1)
+        counts = Counter(o.account for o in generator.generate(10000)[100:])
+        hottest = generator.ranked_accounts[0]
+        coldest = generator.ranked_accounts[-1]
+        self.assertEqual(counts.most_common(1)[0][0], hottest)
+        self.assertGreater(counts[hottest], 10 * counts[coldest])
+
+    def test_overdraft_rate(self):
+        generator = WorkloadGenerator(num_accounts=10, overdraft_rate=1.0, seed=1)
+        for operation in generator.generate(100)[10:]:
+            if operation.kind == TRANSFER:
+                self.assertGreater(operation.amount, Decimal("100.00"))
+
+    def test_save_and_load(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "workload.jsonl")
+            operations = WorkloadGenerator(num_accounts=10, seed=1).generate(100)
+            save_workload(operations, path)
+            self.assertEqual(load_workload(path), operations)
+
+            # Generate with the command line interface.
+            path2 = os.path.join(tmpdir, "workload2.jsonl")
+            main(["generate", path2, "--accounts", "10", "--operations", "100"])
+            self.assertEqual(len(load_workload(path2)), 110)
+
+            # A command is required.
+            with self.assertRaises(SystemExit):
+                main([])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestReplayWorkload(TestCase):
+    def test_replay_simple_application(self):
+        operations = WorkloadGenerator(num_accounts=10, seed=1).generate(200)
+        app_class = SimpleBankAccountApplication.mixin(PopoApplication)
+        with app_class() as app:
+            result = replay_workload(operations, app)
+        self.assertEqual(result.num_operations, 210)
+        self.assertGreater(sum(result.errors.values()), 0)
+        self.assertGreater(result.throughput, 0)
+        self.assertLessEqual(result.percentile(50), result.percentile(99))
+        self.assertIn("210 operations", result.summary())
+
+        # Replay is deterministic.
+        with app_class() as app:
+            result2 = replay_workload(operations, app)
+        self.assertEqual(result.errors, result2.errors)
+
+    def test_replay_system(self):
+        operations = WorkloadGenerator(num_accounts=5, seed=1).generate(50)
+        system = BankAccountSystem(infrastructure_class=PopoApplication)
+        with SingleThreadedRunner(system) as runner:
+            result = replay_workload(
+                operations,
+                accounts=runner.get(Accounts),
+                commands=runner.get(Commands),
+            )
+        self.assertEqual(result.num_operations, 55)
+
+    def test_replay_system_with_ray(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "workload.jsonl")
+            operations = WorkloadGenerator(num_accounts=5, seed=1).generate(20)
+            save_workload(operations, path)
+            output = StringIO()
+            with redirect_stdout(output):
+                main(["replay", path, "--system", "--runner", "ray"])
+            self.assertIn("25 operations", output.getvalue())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_replay_at_rate(self):
+        operations = WorkloadGenerator(num_accounts=5, seed=1).generate(15)
+        app_class = SimpleBankAccountApplication.mixin(PopoApplication)
+        with app_class() as app:
+            result = replay_workload(operations, app, rate=100)
+        self.assertGreaterEqual(result.elapsed, 0.19)